@@ -6,11 +6,26 @@ script and using the --generate option.
 
 The config file is a standard INI file that contains [sections] and options.
 
-Variables that are between %(option)s are interpolated automatically by the
-ConfigParser (with the caveat that they have to be in the same section).
+The configuration is built in layers, each one overrides the previous ones:
+1. DEFAULTS.
+2. The config file.
+3. The environment variables STX_<SECTION>__<OPTION> (e.g.
+    STX_GENERAL__LOG_PATH=/tmp/run), the section is matched ignoring the case.
+4. The overrides of the command line (e.g. main.py --config general:LOG_PATH=x)
+The result is an immutable Snapshot. A run activates its own snapshot, which
+is exported in the STX_CONFIG_SNAPSHOT environment variable, so the robot
+libraries and the child processes of the run load that snapshot instead of
+reading the config file, and the config file is never written.
+
+Variables that are between %(option)s are interpolated with the value of the
+option of the same section (like the ConfigParser does).
 Variables that are between ${section:option} will be interpolated with the
 value from the appropriate section (similar to the way ConfigParse from
-Python3 works).
+Python3 works). The references are followed transitively and the whole
+config file is interpolated once when it is loaded (a cyclic reference raises
+InterpolationCycleError when the option is gotten), the config file is only
+read again by reload_if_changed() if it changed (and no snapshot of a run is
+active).
 
 Example of a config file:
 
@@ -31,53 +46,363 @@ To access config values from other modules follow this approach:
 
 import Config.config as CONF
 full_name = CONF.get('section2', 'fullname')
+CONF.reload_if_changed()
+
+To run with a snapshot of the configuration:
+
+snapshot = CONF.build(overrides=[('general', 'LOG_PATH', output_dir)])
+CONF.activate(snapshot)
 """
 
 from __future__ import print_function
 
 import argparse
 import configparser
+import json
 import os
 import re
 
 
 CONFIG_FILE = os.path.join(os.path.dirname(__file__), 'config.ini')
-CONFIG = configparser.SafeConfigParser()
-CONFIG.read(CONFIG_FILE)
+
+# values used when they are not in the config file
+DEFAULTS = {
+    'general': {'LOG_PATH': '/tmp/logs'},
+}
+
+# prefix of the environment variables that override options, the section and
+# the option are separated by two underscores
+ENVIRONMENT_PREFIX = 'STX_'
+ENVIRONMENT_SEPARATOR = '__'
+# environment variable with the active snapshot (json)
+SNAPSHOT_VARIABLE = 'STX_CONFIG_SNAPSHOT'
+
+# %% (escaped %), %(option)s (same section) and ${section:option} or
+# ${option} (same section) references
+REFERENCE = re.compile(r'%%|%\(([^)]*)\)s|\$\{([^}]*)\}')
+
+# the snapshot used by get(), and the (mtime, size) of the config file it was
+# built from (None if it is the snapshot of a run)
+_SNAPSHOT = None
+_STAMP = None
+
+
+class InterpolationCycleError(configparser.InterpolationError):
+    """An option references itself through other options"""
+
+    def __init__(self, option, section, chain):
+        configparser.InterpolationError.__init__(
+            self, option, section,
+            'Cyclic reference in option {0!r} of section {1!r}: {2}'.format(
+                option, section, ' -> '.join(
+                    '{0}:{1}'.format(*key) for key in chain)))
+
+
+def _optionxform(option):
+    """Normalize an option name (the options are case insensitive)"""
+    return option.lower()
+
+
+class _Resolver(object):
+    """Interpolate the options of a configuration, following the references
+
+    :param raw: a dictionary with the sections as keys and dictionaries with
+        the (normalized) options and their raw values as values
+    :param variables: a dictionary with values that override the options
+        of any section (like the vars argument of ConfigParser.get)
+    """
+
+    __slots__ = ('raw_values', 'variables', 'values', 'chain')
+
+    def __init__(self, raw, variables=None):
+        self.raw_values = raw
+        self.variables = dict(
+            (_optionxform(key), value)
+            for key, value in (variables or {}).items())
+        self.values = {}
+        # the options being resolved, to detect the cycles
+        self.chain = []
+
+    def raw(self, section, option):
+        """Get the raw value of an option
+
+        :raises: NoSectionError or NoOptionError
+        """
+        if option in self.variables:
+            return self.variables[option]
+        if section not in self.raw_values:
+            raise configparser.NoSectionError(section)
+        if option not in self.raw_values[section]:
+            raise configparser.NoOptionError(option, section)
+        return self.raw_values[section][option]
+
+    def resolve(self, section, option):
+        """Get the interpolated value of an option
+
+        :raises: NoSectionError, NoOptionError or InterpolationError
+        """
+        option = _optionxform(option)
+        key = (section, option)
+        if key in self.values:
+            return self.values[key]
+        if key in self.chain:
+            raise InterpolationCycleError(
+                option, section,
+                self.chain[self.chain.index(key):] + [key])
+
+        self.chain.append(key)
+        try:
+            value = REFERENCE.sub(
+                lambda match: self._reference(section, option, match),
+                self.raw(section, option))
+        finally:
+            self.chain.pop()
+        self.values[key] = value
+        return value
+
+    def _reference(self, section, option, match):
+        """Get the value of a reference found in an option"""
+        local, foreign = match.groups()
+        if local is None and foreign is None:
+            return '%'
+        if foreign is not None:
+            target = foreign.split(':', 1)
+            target_section, target_option = (
+                target if len(target) == 2 else (section, target[0]))
+        else:
+            target_section, target_option = section, local
+        try:
+            return self.resolve(target_section, target_option)
+        except (configparser.NoSectionError, configparser.NoOptionError):
+            raise configparser.InterpolationMissingOptionError(
+                option, section, self.raw(section, option),
+                match.group(0))
+
+
+class Snapshot(object):
+    """An immutable configuration, with all its options interpolated
+
+    :param raw: a dictionary with the sections as keys and dictionaries with
+        the options and their raw values as values
+    """
+
+    __slots__ = ('_raw', '_values')
+
+    def __init__(self, raw):
+        raw = dict(
+            (section, dict((_optionxform(option), value)
+                           for option, value in options.items()))
+            for section, options in raw.items())
+        object.__setattr__(self, '_raw', raw)
+        object.__setattr__(self, '_values', interpolate(raw))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('the configuration snapshot is immutable')
+
+    def __reduce__(self):
+        return Snapshot, (self._raw,)
+
+    def to_json(self):
+        """Serialize the snapshot (only the raw values are serialized)"""
+        return json.dumps(self._raw, separators=(',', ':'), sort_keys=True)
+
+    @classmethod
+    def from_json(cls, text):
+        """Create a snapshot from its serialized form (see to_json)"""
+        return cls(json.loads(text))
+
+    def sections(self):
+        """Get the list of sections"""
+        return sorted(self._raw)
+
+    def options(self, section):
+        """Get the list of options of a section"""
+        if section not in self._raw:
+            raise configparser.NoSectionError(section)
+        return sorted(self._raw[section])
+
+    def get(self, section, option, raw=False, variables=None):
+        """Get an interpolated value
+
+        :param section: the section where the option to be gotten is
+        :param option: the option to look for
+        :param raw: the raw value is returned (without interpolations)
+        :param variables: the option is looked up in variables (if provided)
+        :return: the value of the option
+        """
+        resolver = _Resolver(self._raw, variables)
+        if raw:
+            return resolver.raw(section, _optionxform(option))
+        if variables:
+            return resolver.resolve(section, option)
+
+        try:
+            value = self._values[(section, _optionxform(option))]
+        except KeyError:
+            # raises the NoSectionError/NoOptionError of ConfigParser
+            return resolver.resolve(section, option)
+        if isinstance(value, configparser.Error):
+            raise value
+        return value
+
+    def getint(self, section, option):
+        """Get a value as an integer"""
+        return int(self.get(section, option))
+
+    def getfloat(self, section, option):
+        """Get a value as a float"""
+        return float(self.get(section, option))
+
+    def getboolean(self, section, option):
+        """Get a value as a boolean (true, yes, on and 1 are True)"""
+        return configparser.RawConfigParser.BOOLEAN_STATES.get(
+            self.get(section, option).lower(), False)
+
+
+def _stamp(path):
+    """Get the (mtime, size) of a file, None if it does not exist"""
+    try:
+        status = os.stat(path)
+    except OSError:
+        return None
+    return status.st_mtime, status.st_size
+
+
+def interpolate(raw):
+    """Interpolate all the options of a configuration
+
+    :param raw: a dictionary with the sections as keys and dictionaries with
+        the (normalized) options and their raw values as values
+    :return: a dictionary with the interpolated values by (section, option),
+        the options that can not be interpolated have the error as value
+    """
+    resolver = _Resolver(raw)
+    values = {}
+    for section, options in raw.items():
+        for option in options:
+            try:
+                values[(section, option)] = resolver.resolve(section, option)
+            except configparser.InterpolationError as error:
+                values[(section, option)] = error
+    return values
+
+
+def parse_override(text):
+    """Parse an override of the command line
+
+    :param text: the override as section:option=value
+    :return: a (section, option, value) tuple
+    :raises: ValueError if the override does not have that format
+    """
+    key, separator, value = text.partition('=')
+    section, _, option = key.partition(':')
+    if not separator or not section.strip() or not option.strip():
+        raise ValueError(
+            '{}: the override must be section:option=value'.format(text))
+    return section.strip(), option.strip(), value
+
+
+def _section(raw, name):
+    """Get the name of an existing section ignoring the case"""
+    for section in raw:
+        if section.lower() == name.lower():
+            return section
+    return name.lower()
+
+
+def build(path=None, environ=None, overrides=()):
+    """Build a snapshot with all the configuration layers
+
+    :param path: the path of the config file, CONFIG_FILE by default
+    :param environ: the environment variables, os.environ by default
+    :param overrides: a list of (section, option, value) tuples (see
+        parse_override), the last ones win
+    :return: the Snapshot object
+    """
+    parser = configparser.RawConfigParser()
+    parser.optionxform = _optionxform
+    parser.read_dict(DEFAULTS)
+    parser.read(path or CONFIG_FILE)
+    raw = dict((section, dict((option, parser.get(section, option, raw=True))
+                              for option in parser.options(section)))
+               for section in parser.sections())
+
+    environ = os.environ if environ is None else environ
+    for name, value in sorted(environ.items()):
+        if not name.startswith(ENVIRONMENT_PREFIX):
+            continue
+        section, separator, option = name[len(ENVIRONMENT_PREFIX):].partition(
+            ENVIRONMENT_SEPARATOR)
+        if separator and section and option:
+            raw.setdefault(_section(raw, section), {})[
+                _optionxform(option)] = value
+
+    for section, option, value in overrides:
+        raw.setdefault(_section(raw, section), {})[
+            _optionxform(option)] = value
+
+    return Snapshot(raw)
+
+
+def activate(snapshot):
+    """Use a snapshot in this process and its child processes
+
+    :param snapshot: the Snapshot object
+    """
+    global _SNAPSHOT, _STAMP
+    _SNAPSHOT, _STAMP = snapshot, None
+    os.environ[SNAPSHOT_VARIABLE] = snapshot.to_json()
+
+
+def current():
+    """Get the snapshot used by this process"""
+    return _SNAPSHOT
+
+
+def load(path=None):
+    """Load the snapshot of the run, or build it from the config file
+
+    :param path: the path of the config file, CONFIG_FILE by default
+    """
+    global _SNAPSHOT, _STAMP
+    if os.environ.get(SNAPSHOT_VARIABLE):
+        _SNAPSHOT, _STAMP = Snapshot.from_json(
+            os.environ[SNAPSHOT_VARIABLE]), None
+        return
+    stamp = _stamp(path or CONFIG_FILE)
+    _SNAPSHOT, _STAMP = build(path), stamp
+
+
+def reload_if_changed(path=None):
+    """Read the config file again only if it changed since it was loaded
+
+    :param path: the path of the config file, CONFIG_FILE by default
+    :return: True if the config file was read again, False otherwise (also
+        when the snapshot of a run is active)
+    """
+    if os.environ.get(SNAPSHOT_VARIABLE) or (
+            _stamp(path or CONFIG_FILE) == _STAMP):
+        return False
+    load(path)
+    return True
 
 
 def get(section, option, raw=False, variables=None):
-    """Wrapper function to mimic behavior of ConfigParse (Python3).
-
-    Python3 uses a ConfigParse that is different than the Python2 ConfigParser,
-    it has some additional functionality. One of the biggest differences is
-    that with ConfigParse you can interpolate variables from one section into
-    another section of the config file. This functionality is not included in
-    the ConfigParse. Since it is very useful, this function wraps the original
-    get function from ConfigParser so it includes the missing interpolation.
+    """Get an interpolated value of the configuration.
+
+    Options can be interpolated with the %(option)s references of
+    ConfigParser (same section) and also with the ${section:option}
+    references of the Python3 ExtendedInterpolation, the references are
+    followed transitively. All the options are interpolated when the
+    snapshot is built, so a lookup is a dictionary access.
     :param section: the section where the option to be gotten is
     :param option: the option to look for in the config file
-    :param raw: all the '%' interpolations are expanded in the return values,
+    :param raw: all the interpolations are expanded in the return values,
         unless the raw argument is true.
     :param variables: the option is looked up in variables (if provided)
     :return: the specified value from the config file
     """
-    original_option = CONFIG.get(section, option, raw=raw, vars=variables)
-    # find all matches that have the following pattern: ${something}
-    matches = re.findall(r'\$\{(.*?)\}', original_option)
-    new_value = original_option
-    for match in matches:
-        # interpolate matches found with ${something} with the referenced
-        # option from the appropriate section
-        pattern = '${' + match + '}'
-        value = match.split(':')
-        foreign_value = CONFIG.get(value[0], value[1])
-        new_value = new_value.replace(pattern, foreign_value)
-    if original_option != new_value:
-        CONFIG.set(section, option, new_value)
-
-    # return the interpolated value
-    return CONFIG.get(section, option, raw=raw, vars=variables)
+    return _SNAPSHOT.get(section, option, raw=raw, variables=variables)
 
 
 def getint(section, option):
@@ -87,7 +412,7 @@ def getint(section, option):
     :param option: the option to look for in the config file
     :return: the specified value from the config file
     """
-    return int(CONFIG.get(section, option))
+    return _SNAPSHOT.getint(section, option)
 
 
 def getfloat(section, option):
@@ -97,7 +422,7 @@ def getfloat(section, option):
     :param option: the option to look for in the config file
     :return: the specified value from the config file
     """
-    return float(CONFIG.get(section, option))
+    return _SNAPSHOT.getfloat(section, option)
 
 
 def getboolean(section, option):
@@ -105,26 +430,21 @@ def getboolean(section, option):
 
     :param section: the section where the option to be gotten is
     :param option: the option to look for in the config file
-    :return: the specified value from the config file
+    :return: the specified value from the config file, the values accepted
+        by ConfigParser as true (true, yes, on, 1) are True
     """
-    value = CONFIG.get(section, option)
-    return value.lower() == 'true'
-
-
-def _unload_current_values():
-    """Removes current sections from the existing config object"""
-    for section in CONFIG.sections():
-        CONFIG.remove_section(section)
+    return _SNAPSHOT.getboolean(section, option)
 
 
 def create_config():
     """Creates the config file in the current directory"""
     if os.path.isfile(CONFIG_FILE):
         os.remove(CONFIG_FILE)
-    with open(CONFIG_FILE, 'wb') as configfile:
-        _unload_current_values()
-        defaults.load_defaults(CONFIG)
-        CONFIG.write(configfile)
+    parser = configparser.RawConfigParser()
+    parser.optionxform = str
+    parser.read_dict(DEFAULTS)
+    with open(CONFIG_FILE, 'w') as configfile:
+        parser.write(configfile)
 
 
 def parse_arguments():
@@ -137,6 +457,9 @@ def parse_arguments():
     return parser.parse_args()
 
 
+load()
+
+
 if __name__ == '__main__':
     ARGUMENTS = parse_arguments()
     if ARGUMENTS.generate:
@@ -1,7 +1,5 @@
-from imp import reload
 import os
 import getpass
-import subprocess
 import pexpect
 
 import psutil
@@ -9,15 +7,20 @@ import psutil
 from Config import config
 from Libraries import common
 from Utils import logger
+from Utils import proctable
+from Utils import tracing
+from Utils import wait
 
-# reloading config.ini
-reload(config)
+# reading config.ini again only if it changed since it was loaded
+config.reload_if_changed()
 
 # Global variables
 THIS_PATH = os.path.dirname(os.path.abspath(__file__))
 CURRENT_USER = getpass.getuser()
 PASSWORD = config.get('credentials', 'some_variable')
 PROMPT = '$'
+# seconds to wait for a process to exit after terminating it
+TERMINATE_TIMEOUT = 5
 
 # setup the logger
 LOG_FILENAME = 'iso_setup.log'
@@ -36,6 +39,7 @@ class Installer(object):
             LOG_PATH), 'wb')
 
     @staticmethod
+    @tracing.traced('installer.open_xterm_console')
     def open_xterm_console():
         """Open a xterm console to visualize logs from serial connection"""
 
@@ -47,25 +51,33 @@ class Installer(object):
         command = 'python {suite}/Utils/watcher.py {log_path}'.format(
             suite=suite_path, log_path=LOG_PATH)
 
-        try:
-            pid_list = subprocess.check_output(['pidof', terminal]).split()
+        pid_list = [process.pid for process in proctable.find(name=terminal)]
+        if not pid_list:
+            LOG.info('There is not process for : {}'.format(terminal))
 
-            # killing all xterm active sessions
-            for pid in pid_list:
-                _pid = psutil.Process(int(pid))
+        # killing all xterm active sessions
+        for pid in pid_list:
+            try:
+                _pid = psutil.Process(pid)
                 # terminate the process
                 _pid.terminate()
-
-                if _pid.is_running():
+            except psutil.NoSuchProcess:
+                continue
+
+        for pid in pid_list:
+            try:
+                wait.wait_for_process_exit(pid, timeout=TERMINATE_TIMEOUT)
+            except wait.WaitTimeout:
+                try:
                     # forces the process to terminate
-                    _pid.suspend()
-                    _pid.resume()
-        except subprocess.CalledProcessError:
-            LOG.info('There is not process for : {}'.format(terminal))
+                    psutil.Process(pid).kill()
+                except psutil.NoSuchProcess:
+                    pass
 
         os.system('{term} -geometry {geo} -T {title} -e {cmd} &'.format(
             term=terminal, geo=geometry, title=terminal_title, cmd=command))
 
+    @tracing.traced('installer.boot_installer')
     def boot_installer(self):
         boot_timeout = int(config.get('installer', 'BOOT_TIMEOUT'))
         self.child.expect('Escape character')
@@ -88,6 +100,7 @@ class Installer(object):
         self.child.expect('Performing post-installation setup tasks')
         LOG.info('Performing post-installation setup tasks')
 
+    @tracing.traced('installer.first_login')
     def first_login(self):
         """Change the password at first login"""
 
@@ -108,6 +121,7 @@ class Installer(object):
         self.child.expect('$')
         LOG.info('the password was changed successfully')
 
+    @tracing.traced('installer.configure_temp_network')
     def configure_temp_network(self):
         """Setup a temporal IP"""
 
@@ -136,6 +150,7 @@ class Installer(object):
         self.child.expect('1 packets transmitted')
         LOG.info('Ping successful')
 
+    @tracing.traced('installer.config')
     def config(self, config_file):
 
         config_timeout = int(config.get(
@@ -154,6 +169,7 @@ class Installer(object):
         LOG.info('Closing the log')
 
 
+@tracing.traced('installer.install')
 def install():
     install_obj = Installer()
     install_obj.open_xterm_console()
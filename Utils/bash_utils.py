@@ -9,15 +9,45 @@ The functions that belong to this package are the ones that meet this criteria:
 - This module should only include functions that are not related with a
 specific application.
 
+The commands run in persistent shell sessions (see ShellSession) instead of
+starting a new bash process for each one, several commands can be submitted
+at once with run_batch. The commands with a timeout run in a new bash process
+with its own process group (so they can not ask for a password).
+
+Example:
+
+from Utils import bash_utils as bash
+code, output = bash.run_command('sudo virsh list --all')
+code, output = bash.run_command('ping -c 3 10.10.10.2', timeout=60)
+for result in bash.run_batch(['sudo test -d /opt', 'sudo test -f /etc/x']):
+    print(result.command, result.returncode)
+
 Note: Since a lot of functions in this package need to run a in a shell, this
 package should most of the times only be used in Linux.
 """
 
 from __future__ import print_function
 
+import atexit
 import os
-import re
+import select
+import signal
 import subprocess
+import sys
+import threading
+import time
+import uuid
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+try:
+    from Utils import proctable
+except ImportError:
+    # Utils is in sys.path (see Utils/utils.py)
+    import proctable
 
 # Defines a color schema for messages.
 PURPLE = '\033[95m'
@@ -33,6 +63,29 @@ UNDERLINE = '\033[4m'
 DEFAULT = '\033[99m'
 END = '\033[0m'
 
+# set STX_PERSISTENT_SHELL=0 to run every command in a new bash process
+PERSISTENT_SHELL = os.environ.get('STX_PERSISTENT_SHELL', '1') != '0'
+
+# the maximum number of idle shell sessions kept for the next commands
+MAX_IDLE_SESSIONS = 8
+
+# the exit code of the commands that time out (the same one used by timeout)
+TIMEOUT_CODE = 124
+
+READ_SIZE = 65536
+
+_monotonic = getattr(time, 'monotonic', time.time)
+
+# the commands with a timeout run in their own process group (so they can be
+# killed with their children), the other ones keep the terminal of the
+# process (e.g. sudo can ask for the password). Python 2 can only do it with
+# preexec_fn, which is not safe with threads, so it kills only the shell.
+NEW_GROUP = sys.version_info[0] >= 3
+
+# idle shell sessions
+_SESSIONS = []
+_SESSIONS_LOCK = threading.Lock()
+
 # --------------------------------------------------------
 # Functions for printing formatted messages in the console
 # --------------------------------------------------------
@@ -96,26 +149,346 @@ def load_openrc_env_variables():
 # -------------------------------------------
 
 
-def run_command(command, raise_exception=False):
+class CommandResult(object):
+    """The result of a shell command
+
+    :param command: the command executed
+    :param returncode: the exit code of the command (TIMEOUT_CODE if it was
+        killed because it timed out)
+    :param output: the standard output of the command (without leading and
+        trailing spaces)
+    :param error: the standard error of the command (without leading and
+        trailing spaces)
+    :param elapsed: the time the command took in seconds
+    """
+
+    __slots__ = ('command', 'returncode', 'output', 'error', 'elapsed')
+
+    def __init__(self, command, returncode, output, error, elapsed):
+        self.command = command
+        self.returncode = returncode
+        self.output = output
+        self.error = error
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return 'CommandResult({0!r}, returncode={1})'.format(
+            self.command, self.returncode)
+
+
+def _to_bytes(value):
+    """Encode an string as utf-8 (if it is not already encoded)"""
+    return value if isinstance(value, bytes) else value.encode('utf-8')
+
+
+def _collect(process, deadline=None, stream=None, marker=None):
+    """Read the output of a command from the pipes of a process
+
+    :param process: the subprocess.Popen object, its stdout and stderr must be
+        pipes
+    :param deadline: the monotonic time when the command times out (if any)
+    :param stream: a callable that receives each line of the standard output
+        as soon as it is read (if any)
+    :param marker: the marker that ends the output of the command in both
+        pipes, if it is not set the output is read until the process closes
+        the pipes
+    :return: a tuple with the exit code (None if it is the exit code of the
+        process or TIMEOUT_CODE if the command timed out), the standard output
+        and the standard error
+    """
+    buffers = {process.stdout.fileno(): b'', process.stderr.fileno(): b''}
+    finished = {}
+    streamed = 0
+    returncode = None
+    stdout = process.stdout.fileno()
+
+    while len(finished) < len(buffers):
+        timeout = None
+        if deadline is not None:
+            timeout = deadline - _monotonic()
+            if timeout <= 0:
+                returncode = TIMEOUT_CODE
+                break
+        pending = [fd for fd in buffers if fd not in finished]
+        readable, _, _ = select.select(pending, [], [], timeout)
+        for fd in readable:
+            data = os.read(fd, READ_SIZE)
+            buffers[fd] += data
+            if not data:
+                # the pipe was closed (e.g. the shell died)
+                finished[fd] = len(buffers[fd])
+            elif marker is not None:
+                position = buffers[fd].find(marker)
+                if position != -1:
+                    finished[fd] = position
+
+        if stream is not None:
+            # only complete lines are streamed until the command finishes
+            end = finished.get(stdout)
+            if end is None:
+                end = buffers[stdout].rfind(b'\n') + 1
+            for line in buffers[stdout][streamed:end].splitlines():
+                stream(line.decode('utf-8', 'replace'))
+            streamed = max(streamed, end)
+
+    output = buffers[stdout]
+    error = buffers[process.stderr.fileno()]
+    if marker is not None and returncode is None:
+        if stdout in finished and output.find(marker) != -1:
+            try:
+                returncode = int(output[finished[stdout] + len(marker):]
+                                 .split(b'\n', 1)[0])
+            except ValueError:
+                returncode = None
+    output = output[:finished.get(stdout, len(output))]
+    error = error[:finished.get(process.stderr.fileno(), len(error))]
+
+    return returncode, output.strip(), error.strip()
+
+
+class ShellSession(object):
+    """A persistent bash process that runs many commands over its pipes
+
+    Every command is sent to the shell through its standard input and runs in
+    a subshell (so a command can not change the directory, the variables or
+    exit the session), its output is read until a unique marker that the
+    session prints after the command. Running a command in the session only
+    costs a fork of the shell instead of starting a new bash process.
+
+    The shell keeps the controlling terminal of the python process (e.g. sudo
+    can ask for the password and use its cached credentials), the commands
+    with a timeout do not run in a session (see execute).
+
+    The session is bound to the working directory and environment variables
+    of the python process when it was started (see is_current).
+    """
+
+    __slots__ = ('process', 'marker', 'context')
+
+    def __init__(self):
+        self.marker = '__stx_shell_{}__'.format(uuid.uuid4().hex)
+        self.context = _context()
+        self.process = subprocess.Popen(
+            ['/bin/bash'], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, close_fds=True)
+
+    def is_alive(self):
+        """Checks if the shell is still running"""
+        return self.process.poll() is None
+
+    def is_current(self):
+        """Checks if the session can still be used to run commands
+
+        :return: False if the shell died or the working directory or the
+            environment variables of the python process changed since the
+            session was started
+        """
+        return self.is_alive() and self.context == _context()
+
+    def run(self, command, stream=None):
+        """Run a command in the session
+
+        :param command: the command to be executed
+        :param stream: a callable that receives each line of the standard
+            output as soon as it is read
+        :return: the CommandResult object
+        """
+        start = _monotonic()
+        # the command is passed quoted to eval so any syntax error in the
+        # command does not break the session
+        script = ('( eval {command} ) </dev/null\n'
+                  'printf \'{marker}%d\\n\' $?\n'
+                  'printf \'{marker}\\n\' >&2\n').format(
+                      command=quote(command), marker=self.marker)
+
+        try:
+            self.process.stdin.write(_to_bytes(script))
+            self.process.stdin.flush()
+        except (IOError, OSError) as err:
+            self.close()
+            return CommandResult(command, 1, b'', _to_bytes(str(err)),
+                                 _monotonic() - start)
+
+        returncode, output, error = _collect(
+            self.process, None, stream, _to_bytes(self.marker))
+
+        if returncode is None:
+            # the shell died while the command was running
+            self.close()
+            returncode = self.process.returncode or 1
+
+        return CommandResult(command, returncode, output, error,
+                             _monotonic() - start)
+
+    def close(self):
+        """Terminate the shell and any command still running in it"""
+        if self.is_alive():
+            try:
+                self.process.kill()
+            except OSError:
+                pass
+        for pipe in (self.process.stdin, self.process.stdout,
+                     self.process.stderr):
+            try:
+                pipe.close()
+            except (IOError, OSError):
+                pass
+        self.process.wait()
+
+
+def _context():
+    """Get the context the shell sessions are bound to"""
+    return os.getcwd(), sorted(os.environ.items())
+
+
+def _acquire_session():
+    """Get an idle shell session (a new one if there are not idle sessions)
+
+    :return: the ShellSession object or None if a session can not be started
+    """
+    with _SESSIONS_LOCK:
+        while _SESSIONS:
+            session = _SESSIONS.pop()
+            if session.is_current():
+                return session
+            session.close()
+    try:
+        return ShellSession()
+    except (IOError, OSError):
+        return None
+
+
+def _release_session(session):
+    """Return a shell session to the idle sessions"""
+    if session.is_alive():
+        with _SESSIONS_LOCK:
+            if len(_SESSIONS) < MAX_IDLE_SESSIONS:
+                _SESSIONS.append(session)
+                return
+    session.close()
+
+
+def close_sessions():
+    """Terminate all the idle shell sessions"""
+    with _SESSIONS_LOCK:
+        sessions = list(_SESSIONS)
+        del _SESSIONS[:]
+    for session in sessions:
+        session.close()
+
+
+atexit.register(close_sessions)
+
+
+def _run_subprocess(command, timeout=None, stream=None):
+    """Run a command in a new bash process
+
+    When the command has a timeout, it runs in a new process group (see
+    NEW_GROUP) so it is killed with its children.
+
+    :return: the CommandResult object
+    """
+    start = _monotonic()
+    deadline = start + timeout if timeout is not None else None
+    options = {}
+    if timeout is not None and NEW_GROUP:
+        options['start_new_session'] = True
+    proc = subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True,
+        executable='/bin/bash', **options)
+    returncode, output, error = _collect(proc, deadline, stream)
+
+    if returncode == TIMEOUT_CODE:
+        try:
+            if options:
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                proc.kill()
+        except OSError:
+            pass
+        error = error or _to_bytes('timed out after {}s'.format(timeout))
+    proc.wait()
+
+    return CommandResult(command, returncode or proc.returncode, output,
+                         error, _monotonic() - start)
+
+
+def execute(command, timeout=None, stream=None):
+    """Runs a shell command in the host.
+
+    The command runs in one of the persistent shell sessions (see
+    ShellSession), or in a new bash process if it has a timeout or if
+    PERSISTENT_SHELL is disabled.
+
+    :param command: the command to be executed
+    :param timeout: the maximum time in seconds the command can take
+    :param stream: a callable that receives each line of the standard output
+        as soon as it is read
+    :return: the CommandResult object
+    """
+    session = (_acquire_session() if PERSISTENT_SHELL and timeout is None
+               else None)
+    if session is None:
+        return _run_subprocess(command, timeout, stream)
+
+    try:
+        return session.run(command, stream)
+    finally:
+        _release_session(session)
+
+
+def run_batch(commands, timeout=None, stop_on_error=False):
+    """Runs a list of shell commands in the same shell session.
+
+    :param commands: the list of commands to be executed, in order
+    :param timeout: the maximum time in seconds each command can take
+    :param stop_on_error: if True the commands after the first command that
+        fails are not executed
+    :return: a list with the CommandResult object of each command executed
+    """
+    results = []
+    session = (_acquire_session() if PERSISTENT_SHELL and timeout is None
+               else None)
+
+    try:
+        for command in commands:
+            if session is not None and not session.is_alive():
+                # the shell died while running the previous command
+                session = _acquire_session()
+            if session is None:
+                result = _run_subprocess(command, timeout)
+            else:
+                result = session.run(command)
+            results.append(result)
+            if stop_on_error and result.returncode != 0:
+                break
+    finally:
+        if session is not None:
+            _release_session(session)
+
+    return results
+
+
+def run_command(command, raise_exception=False, timeout=None, stream=None):
     """Runs a shell command in the host.
 
     :param command: the command to be executed
     :param raise_exception: if is setup as True it will raise a exception if
         the command was not executed correctly
+    :param timeout: the maximum time in seconds the command can take, the
+        command is killed after it (see TIMEOUT_CODE)
+    :param stream: a callable that receives each line of the standard output
+        as soon as it is read (e.g. print)
     :return: a tuple that contains the exit code of the command executed,
     and the output message of the command.
     """
-    proc = subprocess.Popen(
-        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True,
-        executable='/bin/bash')
-    output, error = proc.communicate()
-    output = output.strip() if output else output
-    error = error.strip() if error else error
+    result = execute(command, timeout=timeout, stream=stream)
 
-    if raise_exception and proc.returncode != 0:
-        raise RuntimeError('{}: {}'.format(command, error or output))
+    if raise_exception and result.returncode != 0:
+        raise RuntimeError('{}: {}'.format(
+            command, result.error or result.output))
 
-    return proc.returncode, error or output
+    return result.returncode, result.error or result.output
 
 
 # ---------------------------------------------
@@ -123,23 +496,31 @@ def run_command(command, raise_exception=False):
 # ---------------------------------------------
 
 
-def is_process_running(process, pid_to_exclude=''):
+def is_process_running(process, pid_to_exclude='', ttl=0):
     """Checks if a process is running.
 
+    The process table is read in-process (see Utils/proctable.py), no command
+    is executed.
+
     :param process: the process to check. This can either be a PID or the
-    command used to start the process
+    command used to start the process (a regular expression searched in the
+    command line of the processes)
     :param pid_to_exclude: int values are accepted only. If this param is set,
-    this function will exclude the pid on this variable.
+    this function will exclude the pid on this variable. A list of PIDs is
+    also accepted.
+    :param ttl: the maximum age in seconds of the process table snapshot
+    used, useful to call this function in a loop (see proctable.processes)
     :return:
         True: if the process is still running.
         False: if the process has finished (was not found)
     """
-    ps_aux = subprocess.Popen(['ps', 'axw'], stdout=subprocess.PIPE)
-    for element in ps_aux.stdout:
-        if re.search(process, element.decode('utf-8')):
-            pid = int(element.split()[0])
-            if pid_to_exclude and pid == pid_to_exclude:
-                continue
-            else:
-                return True
-    return False
+    if not pid_to_exclude:
+        exclude = ()
+    elif isinstance(pid_to_exclude, (list, tuple, set)):
+        exclude = pid_to_exclude
+    else:
+        exclude = (pid_to_exclude,)
+
+    if isinstance(process, int) or str(process).isdigit():
+        return proctable.is_running(pid=process, exclude=exclude, ttl=ttl)
+    return proctable.is_running(pattern=process, exclude=exclude, ttl=ttl)
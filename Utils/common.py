@@ -3,46 +3,56 @@
 from __future__ import print_function
 
 import configparser
+import csv
 import datetime
 import errno
+import fnmatch
+import json
 import os
+import sys
 
-from robot.api import TestData
+from Utils import suite_index
+from Utils.tags import TagFilter
+
+# output formats of list_suites
+TEXT_FORMAT = 'text'
+JSON_FORMAT = 'json'
+CSV_FORMAT = 'csv'
+OUTPUT_FORMATS = (TEXT_FORMAT, JSON_FORMAT, CSV_FORMAT)
+
+# kinds of entries of the suite tree
+SUITE_ENTRY = 'suite'
+TEST_ENTRY = 'test'
 
 
 class Suite(object):
     """Implement a series of suite attributes
 
     To define properties of a suite recognized by robot-framework.
+    The suite is looked up in the suite index (see Utils/suite_index.py),
+    the robot data of the suite is only parsed when it is used.
 
     """
 
     def __init__(self, name, main_suite_path):
         self.name = name
-        self.main_suite = TestData(source=main_suite_path)
-        self.path = self.__get_suite_path(self.main_suite)
-        try:
-            self.data = TestData(source=self.path)
-        except TypeError as err:
+        self.main_suite_path = main_suite_path
+        self.index = suite_index.load(main_suite_path)
+        self.node = self.index.find(name)
+        if self.node is None:
             print('ERROR: Suite {0} not found'.format(self.name))
-            raise err
-
-    def __get_suite_path(self, main_suite):
-        """Return path of an specific test suite
+            raise TypeError('{}: suite not found'.format(self.name))
+        self.path = self.node.source
+        self._data = None
 
-           Args:
-               main_suite = main suite test Data
-           Returns:
-               found_path = path of the suite found
-
-        """
-
-        if main_suite.name == self.name:
-            return main_suite.source
-        for child in main_suite.children:
-            found_path = self.__get_suite_path(child)
-            if found_path:
-                return found_path
+    @property
+    def data(self):
+        """Robot test data of the suite (parsed on first use)"""
+        if self._data is None:
+            # robot is only imported when the test data is needed
+            from robot.api import TestData
+            self._data = TestData(source=self.path)
+        return self._data
 
 
 def get_config():
@@ -119,21 +129,186 @@ def link_latest_run(suite_dir, out_dir):
     return latest_run
 
 
-def list_suites(suite, tree_format):
+class TreeEntry(object):
+    """Implement an entry of the suite tree listing
+
+    To describe a suite or a test case found while walking the suite tree.
+
+    """
+
+    __slots__ = ('kind', 'name', 'longname', 'depth', 'tags', 'source')
+
+    def __init__(self, kind, name, longname, depth, tags=(), source=None):
+        self.kind = kind
+        self.name = name
+        self.longname = longname
+        self.depth = depth
+        self.tags = list(tags)
+        self.source = source
+
+    def as_dict(self):
+        """Return the entry as a dictionary (for the json output)"""
+        entry = {'type': self.kind, 'name': self.name,
+                 'longname': self.longname, 'depth': self.depth}
+        if self.kind == SUITE_ENTRY:
+            entry['source'] = self.source
+        else:
+            entry['tags'] = self.tags
+        return entry
+
+
+def _test_matches(test, longname, tag_filter, name):
+    """Check if a test case matches the listing filters"""
+    if name and not (fnmatch.fnmatchcase(test.name.lower(), name) or
+                     fnmatch.fnmatchcase(longname.lower(), name)):
+        return False
+    return tag_filter.match(test.tags)
+
+
+def walk_suites(suite, tags=None, name=None, max_depth=None):
+    """Walk the suite tree without recursion, yielding its entries
+
+       Args:
+           suite = Suite node where the walk starts (see
+                   Utils/suite_index.py)
+           tags = List of tag patterns (see Utils/tags.py), only the test
+                  cases that match any of them are listed
+           name = Glob of the test case names (or long names) to list
+           max_depth = Deepest level to list (0 is the suite itself)
+       Returns:
+           entries = Generator of TreeEntry objects in tree order, when
+                     there are filters a suite is only listed if it has
+                     matching test cases
+    """
+    tag_filter = TagFilter(tags)
+    name = name.lower() if name else None
+    filtering = bool(tag_filter or name)
+
+    # suites not listed yet because no matching test case was found yet,
+    # they are always the ancestors of the current suite
+    pending = []
+    stack = [(suite, 0)]
+
+    while stack:
+        node, depth = stack.pop()
+        while pending and pending[-1].depth >= depth:
+            pending.pop()
+        if max_depth is not None and depth > max_depth:
+            continue
+
+        pending.append(TreeEntry(SUITE_ENTRY, node.name, node.longname,
+                                 depth, source=node.source))
+        if not filtering:
+            for entry in pending:
+                yield entry
+            del pending[:]
+
+        if max_depth is None or depth < max_depth:
+            for test in node.tests:
+                longname = '{0}.{1}'.format(node.longname, test.name)
+                if not _test_matches(test, longname, tag_filter, name):
+                    continue
+                for entry in pending:
+                    yield entry
+                del pending[:]
+                yield TreeEntry(TEST_ENTRY, test.name, longname, depth + 1,
+                                tags=test.tags)
+
+        stack.extend((child, depth + 1) for child in reversed(node.children))
+
+
+def _has_init_file(folder):
+    """Check if a suite folder has an __init__ file (suite settings)"""
+    return any(os.path.splitext(name)[0] == suite_index.INIT_FILE and
+               os.path.splitext(name)[1].lower() in
+               suite_index.SUITE_EXTENSIONS for name in os.listdir(folder))
+
+
+def select_suites(suite, tags):
+    """Select the sub-suites with test cases that match the tags
+
+    Uses the tags of the suite index, so the suites are not parsed with
+    robot. A folder with an __init__ file is selected as a whole (robot
+    filters its test cases with --include), so its suite setup and
+    teardown still run, and so is a folder where all the test cases match.
+    The suites are selected by their long names (robot --suite option), so
+    the suite runs from its own path and the long names of its sub-suites
+    and test cases are the same ones of a run without tags (see
+    Utils/durations.py).
+
+       Args:
+           suite = Suite node (see Utils/suite_index.py)
+           tags = List of tag patterns (see Utils/tags.py)
+       Returns:
+           suites = List of long names of the suites to run, relative to
+                    the suite (it starts with the suite name)
+           selected = Number of test cases that match the tags
+    """
+    tag_filter = TagFilter(tags)
+    # the suites, selected tests and total tests of the visited suites
+    results = {}
+    stack = [(suite, suite.name, False)]
+
+    while stack:
+        node, longname, visited = stack.pop()
+        if not visited:
+            stack.append((node, longname, True))
+            stack.extend((child, '{0}.{1}'.format(longname, child.name),
+                          False) for child in node.children)
+            continue
+
+        selected = sum(1 for test in node.tests if tag_filter.match(test.tags))
+        total = len(node.tests)
+        suites = [longname] if selected else []
+        for child in node.children:
+            child_suites, child_selected, child_total = results.pop(
+                child.source)
+            suites.extend(child_suites)
+            selected += child_selected
+            total += child_total
+        if selected and node.children and (
+                selected == total or _has_init_file(node.source)):
+            suites = [longname]
+        results[node.source] = (suites, selected, total)
+
+    return results[suite.source][:2]
+
+
+def list_suites(suite, tree_format='', output_format=TEXT_FORMAT, tags=None,
+                name=None, max_depth=None, stream=None):
     """Print in a readable format the list of suites and test cases
 
        Args:
-           suite = Specific suite data
+           suite = Specific suite node (see Utils/suite_index.py)
            tree_format = format to be displayed on stdout
+           output_format = text, json (one object per line) or csv
+           tags = List of tag patterns to filter the test cases
+           name = Glob of the test case names to list
+           max_depth = Deepest level to list (0 is the suite itself)
+           stream = File where the list is written (stdout by default)
 
     """
-
-    print('[S] {}{}'.format(tree_format, suite.name))
-    if suite.testcase_table.tests:
-        tree_format += '.....'
-        for test in suite.testcase_table:
-            print('(T) {}{}'.format(tree_format, test.name))
+    stream = stream or sys.stdout
+    entries = walk_suites(suite, tags=tags, name=name, max_depth=max_depth)
+
+    if output_format == JSON_FORMAT:
+        for entry in entries:
+            stream.write(json.dumps(entry.as_dict()) + '\n')
+    elif output_format == CSV_FORMAT:
+        writer = csv.writer(stream)
+        writer.writerow(['type', 'depth', 'longname', 'name', 'tags',
+                         'source'])
+        for entry in entries:
+            writer.writerow([entry.kind, entry.depth, entry.longname,
+                             entry.name, ','.join(entry.tags),
+                             entry.source or ''])
+    elif output_format == TEXT_FORMAT:
+        for entry in entries:
+            if entry.kind == SUITE_ENTRY:
+                stream.write('[S] {0}{1}{2}\n'.format(
+                    tree_format, '....|' * entry.depth, entry.name))
+            else:
+                stream.write('(T) {0}{1}.....{2}\n'.format(
+                    tree_format, '....|' * (entry.depth - 1), entry.name))
     else:
-        tree_format += '....|'
-    for child in suite.children:
-        list_suites(child, tree_format)
+        raise ValueError('{}: invalid output format'.format(output_format))
@@ -0,0 +1,287 @@
+"""Keep a history of the suite/test durations and balance the shards with it
+
+The durations of the suites and test cases are taken from the output.xml of
+the past runs under Results/ and kept in a compact json file
+(Results/durations.json) with the long name of each suite/test as key and
+the moving average of its duration in seconds as value. The long name of the
+parent suite of each entry is kept too, the suite/test names may contain
+dots so it can not be taken from the long name. The output.xml of a run is
+only parsed once, the runs already parsed are recorded in the same file.
+
+The shards of a parallel run (see Utils/sharding.py) are scheduled with the
+longest processing time first rule: the shards are sorted by their expected
+duration (the longest first) and each one is assigned to the worker that
+becomes free first. The process pool dispatches the shards in that order, so
+the long suites do not start at the end of the run while the rest of the
+workers are idle.
+
+Example:
+
+from Utils import durations
+history = durations.update_from_results('Results')
+plan = durations.schedule(shards, history, workers=4)
+durations.print_schedule(plan)
+"""
+
+from __future__ import print_function
+
+import datetime
+import heapq
+import json
+import os
+import tempfile
+import xml.etree.ElementTree as ElementTree
+
+HISTORY_FILE = 'durations.json'
+
+# the history is rebuilt from the results when its format changes
+HISTORY_VERSION = 2
+
+# weight of the last duration in the moving average
+SMOOTHING = 0.5
+
+# expected duration in seconds of the suites/tests without history
+DEFAULT_DURATION = 60.0
+
+TIME_FORMAT = '%Y%m%d %H:%M:%S.%f'
+
+
+class Schedule(object):
+    """The assignment of the shards to the workers
+
+    Args:
+        order = List of shards in the order they have to be dispatched
+        workers = List with the shards assigned to each worker
+        loads = List with the expected time each worker is busy
+        estimates = Dictionary with the expected duration of each shard name
+    """
+
+    __slots__ = ('order', 'workers', 'loads', 'estimates')
+
+    def __init__(self, order, workers, loads, estimates):
+        self.order = order
+        self.workers = workers
+        self.loads = loads
+        self.estimates = estimates
+
+    @property
+    def makespan(self):
+        """Expected wall time of the run in seconds"""
+        return max(self.loads) if self.loads else 0.0
+
+
+def status_elapsed(status):
+    """Return the seconds of a status element of output.xml (or None)"""
+    if status.get('elapsed') is not None:
+        # robot framework 7 format
+        return float(status.get('elapsed'))
+    try:
+        start = datetime.datetime.strptime(
+            status.get('starttime'), TIME_FORMAT)
+        end = datetime.datetime.strptime(status.get('endtime'), TIME_FORMAT)
+    except (TypeError, ValueError):
+        return None
+    return (end - start).total_seconds()
+
+
+def parse_output(path):
+    """Return the durations of the suites and test cases of an output.xml
+
+       Args:
+           path = Path of the output.xml file
+       Returns:
+           durations = Dictionary with the long names as keys and the
+                       durations in seconds as values
+           parents = Dictionary with the long names as keys and the long
+                     name of the parent suite as values (None for the top
+                     suite)
+    """
+    durations = {}
+    parents = {}
+    # names of the suites/tests that contain the current element
+    names = []
+    tags = []
+
+    for event, element in ElementTree.iterparse(path, ('start', 'end')):
+        if event == 'start':
+            tags.append(element.tag)
+            if element.tag in ('suite', 'test'):
+                names.append(element.get('name'))
+            continue
+
+        tags.pop()
+        if element.tag == 'status' and tags and tags[-1] in (
+                'suite', 'test'):
+            elapsed = status_elapsed(element)
+            if elapsed is not None:
+                longname = '.'.join(names)
+                durations[longname] = elapsed
+                parents[longname] = '.'.join(names[:-1]) or None
+        elif element.tag in ('suite', 'test'):
+            names.pop()
+            element.clear()
+
+    return durations, parents
+
+
+def load_history(path):
+    """Load the durations history
+
+       Args:
+           path = Path of the history file
+       Returns:
+           history = Dictionary with the durations and the parents (see
+                     parse_output) in the durations and parents keys and the
+                     parsed runs in the runs key
+    """
+    try:
+        with open(path) as history_file:
+            history = json.load(history_file)
+    except (IOError, OSError, ValueError):
+        history = {}
+    if history.get('version') != HISTORY_VERSION:
+        history = {'version': HISTORY_VERSION}
+    history.setdefault('durations', {})
+    history.setdefault('parents', {})
+    history.setdefault('runs', [])
+    return history
+
+
+def save_history(path, history):
+    """Save the durations history atomically
+
+       Args:
+           path = Path of the history file
+           history = History dictionary (see load_history)
+    """
+    file_descriptor, temporary = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    with os.fdopen(file_descriptor, 'w') as history_file:
+        json.dump(history, history_file, separators=(',', ':'),
+                  sort_keys=True)
+    os.rename(temporary, path)
+
+
+def record(history, durations, parents):
+    """Add the durations of a run to the history (moving average)
+
+       Args:
+           history = History dictionary (see load_history)
+           durations = Durations of the run (see parse_output)
+           parents = Parents of the suites/tests of the run (see
+                     parse_output)
+    """
+    history['parents'].update(parents)
+    known = history['durations']
+    for name, elapsed in durations.items():
+        if name in known:
+            elapsed = SMOOTHING * elapsed + (1 - SMOOTHING) * known[name]
+        known[name] = round(elapsed, 3)
+
+
+def update_from_results(results_dir):
+    """Add the runs of the results directory that are not in the history
+
+       Args:
+           results_dir = Results directory (each run in a sub-directory)
+       Returns:
+           history = Updated history dictionary (see load_history)
+    """
+    path = os.path.join(results_dir, HISTORY_FILE)
+    history = load_history(path)
+    parsed = set(history['runs'])
+    changed = False
+
+    runs = sorted(name for name in os.listdir(results_dir)
+                  if os.path.isfile(os.path.join(
+                      results_dir, name, 'output.xml')))
+    for run in runs:
+        if run in parsed:
+            continue
+        try:
+            record(history, *parse_output(
+                os.path.join(results_dir, run, 'output.xml')))
+        except ElementTree.ParseError:
+            # the run was interrupted before robot wrote the whole file
+            continue
+        parsed.add(run)
+        changed = True
+
+    if changed:
+        # only the runs that still exist are kept in the history
+        history['runs'] = sorted(parsed.intersection(runs))
+        save_history(path, history)
+    return history
+
+
+def estimate(name, history):
+    """Return the expected duration of a suite or test case
+
+       Args:
+           name = Long name of the suite/test
+           history = History dictionary (see load_history)
+       Returns:
+           duration = Expected seconds, the sum of its tests if the suite
+                      was never run as a whole, DEFAULT_DURATION if it is
+                      unknown
+    """
+    known = history['durations']
+    if name in known:
+        return known[name]
+    parents = history['parents']
+    parts = [elapsed for key, elapsed in known.items()
+             if parents.get(key) == name]
+    return sum(parts) if parts else DEFAULT_DURATION
+
+
+def schedule(shards, history, workers):
+    """Assign the shards to the workers (longest processing time first)
+
+       Args:
+           shards = List of Shard objects (see Utils/sharding.py)
+           history = History dictionary (see load_history)
+           workers = Number of parallel workers
+       Returns:
+           schedule = Schedule object
+    """
+    estimates = dict((shard.name, estimate(shard.name, history))
+                     for shard in shards)
+    order = sorted(shards, key=lambda shard: (-estimates[shard.name],
+                                              shard.index))
+
+    workers = max(1, min(workers, len(shards)))
+    assigned = [[] for _ in range(workers)]
+    loads = [0.0] * workers
+    # the worker that becomes free first takes the next shard
+    free = [(0.0, worker) for worker in range(workers)]
+    for shard in order:
+        load, worker = heapq.heappop(free)
+        assigned[worker].append(shard)
+        loads[worker] = load + estimates[shard.name]
+        heapq.heappush(free, (loads[worker], worker))
+
+    return Schedule(order, assigned, loads, estimates)
+
+
+def _format(seconds):
+    """Format seconds as 1h:02m:03s"""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{0}h:{1:02d}m:{2:02d}s'.format(hours, minutes, seconds)
+
+
+def print_schedule(plan):
+    """Print the schedule of a parallel run
+
+       Args:
+           plan = Schedule object
+    """
+    total = sum(plan.estimates.values())
+    print('=== SCHEDULE ===')
+    for worker, (shards, load) in enumerate(zip(plan.workers, plan.loads)):
+        print('worker {0}: {1}'.format(worker, _format(load)))
+        for shard in shards:
+            print('    {0} ({1})'.format(
+                shard.name, _format(plan.estimates[shard.name])))
+    print('serial time: {0}, predicted makespan: {1}'.format(
+        _format(total), _format(plan.makespan)))
@@ -0,0 +1,333 @@
+"""Probe the capacity of the host.
+
+The resources available in the host are read in-process from /proc and
+/sys (no command is executed) and returned in a single HostSnapshot object:
+- memory: total and available memory from /proc/meminfo.
+- hugepages: total and free pages of each page size.
+- cpus: the CPUs the current process is allowed to run on
+    (sched_getaffinity).
+- cgroup limits: the CPU quota and the memory limit of the cgroup of the
+    current process (cgroup v1 and v2).
+- NUMA nodes: the CPUs, memory and hugepages of each NUMA node.
+- disks: the free space of the mount point of the requested paths.
+
+All the memory values are in MiB and the disk values in GiB (the same units
+used for the memory and partitions of the nodes in hipervisor/setup.yml).
+
+Example:
+
+from Utils import host
+snapshot = host.snapshot(paths=['/var/lib/libvirt/images'])
+print(snapshot.usable_memory, snapshot.usable_cpus)
+"""
+
+import glob
+import math
+import multiprocessing
+import os
+import re
+
+MEBIBYTE = 1024 ** 2
+GIBIBYTE = 1024 ** 3
+
+# any cgroup limit greater than this value means that there is no limit
+UNLIMITED = 2 ** 62
+
+
+def _read(path):
+    """Read a small file from /proc or /sys
+
+    :return: the content of the file without trailing spaces or None if it
+        can not be read
+    """
+    try:
+        with open(path) as proc_file:
+            return proc_file.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _read_int(path, default=None):
+    """Read a file that contains an integer"""
+    value = _read(path)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_cpu_list(cpu_list):
+    """Parse a CPU list in the kernel format (e.g. 0-3,8,10-11)
+
+    :param cpu_list: the CPU list as an string
+    :return: a sorted list of CPU ids
+    """
+    cpus = set()
+    for item in (cpu_list or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if '-' in item:
+            first, last = item.split('-', 1)
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(item))
+    return sorted(cpus)
+
+
+def meminfo(path='/proc/meminfo'):
+    """Read a meminfo file
+
+    :param path: the path of the meminfo file (the NUMA nodes have their own
+        meminfo file with a 'Node N' prefix in each line)
+    :return: a dictionary with the fields of the file in kB (or in number of
+        pages for the hugepages fields)
+    """
+    fields = {}
+    for line in (_read(path) or '').splitlines():
+        match = re.match(r'^(?:Node \d+ )?([\w()]+):\s+(\d+)', line)
+        if match:
+            fields[match.group(1)] = int(match.group(2))
+    return fields
+
+
+def hugepages(path='/sys/kernel/mm/hugepages'):
+    """Get the hugepages of the host (or of a NUMA node)
+
+    :param path: the hugepages folder in sysfs
+    :return: a dictionary with the page size in kB as keys and a dictionary
+        with the total and free pages as values
+    """
+    pages = {}
+    for folder in glob.glob(os.path.join(path, 'hugepages-*kB')):
+        size = int(re.search(r'hugepages-(\d+)kB', folder).group(1))
+        pages[size] = {
+            'total': _read_int(os.path.join(folder, 'nr_hugepages'), 0),
+            'free': _read_int(os.path.join(folder, 'free_hugepages'), 0)}
+    return pages
+
+
+def affinity():
+    """Get the CPUs the current process is allowed to run on
+
+    :return: a sorted list of CPU ids
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(multiprocessing.cpu_count()))
+
+
+def _cgroup_paths(path='/proc/self/cgroup'):
+    """Get the cgroup of the current process for each controller
+
+    :return: a dictionary with the controller as key ('' for cgroup v2) and
+        the path of the cgroup as value
+    """
+    paths = {}
+    for line in (_read(path) or '').splitlines():
+        parts = line.split(':', 2)
+        if len(parts) != 3:
+            continue
+        for controller in parts[1].split(','):
+            paths[controller] = parts[2]
+    return paths
+
+
+def cgroup_limits(root='/sys/fs/cgroup'):
+    """Get the CPU and memory limits of the cgroup of the current process
+
+    :param root: the mount point of the cgroup filesystem
+    :return: a tuple with the CPU limit (number of CPUs, it can be a
+        fraction) and the memory limit in MiB, None means no limit
+    """
+    paths = _cgroup_paths()
+    cpu_limit, memory_limit = None, None
+
+    cgroup_v2 = os.path.exists(os.path.join(root, 'cgroup.controllers'))
+    if '' in paths and cgroup_v2:
+        folder = os.path.join(root, paths[''].lstrip('/'))
+        cpu_max = (_read(os.path.join(folder, 'cpu.max')) or 'max').split()
+        if cpu_max[0] != 'max' and len(cpu_max) == 2:
+            cpu_limit = float(cpu_max[0]) / float(cpu_max[1])
+        memory_max = _read(os.path.join(folder, 'memory.max'))
+        if memory_max and memory_max != 'max':
+            memory_limit = int(memory_max) // MEBIBYTE
+        return cpu_limit, memory_limit
+
+    # cgroup v1
+    for controller in ('cpu', 'cpu,cpuacct'):
+        folder = os.path.join(
+            root, controller, paths.get('cpu', '/').lstrip('/'))
+        quota = _read_int(os.path.join(folder, 'cpu.cfs_quota_us'))
+        period = _read_int(os.path.join(folder, 'cpu.cfs_period_us'))
+        if quota is not None and period:
+            if quota > 0:
+                cpu_limit = float(quota) / period
+            break
+    folder = os.path.join(
+        root, 'memory', paths.get('memory', '/').lstrip('/'))
+    limit = _read_int(os.path.join(folder, 'memory.limit_in_bytes'))
+    if limit is not None and limit < UNLIMITED:
+        memory_limit = limit // MEBIBYTE
+
+    return cpu_limit, memory_limit
+
+
+class NumaNode(object):
+    """A NUMA node of the host
+
+    :param node_id: the id of the NUMA node
+    :param cpus: the list of CPU ids of the node
+    :param memory_total: the total memory of the node in MiB
+    :param memory_free: the free memory of the node in MiB
+    :param hugepages: the hugepages of the node (see hugepages function)
+    """
+
+    __slots__ = ('node_id', 'cpus', 'memory_total', 'memory_free',
+                 'hugepages')
+
+    def __init__(self, node_id, cpus, memory_total, memory_free, hugepages):
+        self.node_id = node_id
+        self.cpus = cpus
+        self.memory_total = memory_total
+        self.memory_free = memory_free
+        self.hugepages = hugepages
+
+    def __repr__(self):
+        return 'NumaNode({0}, cpus={1}, memory_free={2})'.format(
+            self.node_id, len(self.cpus), self.memory_free)
+
+
+def numa_nodes(path='/sys/devices/system/node', allowed_cpus=None):
+    """Get the NUMA nodes of the host
+
+    :param path: the NUMA nodes folder in sysfs
+    :param allowed_cpus: if set, only these CPUs are listed in the nodes
+    :return: a list of NumaNode objects, a single node with all the CPUs and
+        memory is returned if the host does not expose NUMA information
+    """
+    nodes = []
+    for folder in sorted(glob.glob(os.path.join(path, 'node[0-9]*')),
+                         key=lambda name: int(re.search(
+                             r'node(\d+)$', name).group(1))):
+        cpus = parse_cpu_list(_read(os.path.join(folder, 'cpulist')))
+        if allowed_cpus is not None:
+            cpus = [cpu for cpu in cpus if cpu in allowed_cpus]
+        info = meminfo(os.path.join(folder, 'meminfo'))
+        nodes.append(NumaNode(
+            int(re.search(r'node(\d+)$', folder).group(1)), cpus,
+            info.get('MemTotal', 0) // 1024, info.get('MemFree', 0) // 1024,
+            hugepages(os.path.join(folder, 'hugepages'))))
+
+    if not nodes:
+        info = meminfo()
+        cpus = affinity() if allowed_cpus is None else sorted(allowed_cpus)
+        nodes.append(NumaNode(
+            0, cpus, info.get('MemTotal', 0) // 1024,
+            info.get('MemFree', 0) // 1024, hugepages()))
+
+    return nodes
+
+
+def mount_point(path):
+    """Get the mount point of a path
+
+    :param path: an existing path
+    :return: the mount point where the path is stored
+    """
+    path = os.path.realpath(path)
+    while not os.path.ismount(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def disk_free(path):
+    """Get the free space of the filesystem of a path
+
+    :param path: an existing path
+    :return: the free space available for unprivileged users in GiB
+    """
+    statvfs = os.statvfs(path)
+    return float(statvfs.f_frsize * statvfs.f_bavail) / GIBIBYTE
+
+
+class HostSnapshot(object):
+    """The resources of the host at a given moment
+
+    :param memory_total: the total memory in MiB
+    :param memory_available: the memory available for new processes in MiB
+    :param memory_limit: the memory limit of the cgroup in MiB (or None)
+    :param hugepages: the hugepages of the host (see hugepages function)
+    :param cpus: the list of CPU ids the process is allowed to run on
+    :param cpu_limit: the CPU quota of the cgroup in CPUs (or None)
+    :param numa_nodes: the list of NumaNode objects
+    :param disks: a dictionary with the mount points as keys and their free
+        space in GiB as values
+    """
+
+    __slots__ = ('memory_total', 'memory_available', 'memory_limit',
+                 'hugepages', 'cpus', 'cpu_limit', 'numa_nodes', 'disks')
+
+    def __init__(self, memory_total, memory_available, memory_limit,
+                 hugepages, cpus, cpu_limit, numa_nodes, disks):
+        self.memory_total = memory_total
+        self.memory_available = memory_available
+        self.memory_limit = memory_limit
+        self.hugepages = hugepages
+        self.cpus = cpus
+        self.cpu_limit = cpu_limit
+        self.numa_nodes = numa_nodes
+        self.disks = disks
+
+    @property
+    def usable_memory(self):
+        """The memory that can be used in MiB (cgroup limit included)"""
+        if self.memory_limit is None:
+            return self.memory_available
+        return min(self.memory_available, self.memory_limit)
+
+    @property
+    def usable_cpus(self):
+        """The number of CPUs that can be used (cgroup limit included)"""
+        if self.cpu_limit is None:
+            return len(self.cpus)
+        return min(len(self.cpus), int(math.ceil(self.cpu_limit)))
+
+    def free_disk(self, path):
+        """Get the free space of the filesystem of a path in GiB
+
+        :param path: an existing path, it should be one of the paths the
+            snapshot was taken for (otherwise it is probed now)
+        """
+        point = mount_point(path)
+        if point not in self.disks:
+            self.disks[point] = disk_free(point)
+        return self.disks[point]
+
+
+def snapshot(paths=('/',)):
+    """Take a snapshot of the resources of the host
+
+    :param paths: the paths whose free disk space is needed
+    :return: the HostSnapshot object
+    """
+    info = meminfo()
+    memory_total = info.get('MemTotal', 0) // 1024
+    if 'MemAvailable' in info:
+        memory_available = info['MemAvailable'] // 1024
+    else:
+        # kernels older than 3.14 do not provide MemAvailable
+        memory_available = (info.get('MemFree', 0) + info.get('Buffers', 0) +
+                            info.get('Cached', 0)) // 1024
+
+    cpus = affinity()
+    cpu_limit, memory_limit = cgroup_limits()
+
+    disks = {}
+    for path in paths:
+        point = mount_point(path)
+        disks[point] = disk_free(point)
+
+    return HostSnapshot(
+        memory_total, memory_available, memory_limit, hugepages(), cpus,
+        cpu_limit, numa_nodes(allowed_cpus=set(cpus)), disks)
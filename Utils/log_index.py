@@ -0,0 +1,217 @@
+"""Query the phases of the structured logs of the past runs
+
+The json lines logs (see Utils/logger.py) of the runs under Results/ are
+indexed in Results/log_index.json: only the records with a duration (the
+phases) are kept, with their run id, node, phase, duration and time. Every
+log file is indexed by its inode together with the offset already read, so
+the next update only reads the lines appended since then (also after the
+file is rotated), and the phases of the runs that were compressed or
+deleted (see Utils/results.py) stay in the index.
+
+Usage:
+
+python Utils/log_index.py --runs 20 --limit 10
+python Utils/log_index.py --runs 5 --phase provision
+
+Example:
+
+from Utils import log_index
+index = log_index.update('Results')
+for entry in log_index.slowest_phases(index, runs=20):
+    print(entry['phase'], entry['duration'])
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+
+INDEX_FILE = 'log_index.json'
+
+# bump it when the content of the index changes
+INDEX_VERSION = 1
+
+# the json logs and their rotated files (e.g. setup.jsonl.1)
+LOG_FILE = re.compile(r'\.jsonl(\.\d+)?$')
+
+# the json lines files of the results directory that are not logs
+IGNORED_FILES = ('index.jsonl', 'startup_benchmark.jsonl')
+
+# the fields of a record kept in the index
+FIELDS = ('run_id', 'node', 'phase', 'duration', 'time', 'logger')
+
+
+def _load(path):
+    """Load a stored index (empty if it can not be used)"""
+    try:
+        with open(path) as index_file:
+            index = json.load(index_file)
+    except (IOError, OSError, ValueError):
+        index = {}
+    if index.get('version') != INDEX_VERSION:
+        index = {'version': INDEX_VERSION, 'files': {}, 'phases': []}
+    return index
+
+
+def _save(path, index):
+    """Store an index atomically"""
+    file_descriptor, temporary = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    with os.fdopen(file_descriptor, 'w') as index_file:
+        json.dump(index, index_file, separators=(',', ':'))
+    os.rename(temporary, path)
+
+
+def _log_files(results_dir):
+    """Find the json logs of the results directory
+
+    :return: a generator of paths
+    """
+    for folder, _, names in os.walk(results_dir):
+        for name in names:
+            if LOG_FILE.search(name) and name not in IGNORED_FILES:
+                yield os.path.join(folder, name)
+
+
+def _read(path, offset):
+    """Read the phases of a log file from an offset
+
+    :param path: the path of the log file
+    :param offset: the position of the file where the reading starts
+    :return: a tuple with the list of phases and the offset after the last
+        complete line
+    """
+    phases = []
+    with open(path, 'rb') as log_file:
+        log_file.seek(offset)
+        for line in log_file:
+            if not line.endswith(b'\n'):
+                # a line that is being written, it is read next time
+                break
+            offset += len(line)
+            if b'"duration"' not in line:
+                continue
+            try:
+                record = json.loads(line.decode('utf-8'))
+            except ValueError:
+                continue
+            phases.append(dict(
+                (field, record.get(field)) for field in FIELDS))
+    return phases, offset
+
+
+def update(results_dir):
+    """Add the new lines of the json logs to the index
+
+    :param results_dir: the results directory
+    :return: the index, a dictionary with the offset of each log file by
+        inode in files and the list of phases in phases
+    """
+    path = os.path.join(results_dir, INDEX_FILE)
+    index = _load(path)
+    changed = False
+    found = set()
+
+    for log_path in _log_files(results_dir):
+        status = os.stat(log_path)
+        key = '{0}:{1}'.format(status.st_dev, status.st_ino)
+        found.add(key)
+        offset = index['files'].get(key, {}).get('offset', 0)
+        if status.st_size < offset:
+            # the inode was reused by another file
+            offset = 0
+        if status.st_size == offset:
+            continue
+        phases, offset = _read(log_path, offset)
+        index['phases'].extend(phases)
+        index['files'][key] = {'path': log_path, 'offset': offset}
+        changed = True
+
+    # the files deleted or compressed, their phases stay in the index
+    for key in set(index['files']) - found:
+        del index['files'][key]
+        changed = True
+
+    if changed:
+        _save(path, index)
+    return index
+
+
+def last_runs(index, runs):
+    """Get the ids of the last runs of the index
+
+    :param index: the index (see update)
+    :param runs: the number of runs
+    :return: a set with the run ids
+    """
+    started = {}
+    for entry in index['phases']:
+        run = entry.get('run_id')
+        if run and (run not in started or entry['time'] < started[run]):
+            started[run] = entry['time']
+    return set(sorted(started, key=started.get)[-runs:])
+
+
+def slowest_phases(index, runs=None, limit=10, phase=None, node=None):
+    """Get the slowest phases of the last runs
+
+    :param index: the index (see update)
+    :param runs: the number of runs (all of them if it is None)
+    :param limit: the maximum number of phases returned
+    :param phase: only the phases with this name are returned
+    :param node: only the phases of this node are returned
+    :return: a list of phases (dictionaries with the FIELDS), the slowest
+        first
+    """
+    selected = last_runs(index, runs) if runs else None
+    phases = [entry for entry in index['phases']
+              if (selected is None or entry.get('run_id') in selected) and
+              (phase is None or entry.get('phase') == phase) and
+              (node is None or entry.get('node') == node)]
+    phases.sort(key=lambda entry: entry['duration'] or 0, reverse=True)
+    return phases[:limit]
+
+
+def print_phases(phases, stream=None):
+    """Print a table of phases
+
+    :param phases: a list of phases (see slowest_phases)
+    :param stream: the file where the table is written (stdout by default)
+    """
+    stream = stream or sys.stdout
+    line = '{0:>10}  {1:<24} {2:<16} {3:<30} {4}\n'
+    stream.write(line.format('DURATION', 'PHASE', 'NODE', 'RUN', 'TIME'))
+    for entry in phases:
+        stream.write(line.format(
+            '{:.2f}s'.format(entry['duration'] or 0), entry['phase'] or '-',
+            entry['node'] or '-', entry['run_id'] or '-',
+            entry['time'] or '-'))
+
+
+def main():
+    """Update the index and print the slowest phases"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--results', default=os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            'Results'),
+        help='Results directory')
+    parser.add_argument('--runs', type=int, default=20,
+                        help='Number of past runs queried')
+    parser.add_argument('--limit', type=int, default=10,
+                        help='Number of phases shown')
+    parser.add_argument('--phase', help='Show only the phases with this name')
+    parser.add_argument('--node', help='Show only the phases of this node')
+    args = parser.parse_args()
+
+    index = update(args.results)
+    print_phases(slowest_phases(index, args.runs, args.limit, args.phase,
+                                args.node))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,80 @@
-"""This module provides common functions to set up and use the logger."""
+"""This module provides common functions to set up and use the logger.
 
+The file handlers created by setup_logging do not write in the thread that
+logs: the records are put in a queue (QueueHandler) and a single background
+thread writes them, so the code that logs (e.g. the console of the installer
+or the execution of commands) does not wait for the disk. The handlers are
+registered once per file, calling setup_logging several times (or from
+several modules) reuses them instead of writing each message several times.
+The console handler writes directly (so the messages are not mixed with the
+output of print) and Python 2 writes all the records directly.
+
+The log files can also be written as json lines (log_format='json' or the
+STX_LOG_FORMAT=json environment variable): <name>.jsonl instead of <name>.log,
+one object per record with the run id (STX_RUN_ID, the same for all the
+processes of a run) and the node, phase and duration of the records logged
+with phase() or with those fields in extra. See Utils/log_index.py to query
+them.
+
+Example:
+
+from Utils import logger
+LOG = logger.setup_logging('setup', log_file='/tmp/logs/setup.log')
+LOG.info('provisioning %s nodes', 3)
+with logger.phase(LOG, 'boot', node='controller-0'):
+    boot()
+logger.flush()
+"""
+
+import contextlib
+import datetime
+import json
 import logging
 import logging.config
 import logging.handlers
 import os
+import threading
+import timeit
+
+try:
+    import queue
+except ImportError:
+    # python 2
+    import Queue as queue
+
+from Utils import yaml_loader
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+MAX_BYTES = 10485760  # Max file size 10 MB (10 x 1024 x 1024)
+BACKUP_COUNT = 10     # Number of rotating files
+LEVELS = ('notset', 'debug', 'info', 'warn', 'error', 'critical')
+
+# formats of the log files
+TEXT_FORMAT = 'text'
+JSON_FORMAT = 'json'
+LOG_FORMATS = (TEXT_FORMAT, JSON_FORMAT)
+FORMAT_VARIABLE = 'STX_LOG_FORMAT'
+JSON_EXTENSION = '.jsonl'
+
+# the run id shared by all the processes of a run
+RUN_ID_VARIABLE = 'STX_RUN_ID'
+# the fields of the records added to the json lines (with extra)
+PHASE_FIELDS = ('node', 'phase', 'duration')
 
-import yaml
+# loggers of the suite modules that also use the handlers of setup_logging
+PACKAGE_LOGGERS = ('Utils', 'Libraries', 'Qemu', 'hipervisor')
+
+# the writer thread needs threading.main_thread to know when to finish
+ASYNC_WRITES = hasattr(threading, 'main_thread')
+
+# seconds the writer thread waits for records before checking if the
+# program is finishing
+POLL_INTERVAL = 0.2
+
+# the handlers already created, by file path (and 'console')
+_HANDLERS = {}
+_HANDLERS_LOCK = threading.Lock()
 
 
 def setup_logging_using_config(name, config_file):
@@ -17,8 +86,9 @@ def setup_logging_using_config(name, config_file):
         logger
     :return: returns the instance of the logger already configured
     """
-    with open(config_file, 'r') as file_manager:
-        config = yaml.safe_load(file_manager.read())
+    # the parsed config file is cached, so calling this function several
+    # times does not parse the file again
+    config = yaml_loader.load(config_file)
     logging.config.dictConfig(config)
 
     # create the logger object
@@ -27,9 +97,237 @@ def setup_logging_using_config(name, config_file):
     return logger
 
 
+class _Writer(object):
+    """The background thread that writes the records of the QueueHandlers
+
+    The thread is started with the first record (and again in a forked
+    process), and it finishes after the main thread once all the records
+    are written.
+    """
+
+    __slots__ = ('queue', 'thread', 'pid', 'lock')
+
+    def __init__(self):
+        self.queue = None
+        self.thread = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def running(self):
+        """Check if the thread of this process is running"""
+        return (self.pid == os.getpid() and self.thread is not None and
+                self.thread.is_alive())
+
+    def put(self, handler, record):
+        """Queue a record to be handled by a handler
+
+        :return: False if the record can not be queued because the program
+            is finishing (the caller has to handle it), True otherwise
+        """
+        if not self.running():
+            with self.lock:
+                if not self.running():
+                    if not threading.main_thread().is_alive():
+                        return False
+                    self.queue = queue.Queue()
+                    self.thread = threading.Thread(
+                        target=self._run, args=(self.queue,),
+                        name='log-writer')
+                    # joined at exit (also in the processes forked by a
+                    # daemon thread, e.g. the workers of a Pool)
+                    self.thread.daemon = False
+                    self.pid = os.getpid()
+                    self.thread.start()
+        self.queue.put((handler, record))
+        return True
+
+    @staticmethod
+    def _run(records):
+        """Write the records until the main thread finishes"""
+        main_thread = threading.main_thread()
+        while True:
+            try:
+                handler, record = records.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if not main_thread.is_alive():
+                    return
+                continue
+            try:
+                handler.handle(record)
+            finally:
+                records.task_done()
+
+    def flush(self):
+        """Wait until all the queued records are written"""
+        if self.running() and threading.current_thread() is not self.thread:
+            self.queue.join()
+
+
+_WRITER = _Writer()
+
+
+class QueueHandler(logging.Handler):
+    """Send the records to a handler through the writer thread
+
+    The message of the record is merged with its arguments when it is
+    queued (the arguments could change later), the rest of the formatting
+    and the write happen in the writer thread. The records below the level
+    of the handler are discarded before any formatting.
+
+    :param target: the handler that writes the records
+    """
+
+    def __init__(self, target):
+        logging.Handler.__init__(self, target.level)
+        self.target = target
+
+    def setLevel(self, level):
+        logging.Handler.setLevel(self, level)
+        self.target.setLevel(level)
+
+    def handle(self, record):
+        # fast path, the loggers already skip the disabled records but the
+        # handler could be called directly
+        if record.levelno < self.level:
+            return False
+        return logging.Handler.handle(self, record)
+
+    def emit(self, record):
+        try:
+            if record.args:
+                record.msg = record.getMessage()
+                record.args = None
+        except Exception:
+            self.handleError(record)
+            return
+        if not _WRITER.put(self.target, record):
+            self.target.handle(record)
+
+    def flush(self):
+        _WRITER.flush()
+        self.target.flush()
+
+
+def flush():
+    """Wait until all the queued log records are written"""
+    _WRITER.flush()
+
+
+def run_id():
+    """Get the id of the current run (STX_RUN_ID)
+
+    If it is not set, an id is created from the time and the process id
+    and exported, so the child processes use the same one.
+    """
+    if not os.environ.get(RUN_ID_VARIABLE):
+        os.environ[RUN_ID_VARIABLE] = '{0:%Y%m%d%H%M%S}-{1}'.format(
+            datetime.datetime.now(), os.getpid())
+    return os.environ[RUN_ID_VARIABLE]
+
+
+class JsonFormatter(logging.Formatter):
+    """Format the records as json objects (one per line)
+
+    The objects have the time, level, logger, run_id and message of the
+    record, the node, phase and duration fields if the record has them
+    (e.g. logger.info('done', extra={'phase': 'boot', 'duration': 2.5}))
+    and the exception (if any).
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(
+                record.created).isoformat(),
+            'level': record.levelname, 'logger': record.name,
+            'run_id': run_id(), 'message': record.getMessage()}
+        for field in PHASE_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, sort_keys=True)
+
+
+@contextlib.contextmanager
+def phase(logger, name, node=None, level=logging.INFO):
+    """Log the duration of a phase (also when it fails)
+
+    :param logger: the logger used to log the phase
+    :param name: the name of the phase
+    :param node: the name of the node of the phase (if any)
+    :param level: the level of the messages
+    """
+    prefix = '{}: '.format(node) if node else ''
+    logger.log(level, '%s%s started', prefix, name,
+               extra={'node': node, 'phase': name})
+    start = timeit.default_timer()
+    status = 'failed'
+    try:
+        yield
+        status = 'done'
+    finally:
+        duration = round(timeit.default_timer() - start, 3)
+        logger.log(level, '%s%s %s (%.2fs)', prefix, name, status, duration,
+                   extra={'node': node, 'phase': name, 'duration': duration})
+
+
+def _registered(key, factory, level, formatter=None):
+    """Get the handler registered for a key, creating it the first time
+
+    :param key: the key of the handler (e.g. the path of the log file)
+    :param factory: a function that creates the handler
+    :param level: the handler level is lowered to it if it is higher
+    :param formatter: the formatter of the handler (the text format by
+        default)
+    :return: the handler
+    """
+    with _HANDLERS_LOCK:
+        handler = _HANDLERS.get(key)
+        if handler is None:
+            handler = factory()
+            handler.setFormatter(
+                formatter or logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+            handler.setLevel(level)
+            if ASYNC_WRITES and key != 'console':
+                handler = QueueHandler(handler)
+            _HANDLERS[key] = handler
+        elif level < handler.level:
+            handler.setLevel(level)
+    return handler
+
+
+def file_handler(log_file, level=logging.INFO, formatter=None):
+    """Get the (queued) rotating file handler of a log file
+
+    :param log_file: the path of the log file
+    :param level: the minimum level of the records written to the file
+    :param formatter: the formatter of the file (the text format by default)
+    :return: the handler, the same one for every call with the same file
+    """
+    log_file = os.path.abspath(log_file)
+
+    def create():
+        # if the path for the log files does not exist, create it
+        if not os.path.exists(os.path.dirname(log_file)):
+            os.makedirs(os.path.dirname(log_file))
+        return logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT)
+
+    return _registered(log_file, create, level, formatter)
+
+
+def console_handler():
+    """Get the console handler (shared by all the loggers)"""
+    return _registered('console', logging.StreamHandler, logging.INFO)
+
+
 def setup_logging(
         name, level='info', log_file='StarlingX.log', root=False,
-        console_log=True):
+        console_log=True, log_format=None):
     """Sets up a logger according to the desired configuration.
 
     :param name: the name of the logger, most of the times this should be the
@@ -45,50 +343,28 @@ def setup_logging(
     :param console_log: if True, the console handler will be added to the
         logger, which means that the log will also be shown in the screen,
         if False the messages will only be logged to files
+    :param log_format: text or json (the log file is written as json lines
+        in <name>.jsonl), STX_LOG_FORMAT or text by default
     :return: returns the instance of the logger already configured
     """
     # Determine the correct log level
-    if level not in ['notset', 'debug', 'info', 'warn', 'error', 'critical']:
+    if level not in LEVELS:
         level = 'info'
     level = getattr(logging, level.upper())
+    log_format = log_format or os.environ.get(FORMAT_VARIABLE, TEXT_FORMAT)
 
-    # create the console handler
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-
-    # if the path for the log files does not exist, create it
-    if len(log_file.rsplit('/', 1)) == 2:
-        log_path = log_file.rsplit('/', 1)[0]
-        if not os.path.exists(log_path):
-            os.makedirs(log_path)
-
-    # Create the file handlers
-    file_handler = logging.handlers.RotatingFileHandler(
-        log_file,
-        maxBytes=10485760,  # Max file size 10 MB (10 x 1024 x 1024)
-        backupCount=10      # Number of rotating files
-        )
-    file_handler.setLevel(level)
-    error_log_file = (
-        '{basename}.error.log'
-        .format(basename=log_file.replace('.log', ''))
-        )
-    error_file_handler = logging.handlers.RotatingFileHandler(
-        error_log_file,
-        maxBytes=10485760,  # Max file size 10 MB (10 x 1024 x 1024)
-        backupCount=10      # Number of rotating files
-        )
-    error_file_handler.setLevel(logging.ERROR)
-
-    # create a formatter
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        '%Y-%m-%d %H:%M:%S')
-
-    # add the formatter to handlers
-    console_handler.setFormatter(formatter)
-    file_handler.setFormatter(formatter)
-    error_file_handler.setFormatter(formatter)
+    # the handlers are created only once per file, so calling this function
+    # several times does not write the messages several times
+    basename = log_file.replace('.log', '')
+    if log_format == JSON_FORMAT:
+        main_handler = file_handler(
+            basename + JSON_EXTENSION, level, JsonFormatter())
+    else:
+        main_handler = file_handler(log_file, level)
+    handlers = [
+        main_handler,
+        file_handler('{basename}.error.log'.format(basename=basename),
+                     logging.ERROR)]
 
     # create the logger object
     if root:
@@ -96,38 +372,27 @@ def setup_logging(
         logger.name = name
     else:
         logger = logging.getLogger(name)
-        # include log messages from Utils/Libraries/Qemu modules (if any)
-        logging.getLogger('Utils').setLevel(level)
-        logging.getLogger('Utils').addHandler(file_handler)
-        logging.getLogger('Utils').addHandler(error_file_handler)
-        logging.getLogger('Libraries').setLevel(level)
-        logging.getLogger('Libraries').addHandler(file_handler)
-        logging.getLogger('Libraries').addHandler(error_file_handler)
-        logging.getLogger('Qemu').setLevel(level)
-        logging.getLogger('Qemu').addHandler(file_handler)
-        logging.getLogger('Qemu').addHandler(error_file_handler)
+        # include log messages from Utils/Libraries/Qemu/hipervisor modules
+        # (if any)
+        for package in PACKAGE_LOGGERS:
+            package_logger = logging.getLogger(package)
+            package_logger.setLevel(level)
+            for handler in handlers:
+                package_logger.addHandler(handler)
         # add the console handler only if enabled
         if console_log:
-            logging.getLogger('Utils').addHandler(console_handler)
-            logging.getLogger('StarlingX').addHandler(console_handler)
+            logging.getLogger('Utils').addHandler(console_handler())
+            logging.getLogger('StarlingX').addHandler(console_handler())
 
     # set logging level
     logger.setLevel(level)
 
-    # if for some reason this setup function is called multiple times
-    # (some applications could do that as a side effect, for example Flask
-    # applications), then we need to restrict how many handlers are added to
-    # the logger. The logger is a singleton, so there can be only one, but
-    # it could have multiple handlers. So if already has a handler(s) (from a
-    # previous call) then just use that/those one(s) and don't add more
-    # handlers.
-    if not logger.handlers:
-        # add handlers to the requester module logger
-        logger.addHandler(file_handler)
-        logger.addHandler(error_file_handler)
-        # add the console handler only if enabled
-        if console_log:
-            logger.addHandler(console_handler)
+    # addHandler ignores the handlers the logger already has
+    for handler in handlers:
+        logger.addHandler(handler)
+    # add the console handler only if enabled
+    if console_log:
+        logger.addHandler(console_handler())
 
     # initialize the log with a long line so it is easier to identify when
     # one log finishes and another one begins.
@@ -1,6 +1,7 @@
 """Provides different network functions"""
 
 import logging
+import os
 from bash import bash
 import subprocess
 
@@ -12,6 +13,15 @@ from pynetlinux import brctl
 LOG = logging.getLogger(__name__)
 
 
+def network_interfaces_exist():
+    """Checks if the network interfaces virbr[1-4] exist
+
+    :return: True if all the network interfaces exist, False otherwise
+    """
+    return all(os.path.exists('/sys/class/net/virbr{}'.format(interface))
+               for interface in range(1, 5))
+
+
 def delete_network_interfaces():
     """Delete network interfaces
 
@@ -0,0 +1,166 @@
+"""Query the process table of the host without running any command.
+
+The processes are read in-process from /proc (psutil is used instead on the
+systems without /proc), so looking for a process does not fork. The
+processes can be matched by:
+- name: the executable name of the process (e.g. virt-manager).
+- pattern: a regular expression searched in the command line of the process.
+- pid: the id of the process.
+and some PIDs can be excluded from the results.
+
+Polling loops can reuse a recent snapshot of the process table with the ttl
+parameter (in seconds), so the process table is read at most once per ttl.
+
+Example:
+
+from Utils import proctable
+if proctable.is_running(name='virt-manager', ttl=1):
+    print(proctable.find(name='virt-manager'))
+"""
+
+import os
+import re
+import threading
+import time
+
+PROC_PATH = '/proc'
+
+_monotonic = getattr(time, 'monotonic', time.time)
+
+# the last snapshot of the process table: (monotonic time, processes)
+_SNAPSHOT = [0, None]
+_SNAPSHOT_LOCK = threading.Lock()
+
+
+class Process(object):
+    """A process of the host
+
+    :param pid: the id of the process
+    :param name: the executable name of the process (truncated to 15
+        characters by the kernel)
+    :param cmdline: the list of arguments of the process (empty for the
+        kernel threads)
+    """
+
+    __slots__ = ('pid', 'name', 'cmdline')
+
+    def __init__(self, pid, name, cmdline):
+        self.pid = pid
+        self.name = name
+        self.cmdline = cmdline
+
+    @property
+    def command(self):
+        """The command line as it is shown by ps (e.g. [kthreadd])"""
+        if not self.cmdline:
+            return '[{}]'.format(self.name)
+        return ' '.join(self.cmdline)
+
+    def __repr__(self):
+        return 'Process({0}, {1!r})'.format(self.pid, self.name)
+
+
+def _read_process(pid, path=PROC_PATH):
+    """Read a process from /proc
+
+    :return: the Process object or None if the process finished
+    """
+    folder = os.path.join(path, str(pid))
+    try:
+        with open(os.path.join(folder, 'comm'), 'rb') as comm:
+            name = comm.read().decode('utf-8', 'replace').strip()
+        with open(os.path.join(folder, 'cmdline'), 'rb') as cmdline:
+            arguments = cmdline.read().decode('utf-8', 'replace')
+    except (IOError, OSError):
+        return None
+    return Process(pid, name, arguments.rstrip('\0').split('\0')
+                   if arguments else [])
+
+
+def _scan(path=PROC_PATH):
+    """Read all the processes of the host
+
+    :return: a list of Process objects
+    """
+    if not os.path.isdir(path):
+        import psutil
+        processes = []
+        for process in psutil.process_iter():
+            try:
+                processes.append(Process(
+                    process.pid, process.name(), process.cmdline()))
+            except psutil.Error:
+                continue
+        return processes
+
+    processes = []
+    for entry in os.listdir(path):
+        if not entry.isdigit():
+            continue
+        process = _read_process(int(entry), path)
+        if process is not None:
+            processes.append(process)
+    return processes
+
+
+def processes(ttl=0):
+    """Get the processes of the host
+
+    :param ttl: the maximum age in seconds of the snapshot of the process
+        table, 0 to always read the process table
+    :return: a list of Process objects
+    """
+    now = _monotonic()
+    if ttl:
+        with _SNAPSHOT_LOCK:
+            taken, snapshot = _SNAPSHOT
+        if snapshot is not None and now - taken <= ttl:
+            return snapshot
+
+    snapshot = _scan()
+    with _SNAPSHOT_LOCK:
+        _SNAPSHOT[:] = [now, snapshot]
+    return snapshot
+
+
+def find(name=None, pattern=None, pid=None, exclude=(), ttl=0):
+    """Find the processes that match all the given criteria
+
+    :param name: the executable name of the process
+    :param pattern: a regular expression (string or compiled) searched in the
+        command line of the process
+    :param pid: the id of the process
+    :param exclude: the PIDs to be excluded from the results
+    :param ttl: see processes
+    :return: a list of Process objects
+    """
+    if pattern is not None and not hasattr(pattern, 'search'):
+        pattern = re.compile(pattern)
+    exclude = set(int(excluded) for excluded in exclude)
+
+    if pid is not None and not ttl and os.path.isdir(PROC_PATH):
+        # a single process does not need to scan the whole table
+        process = _read_process(int(pid))
+        candidates = [process] if process is not None else []
+    else:
+        candidates = processes(ttl)
+
+    return [process for process in candidates
+            if process.pid not in exclude and
+            (pid is None or process.pid == int(pid)) and
+            (name is None or process.name == name[:15]) and
+            (pattern is None or pattern.search(process.command))]
+
+
+def is_running(name=None, pattern=None, pid=None, exclude=(), ttl=0):
+    """Checks if any process matches the given criteria (see find)
+
+    :return: True if a process was found, False otherwise
+    """
+    return bool(find(name, pattern, pid, exclude, ttl))
+
+
+def clear_cache():
+    """Discard the snapshot of the process table"""
+    with _SNAPSHOT_LOCK:
+        _SNAPSHOT[:] = [0, None]
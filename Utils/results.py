@@ -0,0 +1,448 @@
+"""Manage the runs stored in the results directory
+
+Every execution creates a Results/<timestamp>_<suite> directory (see
+Utils/common.py). This module keeps them under control:
+- index: a json-lines file (Results/index.jsonl) with one entry per run
+    (suite, start time, duration, pass/fail/skip counts, size and where the
+    run is stored), so the history is queried without opening the
+    output.xml of every run. The file is append-only (the last entry of a
+    run wins) and it is compacted when it grows too much.
+- compression: the runs older than the newest ones are compressed to
+    <run>.tar.zst (if the zstandard module is installed) or <run>.tar.gz.
+- retention: the oldest runs are deleted when there are more runs than
+    allowed, when they are older than allowed or when the runs take more
+    space than allowed.
+The runs being executed are never compressed or deleted: a run holds a lock
+on the .running file of its directory while it is executed (see lock_run),
+the lock is released when the run finishes or its process dies. The entries
+of those runs, and of the runs without statistics yet, are indexed again
+until they are complete.
+
+Example:
+
+from Utils import results
+lock = results.lock_run(output_dir)
+...
+results.unlock_run(lock)
+policy = results.Retention(max_runs=50, max_age_days=30, max_size_mb=2048)
+results.apply_retention('Results', policy, exclude=output_dir)
+results.print_runs(results.list_runs('Results', suite='Setup'))
+"""
+
+from __future__ import print_function
+
+import datetime
+import fcntl
+import json
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import time
+import xml.etree.ElementTree as ElementTree
+
+from Utils.durations import status_elapsed
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+INDEX_FILE = 'index.jsonl'
+
+# locked by the process of a run while it is executed
+LOCK_FILE = '.running'
+
+# <timestamp>_<suite> directories, and their archives
+RUN_NAME = re.compile(r'^(\d{14})_(.+?)(\.tar\.gz|\.tar\.zst)?$')
+TIMESTAMP_FORMAT = '%Y%m%d%H%M%S'
+
+GZIP_EXTENSION = '.tar.gz'
+ZSTD_EXTENSION = '.tar.zst'
+
+# where a run is stored (the location of the deleted runs is None)
+DIRECTORY = 'directory'
+
+# newest runs that are not compressed
+DEFAULT_UNCOMPRESSED_RUNS = 5
+
+
+class Retention(object):
+    """Retention policy of the results directory
+
+    Args:
+        max_runs = Maximum number of runs kept (None for no limit)
+        max_age_days = Runs older than this are deleted (None for no limit)
+        max_size_mb = Maximum size of all the runs (None for no limit)
+        uncompressed_runs = Newest runs that are not compressed (None to
+                            never compress)
+    """
+
+    __slots__ = ('max_runs', 'max_age_days', 'max_size_mb',
+                 'uncompressed_runs')
+
+    def __init__(self, max_runs=None, max_age_days=None, max_size_mb=None,
+                 uncompressed_runs=DEFAULT_UNCOMPRESSED_RUNS):
+        self.max_runs = max_runs
+        self.max_age_days = max_age_days
+        self.max_size_mb = max_size_mb
+        self.uncompressed_runs = uncompressed_runs
+
+
+def _size(path):
+    """Return the size in bytes of a file or directory"""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for folder, _, names in os.walk(path):
+        for name in names:
+            total += os.lstat(os.path.join(folder, name)).st_size
+    return total
+
+
+def parse_statistics(path):
+    """Return the statistics of the run of an output.xml
+
+       Args:
+           path = Path of the output.xml file
+       Returns:
+           statistics = Dictionary with the total, passed, failed and
+                        skipped test cases and the elapsed seconds of the
+                        top-level suite
+    """
+    statistics = {'total': 0, 'passed': 0, 'failed': 0, 'skipped': 0,
+                  'elapsed': None}
+    tags = []
+    suites = 0
+
+    for event, element in ElementTree.iterparse(path, ('start', 'end')):
+        if event == 'start':
+            tags.append(element.tag)
+            if element.tag == 'suite':
+                suites += 1
+            continue
+
+        tags.pop()
+        if element.tag == 'status' and suites == 1 and tags[-1] == 'suite':
+            statistics['elapsed'] = status_elapsed(element)
+        elif element.tag == 'stat' and tags[-1] == 'total' and (
+                element.text == 'All Tests' or not statistics['total']):
+            # robot < 4 also has the Critical Tests statistics
+            passed = int(element.get('pass', 0))
+            failed = int(element.get('fail', 0))
+            skipped = int(element.get('skip', 0))
+            statistics.update(total=passed + failed + skipped, passed=passed,
+                              failed=failed, skipped=skipped)
+        elif element.tag == 'suite':
+            suites -= 1
+            element.clear()
+
+    return statistics
+
+
+def lock_run(run_dir):
+    """Mark a run directory as being executed
+
+       Args:
+           run_dir = Directory of the run
+       Returns:
+           lock = The locked file, the run is executed until it is closed
+                  (see unlock_run) or the process finishes
+    """
+    lock = open(os.path.join(run_dir, LOCK_FILE), 'w')
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    return lock
+
+
+def unlock_run(lock):
+    """Mark a run directory as finished
+
+       Args:
+           lock = The locked file (see lock_run)
+    """
+    try:
+        os.remove(lock.name)
+    except OSError:
+        pass
+    lock.close()
+
+
+def is_running(run_dir):
+    """Return True if the run of a directory is being executed"""
+    try:
+        lock = open(os.path.join(run_dir, LOCK_FILE))
+    except (IOError, OSError):
+        return False
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        return True
+    finally:
+        lock.close()
+    return False
+
+
+def _entry(results_dir, name):
+    """Build the index entry of a run directory"""
+    timestamp, suite = RUN_NAME.match(name).groups()[:2]
+    run_dir = os.path.join(results_dir, name)
+    entry = {'run': name, 'suite': suite,
+             'start': datetime.datetime.strptime(
+                 timestamp, TIMESTAMP_FORMAT).isoformat(),
+             'size': _size(run_dir), 'location': DIRECTORY,
+             'running': is_running(run_dir)}
+    output = os.path.join(run_dir, 'output.xml')
+    try:
+        entry.update(parse_statistics(output))
+    except (IOError, OSError, ElementTree.ParseError):
+        # the run did not finish or it was interrupted
+        entry.update(total=None, passed=None, failed=None, skipped=None,
+                     elapsed=None)
+    return entry
+
+
+def load_index(results_dir):
+    """Load the index of the runs
+
+       Args:
+           results_dir = Results directory
+       Returns:
+           entries = Dictionary with the run names as keys and their last
+                     entry as values
+           lines = Number of lines of the index file
+    """
+    entries = {}
+    lines = 0
+    try:
+        with open(os.path.join(results_dir, INDEX_FILE)) as index:
+            for line in index:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a line partially written by an interrupted run
+                    continue
+                entries[entry['run']] = entry
+                lines += 1
+    except (IOError, OSError):
+        pass
+    return entries, lines
+
+
+def _write_index(results_dir, entries, compact):
+    """Append entries to the index, or rewrite it with all of them"""
+    path = os.path.join(results_dir, INDEX_FILE)
+    if not compact:
+        with open(path, 'a') as index:
+            for entry in entries:
+                index.write(json.dumps(entry, sort_keys=True) + '\n')
+        return
+    file_descriptor, temporary = tempfile.mkstemp(
+        dir=results_dir, suffix='.tmp')
+    with os.fdopen(file_descriptor, 'w') as index:
+        for entry in sorted(entries, key=lambda item: item['run']):
+            index.write(json.dumps(entry, sort_keys=True) + '\n')
+    os.rename(temporary, path)
+
+
+def _save(results_dir, entries, changed, lines):
+    """Store the changed entries, compacting the index if it is too big
+
+    Returns the number of lines of the index file.
+    """
+    if not changed:
+        return lines
+    if lines + len(changed) > 2 * len(entries):
+        _write_index(results_dir, entries.values(), compact=True)
+        return len(entries)
+    _write_index(results_dir, changed, compact=False)
+    return lines + len(changed)
+
+
+def _complete(entry):
+    """Return True if the entry of a run does not change anymore"""
+    return entry['location'] != DIRECTORY or (
+        not entry.get('running') and entry.get('total') is not None)
+
+
+def update_index(results_dir):
+    """Add the new run directories, and the incomplete ones, to the index
+
+       Args:
+           results_dir = Results directory
+       Returns:
+           entries = Dictionary with the run names as keys and their entry
+                     as values (see load_index)
+    """
+    return _update_index(results_dir)[0]
+
+
+def _update_index(results_dir):
+    """Add the new run directories to the index (see update_index)
+
+    Returns the entries and the number of lines of the index file.
+    """
+    entries, lines = load_index(results_dir)
+    changed = []
+    for name in sorted(os.listdir(results_dir)):
+        match = RUN_NAME.match(name)
+        if (not match or match.group(3) or
+                name in entries and _complete(entries[name]) or
+                not os.path.isdir(os.path.join(results_dir, name))):
+            continue
+        entry = _entry(results_dir, name)
+        if entry != entries.get(name):
+            entries[name] = entry
+            changed.append(entry)
+    return entries, _save(results_dir, entries, changed, lines)
+
+
+def compress_run(results_dir, name):
+    """Compress a run directory and remove it
+
+       Args:
+           results_dir = Results directory
+           name = Name of the run directory
+       Returns:
+           archive = Name of the archive (zstd if the zstandard module is
+                     installed, gzip otherwise)
+    """
+    run_dir = os.path.join(results_dir, name)
+    extension = ZSTD_EXTENSION if zstandard else GZIP_EXTENSION
+    file_descriptor, temporary = tempfile.mkstemp(
+        dir=results_dir, suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'wb') as archive_file:
+            if zstandard:
+                writer = zstandard.ZstdCompressor().stream_writer(
+                    archive_file)
+                with writer, tarfile.open(fileobj=writer, mode='w|') as tar:
+                    tar.add(run_dir, arcname=name)
+            else:
+                with tarfile.open(fileobj=archive_file, mode='w:gz') as tar:
+                    tar.add(run_dir, arcname=name)
+        os.rename(temporary, run_dir + extension)
+    except BaseException:
+        os.remove(temporary)
+        raise
+    shutil.rmtree(run_dir)
+    return name + extension
+
+
+def _remove(path):
+    """Remove a run directory or archive"""
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+def apply_retention(results_dir, retention, exclude=None):
+    """Compress and delete the old runs following a retention policy
+
+       Args:
+           results_dir = Results directory
+           retention = Retention object
+           exclude = Path of the run being executed, it is always kept (as
+                     the runs of other processes that are being executed)
+       Returns:
+           deleted = List of names of the deleted runs
+           compressed = List of names of the compressed runs
+    """
+    entries, lines = _update_index(results_dir)
+    exclude = os.path.basename(os.path.normpath(exclude)) if exclude else None
+    now = time.time()
+    max_size = (retention.max_size_mb * 2 ** 20
+                if retention.max_size_mb is not None else None)
+    changed, deleted, compressed = [], [], []
+    kept, kept_size = 0, 0
+    # once the size limit is reached all the older runs are deleted
+    full = False
+
+    stored = [entry for entry in entries.values() if entry['location']]
+    # the newest runs first
+    for entry in sorted(stored, key=lambda item: item['run'], reverse=True):
+        name = entry['run']
+        if name == exclude or entry.get('running'):
+            kept, kept_size = kept + 1, kept_size + entry['size']
+            continue
+
+        started = time.mktime(datetime.datetime.strptime(
+            entry['start'], '%Y-%m-%dT%H:%M:%S').timetuple())
+        expired = full or (
+            retention.max_runs is not None and
+            kept >= retention.max_runs) or (
+            retention.max_age_days is not None and
+            now - started > retention.max_age_days * 86400)
+
+        if (not expired and entry['location'] == DIRECTORY and
+                retention.uncompressed_runs is not None and
+                kept >= retention.uncompressed_runs):
+            entry['location'] = compress_run(results_dir, name)
+            entry['size'] = _size(os.path.join(results_dir,
+                                               entry['location']))
+            changed.append(entry)
+            compressed.append(name)
+
+        if not expired and max_size is not None and (
+                kept_size + entry['size'] > max_size):
+            expired = full = True
+
+        if expired:
+            location = (name if entry['location'] == DIRECTORY
+                        else entry['location'])
+            _remove(os.path.join(results_dir, location))
+            entry['location'] = None
+            if entry not in changed:
+                changed.append(entry)
+            deleted.append(name)
+            if name in compressed:
+                compressed.remove(name)
+            continue
+        kept, kept_size = kept + 1, kept_size + entry['size']
+
+    _save(results_dir, entries, changed, lines)
+    return deleted, compressed
+
+
+def list_runs(results_dir, suite=None):
+    """Return the runs of the index (oldest first)
+
+       Args:
+           results_dir = Results directory
+           suite = Name of the suite, only its runs are returned
+       Returns:
+           runs = List of index entries (see update_index)
+    """
+    entries, _ = load_index(results_dir)
+    runs = sorted(entries.values(), key=lambda item: item['run'])
+    if suite:
+        runs = [entry for entry in runs
+                if entry['suite'].lower() == suite.lower()]
+    return runs
+
+
+def _format_size(size):
+    """Format a size in bytes as MB"""
+    return '{0:.1f}MB'.format(size / 2.0 ** 20)
+
+
+def print_runs(runs):
+    """Print the runs of the index
+
+       Args:
+           runs = List of index entries (see list_runs)
+    """
+    line = '{0:<40} {1:>6} {2:>6} {3:>6} {4:>9} {5:>9}  {6}'
+    print(line.format('RUN', 'PASS', 'FAIL', 'SKIP', 'TIME', 'SIZE',
+                      'STORED'))
+    for entry in runs:
+        counts = ['-' if entry.get(key) is None else entry[key]
+                  for key in ('passed', 'failed', 'skipped')]
+        elapsed = entry.get('elapsed')
+        print(line.format(
+            entry['run'][:40], counts[0], counts[1], counts[2],
+            '-' if elapsed is None else '{}s'.format(int(elapsed)),
+            _format_size(entry['size']),
+            'running' if entry.get('running') else
+            entry['location'] or 'deleted'))
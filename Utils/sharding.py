@@ -0,0 +1,199 @@
+"""Run a Robot Framework suite in parallel shards
+
+The suite is split in shards that run in a pool of processes, each shard in
+its own output directory, and their results are merged with rebot in one
+output.xml/log.html/report.html in the output directory of the execution:
+- suite: one shard per sub-suite of the suite (the default), if the suite
+    does not have sub-suites it is sharded by test.
+- test: one shard per test case.
+
+Every shard runs the whole suite filtered with the --suite/--test options of
+robot, so the results of the shards have the same top-level suite and they
+are merged with `rebot --merge`.
+
+robot is only imported when the shards run, so the module can be imported
+to parse the command line arguments without the robot import cost.
+
+Example:
+
+from Utils import common, sharding
+suite = common.Suite('Tests', MAIN_SUITE)
+shards = sharding.make_shards(suite.node, mode=sharding.SUITE)
+sharding.run_shards(suite.path, shards, output_dir, processes=4)
+"""
+
+from __future__ import print_function
+
+import multiprocessing
+import os
+import re
+
+from Utils.tags import TagFilter
+
+SUITE = 'suite'
+TEST = 'test'
+SHARD_MODES = (SUITE, TEST)
+
+SHARDS_DIR = 'shards'
+
+
+class Shard(object):
+    """A part of a suite that runs in its own process
+
+    Args:
+        index = Position of the shard in the execution
+        name = Long name of the sub-suite or test case of the shard
+        option = Robot option used to select the shard (suite or test)
+    """
+
+    __slots__ = ('index', 'name', 'option')
+
+    def __init__(self, index, name, option):
+        self.index = index
+        self.name = name
+        self.option = option
+
+    @property
+    def directory(self):
+        """Name of the output directory of the shard"""
+        return '{0:03d}_{1}'.format(
+            self.index, re.sub(r'[^\w.-]+', '_', self.name)[:80])
+
+    def __repr__(self):
+        return 'Shard({0}, {1}={2!r})'.format(
+            self.index, self.option, self.name)
+
+
+def _longname(parent, name):
+    """Return the long name of a suite or test (e.g. Tests.Setup.Test 1)"""
+    return '{0}.{1}'.format(parent, name) if parent else name
+
+
+def _tests(suite, parent='', tag_filter=None):
+    """Return the long names of all the test cases of a suite
+
+       Args:
+           suite = Suite node (see Utils/suite_index.py)
+           parent = Long name of the parent suite
+           tag_filter = TagFilter object, only the test cases that match it
+                        are returned (all if it is None)
+       Returns:
+           tests = Generator of long names
+    """
+    longname = _longname(parent, suite.name)
+    for test in suite.tests:
+        if tag_filter is None or tag_filter.match(test.tags):
+            yield _longname(longname, test.name)
+    for child in suite.children:
+        for test in _tests(child, longname, tag_filter):
+            yield test
+
+
+def make_shards(suite, mode=SUITE, tags=None):
+    """Split a suite in shards
+
+       Args:
+           suite = Suite node (see Utils/suite_index.py)
+           mode = How the suite is split (suite or test)
+           tags = List of tag patterns (see Utils/tags.py), the sub-suites
+                  and test cases without matching test cases are not
+                  sharded
+       Returns:
+           shards = List of Shard objects
+    """
+    if mode not in SHARD_MODES:
+        raise ValueError('{}: invalid shard mode'.format(mode))
+
+    tag_filter = TagFilter(tags) if tags else None
+    if mode == SUITE and suite.children:
+        names = [(_longname(suite.name, child.name), SUITE)
+                 for child in suite.children
+                 if tag_filter is None or any(
+                     tag_filter.match(test.tags)
+                     for test in child.all_tests())]
+    else:
+        names = [(name, TEST) for name in _tests(suite, '', tag_filter)]
+
+    return [Shard(index, name, option)
+            for index, (name, option) in enumerate(names, 1)]
+
+
+def run_shard(arguments):
+    """Run a shard with robot (executed in the worker processes)
+
+       Args:
+           arguments = Tuple with the suite path, the Shard object, the
+                       output directory of the shard and the extra robot
+                       options
+       Returns:
+           result = Tuple with the Shard, the robot return code and the
+                    path of its output.xml (None if it was not created)
+    """
+    import robot
+
+    suite_path, shard, shard_dir, options = arguments
+    if not os.path.exists(shard_dir):
+        os.makedirs(shard_dir)
+
+    options = dict(options)
+    options[shard.option] = shard.name
+    options['variable'] = list(options.get('variable') or []) + [
+        'LOGS_DIR:{}'.format(shard_dir)]
+
+    # the console output of the shards is stored in their directory, so the
+    # output of the parallel shards is not mixed
+    with open(os.path.join(shard_dir, 'console.txt'), 'w') as console:
+        return_code = robot.run(
+            suite_path, outputdir=shard_dir, output='output.xml',
+            log='NONE', report='NONE', stdout=console, stderr=console,
+            **options)
+
+    output = os.path.join(shard_dir, 'output.xml')
+    return shard, return_code, output if os.path.isfile(output) else None
+
+
+def run_shards(suite_path, shards, output_dir, processes, **options):
+    """Run the shards in a pool of processes and merge their results
+
+       Args:
+           suite_path = Path of the suite
+           shards = List of Shard objects
+           output_dir = Output directory of the execution, the merged results
+                        are stored there and the results of each shard in
+                        its shards/<index>_<name> sub-directory
+           processes = Maximum number of shards running at the same time
+           options = Extra robot options for all the shards (e.g. include)
+       Returns:
+           return_code = Return code of rebot (the number of failed tests)
+    """
+    arguments = [
+        (suite_path, shard,
+         os.path.join(output_dir, SHARDS_DIR, shard.directory), options)
+        for shard in shards]
+
+    # a fresh process for each shard, so the global state of robot (e.g.
+    # the imported libraries) is not shared between shards
+    pool = multiprocessing.Pool(
+        processes=max(1, min(processes, len(shards))), maxtasksperchild=1)
+    outputs = {}
+    try:
+        for number, (shard, return_code, output) in enumerate(
+                pool.imap_unordered(run_shard, arguments), 1):
+            print('[{0}/{1}] {2} ({3})'.format(
+                number, len(shards), shard.name,
+                'PASS' if return_code == 0 else 'FAIL'))
+            if output:
+                outputs[shard.index] = output
+    finally:
+        pool.close()
+        pool.join()
+
+    if not outputs:
+        print('ERROR: no shard produced results')
+        return 1
+
+    import robot
+    return robot.rebot(
+        *[outputs[index] for index in sorted(outputs)], merge=True,
+        outputdir=output_dir, output='output.xml', log='log.html',
+        report='report.html')
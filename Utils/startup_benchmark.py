@@ -0,0 +1,119 @@
+"""Benchmark the startup time of main.py
+
+Runs `python main.py --help` and `python main.py --list-suites` several
+times in new processes, and records the best and the median time of each
+command (with the git revision and python version) in
+Results/startup_benchmark.jsonl, so the latency can be tracked across
+changes. The results are compared with the previous record. Nothing is
+recorded if a command fails (e.g. main.py refuses to run as root).
+
+Usage:
+
+python Utils/startup_benchmark.py --runs 20
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+
+SUITE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(SUITE_DIR, 'main.py')
+RECORDS_FILE = os.path.join(SUITE_DIR, 'Results', 'startup_benchmark.jsonl')
+
+COMMANDS = (('help', ['--help']), ('list-suites', ['--list-suites']))
+
+
+def measure(arguments, runs):
+    """Measure the time of a main.py command
+
+    :param arguments: the list of arguments of main.py
+    :param runs: the number of times the command is executed
+    :return: a dictionary with the best and the median time in seconds
+    :raises subprocess.CalledProcessError: if the command fails
+    """
+    command = [sys.executable, MAIN] + arguments
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(runs):
+            start = timeit.default_timer()
+            returncode = subprocess.call(command, stdout=devnull,
+                                         stderr=devnull, cwd=SUITE_DIR)
+            times.append(timeit.default_timer() - start)
+            if returncode != 0:
+                # a failed startup is not a valid measure
+                raise subprocess.CalledProcessError(returncode, command)
+    times.sort()
+    return {'best': round(times[0], 4),
+            'median': round(times[len(times) // 2], 4)}
+
+
+def revision():
+    """Get the current git revision (None if it is not available)"""
+    try:
+        with open(os.devnull, 'w') as devnull:
+            output = subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=SUITE_DIR,
+                stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('utf-8').strip()
+
+
+def last_record(path):
+    """Get the last record of the benchmark file (None if there is none)"""
+    try:
+        with open(path) as records:
+            lines = [line for line in records if line.strip()]
+    except (IOError, OSError):
+        return None
+    return json.loads(lines[-1]) if lines else None
+
+
+def main():
+    """Run the benchmark and record its results"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10,
+                        help='Times each command is executed')
+    parser.add_argument('--no-record', dest='record', action='store_false',
+                        help='Do not store the results')
+    args = parser.parse_args()
+
+    previous = last_record(RECORDS_FILE)
+    record = {
+        'date': datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'revision': revision(), 'python': platform.python_version(),
+        'runs': args.runs, 'commands': {}}
+
+    for name, arguments in COMMANDS:
+        try:
+            result = measure(arguments, args.runs)
+        except subprocess.CalledProcessError as error:
+            sys.exit('{0} failed with exit code {1}, the results are not '
+                     'recorded'.format(' '.join(error.cmd),
+                                       error.returncode))
+        record['commands'][name] = result
+        line = '{0:<12} best {1:.3f}s  median {2:.3f}s'.format(
+            name, result['best'], result['median'])
+        before = (previous or {}).get('commands', {}).get(name)
+        if before and before.get('median'):
+            line += '  ({0:+.1f}% vs {1})'.format(
+                (result['median'] / before['median'] - 1) * 100,
+                previous.get('revision'))
+        print(line)
+
+    if args.record:
+        if not os.path.isdir(os.path.dirname(RECORDS_FILE)):
+            os.makedirs(os.path.dirname(RECORDS_FILE))
+        with open(RECORDS_FILE, 'a') as records:
+            records.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    main()
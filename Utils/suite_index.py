@@ -0,0 +1,357 @@
+"""Persistent index of the suite tree
+
+The suite tree (the Tests folder) is indexed without parsing it with robot:
+every suite file is read with a lightweight parser that only extracts the
+test case names and tags, and the result is stored in a json file together
+with the mtime and size of each file. The next time the index is loaded only
+the files that changed are parsed again, so looking up a suite or listing
+the tree does not parse the whole tree.
+
+The suite names follow the robot framework rules (e.g. the file
+01__basic_setup.robot is the suite Basic Setup) and the tags of the test
+cases include the Force Tags/Test Tags of their suite file and of the
+__init__ files of their folders, and the Default Tags of their suite file
+(if the test case does not have [Tags]).
+
+Example:
+
+from Utils import suite_index
+index = suite_index.load('Tests')
+suite = index.find('Basic Setup')
+print(suite.source, [test.name for test in suite.all_tests()])
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+# the folder where the indexes are stored
+INDEX_DIR = os.environ.get(
+    'STX_SUITE_INDEX_DIR', os.path.join(
+        os.path.expanduser('~'), '.cache', 'stx-suite', 'suites'))
+
+# bump it when the content of the index changes
+INDEX_VERSION = 1
+
+SUITE_EXTENSIONS = ('.robot', '.txt', '.tsv')
+INIT_FILE = '__init__'
+
+TEST_SECTIONS = ('test case', 'test cases', 'task', 'tasks')
+SETTING_SECTIONS = ('setting', 'settings')
+FORCE_TAGS = ('force tags', 'test tags')
+DEFAULT_TAGS = ('default tags',)
+
+_CELL_SEPARATOR = re.compile(r'\t| {2,}')
+
+
+class TestEntry(object):
+    """A test case of the index
+
+    :param name: the name of the test case
+    :param tags: the list of tags of the test case
+    """
+
+    __slots__ = ('name', 'tags')
+
+    def __init__(self, name, tags):
+        self.name = name
+        self.tags = tags
+
+
+class SuiteNode(object):
+    """A suite of the index (a suite file or a folder)
+
+    :param name: the name of the suite
+    :param source: the path of the suite file or folder
+    :param tests: the list of TestEntry objects (empty for folders)
+    :param children: the list of SuiteNode objects of a folder
+    """
+
+    __slots__ = ('name', 'source', 'tests', 'children', 'longname')
+
+    def __init__(self, name, source, tests=(), children=(), longname=None):
+        self.name = name
+        self.source = source
+        self.tests = list(tests)
+        self.children = list(children)
+        self.longname = longname or name
+
+    def walk(self):
+        """Iterate over the suite and all its sub-suites (pre-order)"""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+    def all_tests(self):
+        """Iterate over the test cases of the suite and its sub-suites"""
+        for node in self.walk():
+            for test in node.tests:
+                yield test
+
+    def __repr__(self):
+        return 'SuiteNode({0!r}, {1} tests)'.format(
+            self.longname, len(self.tests))
+
+
+def suite_name(path):
+    """Get the name robot framework gives to a suite file or folder
+
+    :param path: the path of the suite
+    :return: the name of the suite
+    """
+    name = os.path.basename(path.rstrip(os.sep))
+    if not os.path.isdir(path):
+        name = os.path.splitext(name)[0]
+    name = name.split('__', 1)[-1]
+    name = name.replace('_', ' ').strip()
+    return name.title() if name.islower() else name
+
+
+def normalize(name):
+    """Normalize a suite name the way robot matches them"""
+    return re.sub(r'[\s_]', '', name).lower()
+
+
+def _cells(line):
+    """Split a line of a suite file in cells (space, pipe or tsv format)"""
+    line = line.rstrip('\r\n')
+    if line.startswith('|'):
+        cells = [cell.strip() for cell in line.strip().split('|')[1:]]
+        if cells and not cells[-1]:
+            cells.pop()
+    elif line[:1].isspace():
+        # the indented lines belong to the current test case or setting
+        cells = [''] + _CELL_SEPARATOR.split(line.strip())
+    else:
+        cells = _CELL_SEPARATOR.split(line.rstrip())
+    # the comments end the line
+    for position, cell in enumerate(cells):
+        if cell.startswith('#'):
+            return cells[:position]
+    return cells
+
+
+def parse_file(path):
+    """Extract the test cases and the tags of a suite file
+
+    :param path: the path of the file
+    :return: a dictionary with the list of tests (name and tags) and the
+        force and default tags of the file, the tests key is None if the
+        file does not have a test case section
+    """
+    tests = None
+    force_tags, default_tags = [], []
+    section = None
+    current = None
+    continued = None
+
+    with open(path, 'rb') as suite_file:
+        content = suite_file.read().decode('utf-8', 'replace')
+
+    for line in content.splitlines():
+        if line.startswith('*'):
+            section = line.strip('* \t').lower()
+            if section in TEST_SECTIONS and tests is None:
+                tests = []
+            current, continued = None, None
+            continue
+
+        cells = _cells(line)
+        if not any(cells):
+            continue
+
+        if section in SETTING_SECTIONS:
+            setting = cells[0].lower()
+            if setting == '...' and continued is not None:
+                continued.extend(cells[1:])
+            elif setting in FORCE_TAGS:
+                force_tags.extend(cells[1:])
+                continued = force_tags
+            elif setting in DEFAULT_TAGS:
+                default_tags.extend(cells[1:])
+                continued = default_tags
+            else:
+                continued = None
+
+        elif section in TEST_SECTIONS:
+            if cells[0]:
+                # a new test case, its settings can start in the same line
+                current = {'name': cells[0], 'tags': None}
+                tests.append(current)
+                cells = [''] + cells[1:]
+                continued = None
+            if current is None or len(cells) < 2:
+                continue
+            if cells[1].lower() == '[tags]':
+                current['tags'] = cells[2:]
+                continued = current['tags']
+            elif cells[1] == '...' and continued is not None:
+                continued.extend(cells[2:])
+            else:
+                continued = None
+
+    return {'tests': tests, 'force_tags': force_tags,
+            'default_tags': default_tags}
+
+
+def _index_file(root):
+    """Get the path of the index of a suite tree"""
+    name = hashlib.sha1(os.path.abspath(root).encode('utf-8')).hexdigest()
+    return os.path.join(INDEX_DIR, '{}.json'.format(name))
+
+
+def _is_ignored(name):
+    """Checks if a file or folder is ignored by robot framework"""
+    return name.startswith(('.', '_')) or name == 'CVS'
+
+
+class SuiteIndex(object):
+    """The index of a suite tree
+
+    :param root: the path of the root suite (e.g. Tests)
+    :param files: a dictionary with the paths of the suite files (relative
+        to the root) as keys and a dictionary with their mtime, size and
+        parsed content (see parse_file) as values
+    """
+
+    def __init__(self, root, files):
+        self.root = os.path.abspath(root)
+        self.files = files
+        self.tree = self._build(self.root, '', [])
+        self._by_name = {}
+        for node in self.tree.walk() if self.tree else ():
+            for key in (normalize(node.name), normalize(node.longname)):
+                self._by_name.setdefault(key, node)
+
+    def _entry(self, path):
+        """Get the indexed content of a file"""
+        return self.files.get(os.path.relpath(path, self.root))
+
+    def _build(self, path, parent, force_tags):
+        """Build the SuiteNode of a file or folder
+
+        :return: the SuiteNode or None if it does not have test cases
+        """
+        name = suite_name(path)
+        longname = '{0}.{1}'.format(parent, name) if parent else name
+
+        if not os.path.isdir(path):
+            entry = self._entry(path)
+            if not entry or entry['tests'] is None:
+                return None
+            tags = force_tags + entry['force_tags']
+            tests = [TestEntry(test['name'], tags + (
+                test['tags'] if test['tags'] is not None else
+                entry['default_tags'])) for test in entry['tests']]
+            return SuiteNode(name, path, tests, longname=longname)
+
+        children = []
+        tags = list(force_tags)
+        names = sorted(os.listdir(path), key=lambda item: item.lower())
+        for child in names:
+            if os.path.splitext(child)[0] == INIT_FILE:
+                entry = self._entry(os.path.join(path, child))
+                if entry:
+                    tags.extend(entry['force_tags'])
+        for child in names:
+            if _is_ignored(child):
+                continue
+            child_path = os.path.join(path, child)
+            if not os.path.isdir(child_path) and (
+                    os.path.splitext(child)[1].lower() not in
+                    SUITE_EXTENSIONS):
+                continue
+            node = self._build(child_path, longname, tags)
+            if node is not None:
+                children.append(node)
+
+        if not children and parent:
+            return None
+        return SuiteNode(name, path, children=children, longname=longname)
+
+    def find(self, name):
+        """Find a suite by name or long name (e.g. Tests.Setup)
+
+        :param name: the name of the suite, the case, the spaces and the
+            underscores are ignored
+        :return: the SuiteNode object or None if it does not exist
+        """
+        return self._by_name.get(normalize(name))
+
+
+def _scan(root):
+    """Get the suite files of a tree with their mtime and size
+
+    :return: a dictionary with the paths relative to the root as keys and
+        (mtime, size) tuples as values
+    """
+    files = {}
+    for folder, folders, names in os.walk(root):
+        folders[:] = [name for name in folders if not _is_ignored(name)]
+        for name in names:
+            if (os.path.splitext(name)[1].lower() not in SUITE_EXTENSIONS or
+                    (_is_ignored(name) and
+                     os.path.splitext(name)[0] != INIT_FILE)):
+                continue
+            path = os.path.join(folder, name)
+            status = os.stat(path)
+            files[os.path.relpath(path, root)] = (status.st_mtime,
+                                                  status.st_size)
+    return files
+
+
+def _load_cached(path):
+    """Load the files of a stored index (empty if it can not be used)"""
+    try:
+        with open(path) as index_file:
+            stored = json.load(index_file)
+    except (IOError, OSError, ValueError):
+        return {}
+    if stored.get('version') != INDEX_VERSION:
+        return {}
+    return stored.get('files', {})
+
+
+def _save(path, files):
+    """Store the files of an index, errors are ignored"""
+    try:
+        if not os.path.exists(INDEX_DIR):
+            os.makedirs(INDEX_DIR)
+        file_descriptor, temporary = tempfile.mkstemp(
+            dir=INDEX_DIR, suffix='.tmp')
+        with os.fdopen(file_descriptor, 'w') as index_file:
+            json.dump({'version': INDEX_VERSION, 'files': files}, index_file,
+                      separators=(',', ':'))
+        os.rename(temporary, path)
+    except (IOError, OSError):
+        pass
+
+
+def load(root):
+    """Load the index of a suite tree, parsing only the files that changed
+
+    :param root: the path of the root suite (e.g. Tests)
+    :return: the SuiteIndex object
+    """
+    root = os.path.abspath(root)
+    index_path = _index_file(root)
+    cached = _load_cached(index_path)
+    files = {}
+    changed = False
+
+    for relative, (mtime, size) in _scan(root).items():
+        entry = cached.get(relative)
+        if not entry or entry['mtime'] != mtime or entry['size'] != size:
+            entry = parse_file(os.path.join(root, relative))
+            entry.update(mtime=mtime, size=size)
+            changed = True
+        files[relative] = entry
+
+    if changed or len(files) != len(cached):
+        _save(index_path, files)
+
+    return SuiteIndex(root, files)
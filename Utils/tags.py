@@ -0,0 +1,97 @@
+"""Evaluate robot framework tag patterns against the tags of the tests
+
+The patterns follow the robot framework --include/--exclude syntax:
+- foo: a test with the tag foo, the case, spaces and underscores are ignored.
+- bar*, ba?: wildcards (* any string, ? any character).
+- fooANDbar*, foo&bar*: tests with all the patterns.
+- fooORbar: tests with any of the patterns.
+- fooNOTbar: tests with foo and without bar (NOTbar alone is also valid).
+As in robot, NOT has the lowest precedence and AND the highest, and a test
+matches a list of patterns (several --include options) if it matches any of
+them.
+
+Example:
+
+from Utils import tags
+pattern = tags.TagPattern('sanityANDcontroller*NOTslow')
+pattern.match(['Sanity', 'controller-0'])
+"""
+
+import fnmatch
+import re
+
+
+def normalize(tag):
+    """Normalize a tag (or pattern) the way robot compares them"""
+    return re.sub(r'[\s_]', '', tag).lower()
+
+
+class TagPattern(object):
+    """A robot framework tag pattern
+
+    :param pattern: the pattern as an string (e.g. fooANDbar*)
+    """
+
+    __slots__ = ('pattern', '_match')
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self._match = _compile(pattern.replace(' ', ''))
+
+    def match(self, tags):
+        """Check if a list of tags matches the pattern
+
+        :param tags: the tags of a test case
+        :return: True if the tags match the pattern, False otherwise
+        """
+        return self._match([normalize(tag) for tag in tags])
+
+    def __repr__(self):
+        return 'TagPattern({!r})'.format(self.pattern)
+
+
+def _compile(pattern):
+    """Compile a pattern (without spaces) to a function over normalized tags
+
+    :return: a function that receives the list of normalized tags
+    """
+    if 'NOT' in pattern:
+        must, must_nots = pattern.split('NOT')[0], pattern.split('NOT')[1:]
+        must = _compile(must) if must else None
+        must_nots = [_compile(item) for item in must_nots if item]
+        return lambda tags: ((must is None or must(tags)) and
+                             not any(item(tags) for item in must_nots))
+    if 'OR' in pattern:
+        items = [_compile(item) for item in pattern.split('OR') if item]
+        return lambda tags: any(item(tags) for item in items)
+    if 'AND' in pattern or '&' in pattern:
+        items = [_compile(item) for item in
+                 pattern.replace('&', 'AND').split('AND') if item]
+        return lambda tags: all(item(tags) for item in items)
+
+    expression = re.compile(fnmatch.translate(normalize(pattern)))
+    return lambda tags: any(expression.match(tag) for tag in tags)
+
+
+class TagFilter(object):
+    """A list of tag patterns (like several --include options)
+
+    :param patterns: a list of pattern strings, an empty list matches all
+        the tests
+    """
+
+    __slots__ = ('patterns',)
+
+    def __init__(self, patterns):
+        self.patterns = [TagPattern(pattern) for pattern in patterns or []]
+
+    def match(self, tags):
+        """Check if a list of tags matches any of the patterns"""
+        if not self.patterns:
+            return True
+        return any(pattern.match(tags) for pattern in self.patterns)
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    __nonzero__ = __bool__
@@ -0,0 +1,303 @@
+"""Trace the time spent in the phases of the setup, install and test runs
+
+A span measures a phase with a monotonic clock, it can have attributes (e.g.
+the node) and it can contain other spans. The current span is kept in a
+context variable (a thread local in Python 2), so the spans of different
+threads and asyncio tasks do not get mixed.
+
+The finished spans can be exported to the Chrome trace format (open it in
+chrome://tracing or https://ui.perfetto.dev) and summarized in a table. When
+the STX_TRACE_DIR environment variable is set, every process writes its
+spans to trace-<pid>.json in that directory when it finishes, and collect()
+merges them (main.py does it for the processes of a run).
+
+Every finished span is also logged (Utils.tracing logger) with its node,
+phase and duration, so the spans are in the json logs (see Utils/logger.py).
+
+Example:
+
+from Utils import tracing
+
+@tracing.traced()
+def boot(node):
+    with tracing.span('load kernel', node=node) as current:
+        current.set('size', 1024)
+
+boot('controller-0')
+tracing.export_chrome('trace.json')
+tracing.print_summary()
+"""
+
+from __future__ import print_function
+
+import atexit
+import contextlib
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+try:
+    import contextvars
+except ImportError:
+    # python < 3.7
+    contextvars = None
+
+LOG = logging.getLogger(__name__)
+
+TRACE_DIR_VARIABLE = 'STX_TRACE_DIR'
+TRACE_FILE_PREFIX = 'trace-'
+
+_monotonic = getattr(time, 'monotonic', time.time)
+
+
+class Span(object):
+    """A phase being traced
+
+    :param name: the name of the phase
+    :param parent: the Span that contains this one (None for the top ones)
+    :param attributes: a dictionary with the attributes of the span
+    """
+
+    __slots__ = ('name', 'parent', 'attributes', 'start', 'end', 'pid',
+                 'thread')
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.parent = parent
+        self.attributes = dict(attributes or {})
+        self.start = _monotonic()
+        self.end = None
+        self.pid = os.getpid()
+        self.thread = threading.current_thread().name
+
+    def set(self, key, value):
+        """Set an attribute of the span"""
+        self.attributes[key] = value
+
+    @property
+    def duration(self):
+        """Seconds of the span (until now if it did not finish)"""
+        return (self.end if self.end is not None else _monotonic()) - (
+            self.start)
+
+    @property
+    def depth(self):
+        """Number of spans that contain this one"""
+        depth, parent = 0, self.parent
+        while parent is not None:
+            depth, parent = depth + 1, parent.parent
+        return depth
+
+    def __repr__(self):
+        return 'Span({0!r}, {1:.3f}s)'.format(self.name, self.duration)
+
+
+class Tracer(object):
+    """Keep the current span and the finished spans of the process"""
+
+    def __init__(self):
+        self.spans = []
+        self.lock = threading.Lock()
+        if contextvars is not None:
+            self._current = contextvars.ContextVar('span', default=None)
+        else:
+            self._local = threading.local()
+        self._dump_pid = None
+
+    def current(self):
+        """Get the current span (None if there is none)"""
+        if contextvars is not None:
+            return self._current.get()
+        return getattr(self._local, 'span', None)
+
+    def _set_current(self, span):
+        """Set the current span, return the token to restore the previous"""
+        if contextvars is not None:
+            return self._current.set(span)
+        previous = self.current()
+        self._local.span = span
+        return previous
+
+    def _restore(self, token):
+        """Restore the span that was current before _set_current"""
+        if contextvars is not None:
+            self._current.reset(token)
+        else:
+            self._local.span = token
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        """Trace a phase (see the span function of the module)"""
+        current = Span(name, self.current(), attributes)
+        token = self._set_current(current)
+        try:
+            yield current
+        except SystemExit as error:
+            if error.code not in (None, 0):
+                current.set('error', 'exit code {}'.format(error.code))
+            raise
+        except BaseException as error:
+            current.set('error', type(error).__name__)
+            raise
+        finally:
+            current.end = _monotonic()
+            self._restore(token)
+            self._finish(current)
+
+    def _finish(self, span):
+        """Store a finished span"""
+        with self.lock:
+            self.spans.append(span)
+        LOG.info('%s finished (%.3fs)', span.name, span.duration,
+                 extra={'node': span.attributes.get('node'),
+                        'phase': span.name,
+                        'duration': round(span.duration, 3)})
+        if os.environ.get(TRACE_DIR_VARIABLE) and (
+                self._dump_pid != os.getpid()):
+            self._dump_pid = os.getpid()
+            atexit.register(self.dump)
+            if 'multiprocessing' in sys.modules:
+                # the workers of a multiprocessing pool do not run atexit
+                from multiprocessing import util
+                util.Finalize(None, self.dump, exitpriority=0)
+
+    def finished(self):
+        """Get the finished spans of this process"""
+        with self.lock:
+            return [span for span in self.spans if span.pid == os.getpid()]
+
+    def dump(self):
+        """Write the spans of this process in the STX_TRACE_DIR directory"""
+        directory = os.environ.get(TRACE_DIR_VARIABLE)
+        spans = self.finished()
+        if not directory or not spans:
+            return
+        path = os.path.join(directory, '{0}{1}.json'.format(
+            TRACE_FILE_PREFIX, os.getpid()))
+        with open(path, 'w') as trace_file:
+            json.dump(chrome_events(spans), trace_file)
+
+
+TRACER = Tracer()
+
+
+def span(name, **attributes):
+    """Trace a phase in a with block
+
+    :param name: the name of the phase
+    :param attributes: the attributes of the span (e.g. node='controller-0')
+    :return: a context manager that gives the Span object
+    """
+    return TRACER.span(name, **attributes)
+
+
+def traced(name=None, **attributes):
+    """Decorator that traces every call of a function
+
+    :param name: the name of the span, the qualified name of the function
+        by default
+    :param attributes: the attributes of the span
+    """
+    def decorator(function):
+        span_name = name or getattr(function, '__qualname__',
+                                    function.__name__)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with TRACER.span(span_name, **attributes):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current():
+    """Get the current span (None if there is none)"""
+    return TRACER.current()
+
+
+def chrome_events(spans=None):
+    """Convert spans to chrome trace events
+
+    :param spans: a list of Span objects, the finished spans of the process
+        by default
+    :return: a list of complete events (dictionaries)
+    """
+    spans = TRACER.finished() if spans is None else spans
+    return [{'name': span.name, 'ph': 'X', 'cat': 'stx',
+             # the monotonic clock is the same for all the processes
+             'ts': round(span.start * 1e6, 1),
+             'dur': round((span.end - span.start) * 1e6, 1),
+             'pid': span.pid, 'tid': span.thread,
+             'args': dict((key, str(value))
+                          for key, value in span.attributes.items())}
+            for span in spans]
+
+
+def collect(directory):
+    """Merge the spans dumped by the processes of a run with these ones
+
+    :param directory: the STX_TRACE_DIR of the run
+    :return: a list of chrome trace events
+    """
+    events = chrome_events()
+    for name in sorted(os.listdir(directory)):
+        if not (name.startswith(TRACE_FILE_PREFIX) and
+                name.endswith('.json')) or name == '{0}{1}.json'.format(
+                    TRACE_FILE_PREFIX, os.getpid()):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as trace_file:
+                events.extend(json.load(trace_file))
+        except (IOError, OSError, ValueError):
+            continue
+    return events
+
+
+def export_chrome(path, events=None):
+    """Write a Chrome trace file
+
+    :param path: the path of the json file
+    :param events: a list of chrome trace events, the spans of this process
+        by default (see chrome_events and collect)
+    """
+    events = chrome_events() if events is None else events
+    with open(path, 'w') as trace_file:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'},
+                  trace_file)
+
+
+def summary(events=None):
+    """Summarize the time of each phase
+
+    :param events: a list of chrome trace events, the spans of this process
+        by default
+    :return: a list of (name, count, total seconds, maximum seconds) tuples,
+        the longest total first
+    """
+    events = chrome_events() if events is None else events
+    phases = {}
+    for event in events:
+        count, total, longest = phases.get(event['name'], (0, 0.0, 0.0))
+        duration = event['dur'] / 1e6
+        phases[event['name']] = (count + 1, total + duration,
+                                 max(longest, duration))
+    return sorted(((name,) + values for name, values in phases.items()),
+                  key=lambda item: item[2], reverse=True)
+
+
+def print_summary(events=None, stream=None):
+    """Print the summary of the phases as a table
+
+    :param events: a list of chrome trace events (see summary)
+    :param stream: the file where the table is written (stdout by default)
+    """
+    stream = stream or sys.stdout
+    line = '{0:<48} {1:>6} {2:>10} {3:>10}\n'
+    stream.write(line.format('PHASE', 'CALLS', 'TOTAL', 'MAX'))
+    for name, count, total, longest in summary(events):
+        stream.write(line.format(name[:48], count, '{:.2f}s'.format(total),
+                                 '{:.2f}s'.format(longest)))
@@ -12,11 +12,15 @@ agnostic.
 from __future__ import print_function
 
 import os
+import threading
 import timeit
 import pwd
 
 import bash_utils as bash
 
+# the start times of the running timers of each thread (see timer)
+_TIMERS = threading.local()
+
 
 def find_owner(element):
     """Find the owner of a file or folder
@@ -29,39 +33,69 @@ def find_owner(element):
     return pwd.getpwuid(os.stat(element).st_uid).pw_name
 
 
+def _native_exists(path, check, sudo):
+    """Checks if a path exists without running any command
+
+    :param path: the path to be validated
+    :param check: os.path.isdir or os.path.isfile
+    :param sudo: True if the path may require root permission
+    :return: True or False if the check is conclusive, None if it needs to
+        be done with root permission
+    """
+    if check(path):
+        return True
+    if not sudo or os.geteuid() == 0:
+        return False
+    # the path does not exist for the current user, the check is only
+    # conclusive if the user can search its parent directory
+    parent = os.path.dirname(os.path.abspath(path))
+    if os.path.isdir(parent) and os.access(parent, os.X_OK):
+        return False
+    return None
+
+
 def isdir(path, sudo=True):
     """Validates if a directory exist in a host.
 
+    The directory is checked in-process, sudo is only used when the current
+    user can not check it.
+
     :param path: the path of the directory to be validated
     :param sudo: this needs to be set to True for directories that require
     root permission
     :return: True if the directory exists, False otherwise
     """
-    status, _ = bash.run_command(
-        '{prefix}test -d {path}'.format(
-            path=path, prefix='sudo ' if sudo else ''))
-    exist = True if not status else False
+    exist = _native_exists(os.path.expanduser(path), os.path.isdir, sudo)
+    if exist is None:
+        status, _ = bash.run_command('sudo test -d {path}'.format(path=path))
+        exist = True if not status else False
     return exist
 
 
 def isfile(path, sudo=True):
     """Validates if a file exist in a host.
 
+    The file is checked in-process, sudo is only used when the current user
+    can not check it.
+
     :param path: the absolute path of the file to be validated
     :param sudo: this needs to be set to True for files that require
     root permission
     :return: True if the file exists, False otherwise
     """
-    status, _ = bash.run_command(
-        '{prefix}test -f {path}'.format(
-            path=path, prefix='sudo ' if sudo else ''))
-    exist = True if not status else False
+    exist = _native_exists(os.path.expanduser(path), os.path.isfile, sudo)
+    if exist is None:
+        status, _ = bash.run_command('sudo test -f {path}'.format(path=path))
+        exist = True if not status else False
     return exist
 
 
 def timer(action, print_elapsed_time=True):
     """Function that works as a timer, with a start/stop button.
 
+    The timers can be nested (stop stops the last timer started) and each
+    thread has its own timers. See Utils/tracing.py to trace phases.
+
     :param action: the action to perform, the valid options are:
         - start: start a counter for an operation
         - stop: stop the current time
@@ -70,16 +104,14 @@ def timer(action, print_elapsed_time=True):
     :return: the elapsed_time string variable
     """
     elapsed_time = 0
+    starts = _TIMERS.__dict__.setdefault('starts', [])
     if action.lower() == 'start':
-        start = timeit.default_timer()
-        os.environ['START_TIME'] = str(start)
+        starts.append(timeit.default_timer())
     elif action.lower() == 'stop':
-        if 'START_TIME' not in os.environ:
+        if not starts:
             bash.message('err', 'you need to start the timer first')
             return None
-        stop = timeit.default_timer()
-        total_time = stop - float(os.environ['START_TIME'])
-        del os.environ['START_TIME']
+        total_time = timeit.default_timer() - starts.pop()
 
         # output running time in a nice format.
         minutes, seconds = divmod(total_time, 60)
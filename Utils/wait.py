@@ -0,0 +1,305 @@
+"""Wait for conditions with deadlines, backoff and event sources.
+
+wait_for checks a condition until it holds or its deadline expires. Between
+two checks it sleeps with an exponential backoff, or, if an event source is
+given, until the source reports that something changed (whatever happens
+first), so the wait returns as soon as the condition holds instead of after
+the worst-case sleep. The available event sources are:
+- Notifier: notified by the code (e.g. a libvirt domain lifecycle event
+    callback, see hipervisor/backends.py).
+- FileWatch: inotify events of a folder (e.g. a file is created or written).
+- ProcessWatch: the exit of a process (pidfd).
+The backoff is still used as a safety net when a source is given, and the
+sources fall back to plain polling when they are not supported by the
+system.
+
+Example:
+
+from Utils import wait
+wait.wait_for_file('/var/log/console.txt', timeout=60, pattern='login:')
+wait.wait_for_process_exit(pid, timeout=10)
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import re
+import select
+import threading
+import time
+
+# the first and the maximum sleep between two checks of a condition
+DEFAULT_INTERVAL = 0.05
+DEFAULT_MAX_INTERVAL = 2.0
+BACKOFF_FACTOR = 2
+
+# inotify flags and events (see inotify(7))
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+FILE_EVENTS = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO |
+               IN_CREATE | IN_DELETE)
+
+# the pidfd_open system call number (the same in all the architectures)
+SYS_PIDFD_OPEN = 434
+
+_monotonic = getattr(time, 'monotonic', time.time)
+
+
+class WaitTimeout(RuntimeError):
+    """The condition did not hold before the deadline"""
+
+
+class Deadline(object):
+    """A point in time (monotonic clock) when a wait expires
+
+    :param timeout: the seconds from now, None for no deadline
+    """
+
+    __slots__ = ('timeout', 'end')
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.end = None if timeout is None else _monotonic() + timeout
+
+    def remaining(self):
+        """The seconds left (None if there is no deadline)"""
+        if self.end is None:
+            return None
+        return max(0.0, self.end - _monotonic())
+
+    def expired(self):
+        """Checks if the deadline passed"""
+        return self.end is not None and _monotonic() >= self.end
+
+
+def backoff(interval=DEFAULT_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL,
+            factor=BACKOFF_FACTOR):
+    """Generate the delays of an exponential backoff
+
+    :param interval: the first delay in seconds
+    :param max_interval: the maximum delay in seconds
+    :param factor: the factor applied to the delay after each step
+    :return: an infinite generator of delays
+    """
+    while True:
+        yield interval
+        interval = min(interval * factor, max_interval)
+
+
+class Notifier(object):
+    """An event source that is notified by the code"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def notify(self):
+        """Wake up the waits using this source"""
+        self._event.set()
+
+    def wait(self, timeout):
+        """Wait until the source is notified or the timeout expires"""
+        self._event.wait(timeout)
+        self._event.clear()
+
+    def close(self):
+        """Release the resources of the source (nothing to do)"""
+
+
+def _libc():
+    """Load the C library (None if it is not available)"""
+    try:
+        return ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+    except OSError:
+        return None
+
+
+class _FileDescriptorSource(object):
+    """An event source that is ready when a file descriptor is readable"""
+
+    def __init__(self, descriptor):
+        # None means that the source is not supported (polling is used)
+        self.descriptor = descriptor
+
+    def wait(self, timeout):
+        """Wait until the source has events or the timeout expires"""
+        if self.descriptor is None:
+            time.sleep(timeout or 0)
+            return
+        readable, _, _ = select.select([self.descriptor], [], [], timeout)
+        if readable:
+            self._drain()
+
+    def _drain(self):
+        """Consume the events of the source"""
+
+    def close(self):
+        """Close the file descriptor of the source"""
+        if self.descriptor is not None:
+            os.close(self.descriptor)
+            self.descriptor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class FileWatch(_FileDescriptorSource):
+    """An event source for the changes of the files of a folder (inotify)
+
+    :param path: a file or a folder, for a file its folder is watched (so the
+        file can be created after the watch)
+    :param events: the inotify events that wake up the waits
+    """
+
+    def __init__(self, path, events=FILE_EVENTS):
+        folder = path if os.path.isdir(path) else os.path.dirname(
+            os.path.abspath(path))
+        descriptor = None
+        libc = _libc()
+        if libc is not None and hasattr(libc, 'inotify_init1'):
+            descriptor = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if descriptor < 0:
+                descriptor = None
+            elif libc.inotify_add_watch(
+                    descriptor, folder.encode('utf-8'), events) < 0:
+                os.close(descriptor)
+                descriptor = None
+        super(FileWatch, self).__init__(descriptor)
+
+    def _drain(self):
+        while True:
+            try:
+                if not os.read(self.descriptor, 4096):
+                    return
+            except OSError as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+
+
+class ProcessWatch(_FileDescriptorSource):
+    """An event source for the exit of a process (pidfd)
+
+    :param pid: the id of the process
+    """
+
+    def __init__(self, pid):
+        descriptor = None
+        try:
+            if hasattr(os, 'pidfd_open'):
+                descriptor = os.pidfd_open(pid)
+            else:
+                libc = _libc()
+                if libc is not None:
+                    descriptor = libc.syscall(SYS_PIDFD_OPEN, pid, 0)
+                    if descriptor < 0:
+                        descriptor = None
+        except OSError:
+            descriptor = None
+        super(ProcessWatch, self).__init__(descriptor)
+
+
+def wait_for(condition, timeout=None, source=None,
+             interval=DEFAULT_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL,
+             message=None):
+    """Wait until a condition holds
+
+    :param condition: a callable without arguments, the condition holds when
+        it returns a true value
+    :param timeout: the maximum time to wait in seconds (None to wait
+        forever)
+    :param source: an event source (e.g. Notifier, FileWatch or
+        ProcessWatch), the condition is checked again as soon as the source
+        reports an event
+    :param interval: the first delay between two checks in seconds
+    :param max_interval: the maximum delay between two checks in seconds
+    :param message: the message of the exception raised on timeout
+    :return: the value returned by the condition
+    :raises WaitTimeout: if the condition did not hold before the timeout
+    """
+    deadline = Deadline(timeout)
+
+    for delay in backoff(interval, max_interval):
+        result = condition()
+        if result:
+            return result
+        remaining = deadline.remaining()
+        if remaining is not None:
+            if remaining <= 0:
+                raise WaitTimeout(message or 'condition not met after {}s'
+                                  .format(timeout))
+            delay = min(delay, remaining)
+        if source is None:
+            time.sleep(delay)
+        else:
+            source.wait(delay)
+
+
+def process_exists(pid):
+    """Checks if a process is running (the zombie processes are not)
+
+    :param pid: the id of the process
+    :return: True if the process exists, False otherwise
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as err:
+        if err.errno == errno.ESRCH:
+            return False
+    try:
+        with open('/proc/{}/stat'.format(pid)) as stat:
+            return stat.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except (IOError, OSError, IndexError):
+        return True
+
+
+def wait_for_process_exit(pid, timeout=None):
+    """Wait until a process exits
+
+    :param pid: the id of the process
+    :param timeout: the maximum time to wait in seconds
+    :raises WaitTimeout: if the process is still running after the timeout
+    """
+    with ProcessWatch(pid) as source:
+        wait_for(lambda: not process_exists(pid), timeout, source,
+                 message='{0}: still running after {1}s'.format(
+                     pid, timeout))
+
+
+def wait_for_file(path, timeout=None, pattern=None):
+    """Wait until a file exists (and it contains a pattern)
+
+    :param path: the path of the file
+    :param timeout: the maximum time to wait in seconds
+    :param pattern: a regular expression searched in the content of the file
+    :return: the match object if a pattern is given, True otherwise
+    :raises WaitTimeout: if the condition did not hold before the timeout
+    """
+    if pattern is not None and not hasattr(pattern, 'search'):
+        pattern = re.compile(pattern)
+
+    def condition():
+        if not os.path.isfile(path):
+            return False
+        if pattern is None:
+            return True
+        try:
+            with open(path) as content:
+                return pattern.search(content.read())
+        except (IOError, OSError):
+            return False
+
+    with FileWatch(path) as source:
+        return wait_for(condition, timeout, source,
+                        message='{0}: not ready after {1}s'.format(
+                            path, timeout))
@@ -0,0 +1,131 @@
+"""Load yaml files in a fast and safe way.
+
+The yaml files are always loaded with the safe loader, the C implementation
+(libyaml) is used when it is available and the pure python one otherwise.
+
+The parsed documents are cached in memory by path, a document is only parsed
+again when its file is modified (its mtime or size changed). Optionally the
+parsed documents can also be cached on disk (json format), so different
+processes (e.g. consecutive runs of hipervisor/setup.py) do not need to parse
+the same big yaml file again. The cache files are only data, loading a
+tampered one can not run code. The documents that json can not represent as
+they are (e.g. dates or keys that are not strings) are not cached on disk.
+
+Example:
+
+from Utils import yaml_loader
+configurations = yaml_loader.load('setup.yml', disk_cache=True)
+"""
+
+import copy
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import yaml
+
+# the C loader is only available if PyYAML was built with libyaml
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# the folder where the parsed documents are cached on disk
+CACHE_DIR = os.environ.get(
+    'STX_YAML_CACHE_DIR', os.path.join(
+        os.path.expanduser('~'), '.cache', 'stx-suite', 'yaml'))
+
+# parsed documents: absolute path -> (key, document)
+_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def _file_key(path):
+    """Get the key that identifies the current version of a file"""
+    status = os.stat(path)
+    return status.st_mtime, status.st_size
+
+
+def _cache_file(path):
+    """Get the path of the on-disk cache of a yaml file"""
+    name = hashlib.sha1(path.encode('utf-8')).hexdigest()
+    return os.path.join(CACHE_DIR, '{}.json'.format(name))
+
+
+def _load_from_disk(path, key):
+    """Get a document from the on-disk cache
+
+    :return: the document or None if it is not cached (or it is outdated)
+    """
+    try:
+        with open(_cache_file(path)) as cache_file:
+            cached = json.load(cache_file)
+        if cached['path'] != path or tuple(cached['key']) != key:
+            return None
+        return cached['document']
+    except (IOError, OSError, ValueError, TypeError, KeyError):
+        return None
+
+
+def _save_to_disk(path, key, document):
+    """Save a document in the on-disk cache, errors are ignored"""
+    try:
+        content = json.dumps({'path': path, 'key': key,
+                              'document': document})
+    except (TypeError, ValueError):
+        return
+    if json.loads(content)['document'] != document:
+        # json would change the document (e.g. integer keys)
+        return
+    try:
+        if not os.path.exists(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+        file_descriptor, temporary = tempfile.mkstemp(
+            dir=CACHE_DIR, suffix='.tmp')
+        with os.fdopen(file_descriptor, 'w') as cache_file:
+            cache_file.write(content)
+        os.rename(temporary, _cache_file(path))
+    except (IOError, OSError):
+        pass
+
+
+def loads(stream):
+    """Parse a yaml document with the safe loader
+
+    :param stream: an string or an opened file with the yaml document
+    :return: the parsed document
+    """
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def load(path, disk_cache=False):
+    """Load a yaml file
+
+    :param path: the path of the yaml file
+    :param disk_cache: if True the parsed document is also cached on disk
+    :return: the parsed document, it is a copy of the cached one so it can be
+        modified by the caller
+    """
+    path = os.path.abspath(path)
+    key = _file_key(path)
+
+    with _CACHE_LOCK:
+        cached = _CACHE.get(path)
+    if cached and cached[0] == key:
+        return copy.deepcopy(cached[1])
+
+    document = _load_from_disk(path, key) if disk_cache else None
+    if document is None:
+        with open(path) as yaml_file:
+            document = loads(yaml_file)
+        if disk_cache:
+            _save_to_disk(path, key, document)
+
+    with _CACHE_LOCK:
+        _CACHE[path] = (key, document)
+    return copy.deepcopy(document)
+
+
+def clear_cache():
+    """Remove all the documents from the memory cache"""
+    with _CACHE_LOCK:
+        _CACHE.clear()
@@ -0,0 +1,425 @@
+"""Hypervisor backends used to manage the lab domains.
+
+A backend performs the domain operations needed to provision a lab (state
+query, destroy, undefine, define from XML and start). The following backends
+are available:
+
+- libvirt: uses the libvirt python bindings through one persistent connection
+    that is shared by all the threads, no process is spawned per operation.
+- virsh: uses `sudo virsh` commands, this is the fallback when the libvirt
+    bindings are not installed.
+- fake: keeps the domains in memory, it is intended to exercise/benchmark the
+    provisioning flow without libvirtd.
+
+To get a backend use the get_backend function:
+
+from hipervisor import backends
+backend = backends.get_backend('auto')
+if backend.state('controller-0') == backends.RUNNING:
+    backend.destroy('controller-0')
+"""
+
+import os
+import re
+import tempfile
+import threading
+import time
+
+from Utils import bash_utils as bash
+from Utils import wait
+
+try:
+    import libvirt
+except ImportError:
+    libvirt = None
+
+# the connection used by virt-manager/virsh for the system domains
+DEFAULT_URI = 'te:///system'
+
+# domain states (same strings reported by `virsh domstate`)
+NO_STATE = 'no state'
+RUNNING = 'running'
+IDLE = 'idle'
+PAUSED = 'paused'
+IN_SHUTDOWN = 'in shutdown'
+SHUT_OFF = 'shut off'
+CRASHED = 'crashed'
+PM_SUSPENDED = 'pmsuspended'
+
+# libvirt virDomainState values in order
+LIBVIRT_STATES = (NO_STATE, RUNNING, IDLE, PAUSED, IN_SHUTDOWN, SHUT_OFF,
+                  CRASHED, PM_SUSPENDED)
+
+BACKENDS = ('auto', 'libvirt', 'virsh', 'fake')
+
+# the default maximum time to wait for a domain state change in seconds
+STATE_TIMEOUT = 60
+
+# the libvirt event loop is started once per process
+_EVENT_LOOP_LOCK = threading.Lock()
+_EVENT_LOOP = []
+
+
+class Backend(object):
+    """Interface of the hypervisor backends"""
+
+    name = None
+
+    def state(self, domain):
+        """Get the state of a domain
+
+        :param domain: the name of the domain
+        :return: the state of the domain (e.g. RUNNING, SHUT_OFF) or None if
+            the domain does not exist
+        """
+        raise NotImplementedError
+
+    def domains(self):
+        """Get the names of all the defined domains
+
+        :return: a list with the names of the domains
+        """
+        raise NotImplementedError
+
+    def exists(self, domain):
+        """Checks if a domain is defined
+
+        :param domain: the name of the domain
+        :return: True if the domain exists, False otherwise
+        """
+        return self.state(domain) is not None
+
+    def destroy(self, domain):
+        """Stop a running domain immediately
+
+        :param domain: the name of the domain
+        """
+        raise NotImplementedError
+
+    def undefine(self, domain):
+        """Remove the definition of a domain
+
+        :param domain: the name of the domain
+        """
+        raise NotImplementedError
+
+    def define(self, xml):
+        """Define a persistent domain from its XML (it is not started)
+
+        :param xml: the domain XML as an string
+        :return: the name of the domain defined
+        """
+        raise NotImplementedError
+
+    def start(self, domain):
+        """Start a defined domain
+
+        :param domain: the name of the domain
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release the resources used by the backend (if any)"""
+
+    def _state_source(self, domain):
+        """Get the event source of the state changes of a domain
+
+        :return: a Utils.wait event source or None to poll the state
+        """
+        return None
+
+    def wait_for_state(self, domain, states, timeout=STATE_TIMEOUT):
+        """Wait until a domain is in one of the given states
+
+        :param domain: the name of the domain
+        :param states: a list of states (e.g. [SHUT_OFF]), None can be
+            included to also accept a domain that does not exist
+        :param timeout: the maximum time to wait in seconds
+        :raises Utils.wait.WaitTimeout: if the domain is not in any of the
+            states after the timeout
+        """
+        wait.wait_for(
+            lambda: self.state(domain) in states, timeout,
+            self._state_source(domain),
+            message='{0}: not in {1} after {2}s'.format(
+                domain, ', '.join(str(state) for state in states), timeout))
+
+
+def _start_event_loop():
+    """Start the libvirt event loop in a daemon thread (only once)
+
+    The event loop needs to be registered before opening the connections
+    whose events are dispatched.
+    """
+    with _EVENT_LOOP_LOCK:
+        if _EVENT_LOOP:
+            return
+        libvirt.virEventRegisterDefaultImpl()
+
+        def run():
+            while True:
+                libvirt.virEventRunDefaultImpl()
+
+        thread = threading.Thread(target=run, name='libvirt-events')
+        thread.daemon = True
+        thread.start()
+        _EVENT_LOOP.append(thread)
+
+
+class LibvirtBackend(Backend):
+    """Backend that uses one persistent libvirt connection"""
+
+    name = 'libvirt'
+
+    def __init__(self, uri=DEFAULT_URI):
+        if libvirt is None:
+            raise ImportError('libvirt python bindings are not installed')
+        self.uri = uri
+        self._connection = None
+        self._lock = threading.Lock()
+        # domain name -> wait.Notifier notified by the lifecycle events
+        self._notifiers = {}
+
+    @property
+    def connection(self):
+        """The libvirt connection, it is (re)opened when needed
+
+        libvirt connections are thread safe, so the same connection is shared
+        by all the provisioning threads.
+        """
+        with self._lock:
+            if self._connection is None or not self._connection.isAlive():
+                _start_event_loop()
+                self._connection = libvirt.open(self.uri)
+                if self._connection is None:
+                    raise RuntimeError('{}: unable to connect'.format(
+                        self.uri))
+                try:
+                    self._connection.domainEventRegisterAny(
+                        None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+                        self._lifecycle_event, None)
+                except libvirt.libvirtError:
+                    # the state changes are polled without the events
+                    pass
+            return self._connection
+
+    def _lifecycle_event(self, connection, dom, event, detail, opaque):
+        """Wake up the waits of a domain when its state changes"""
+        notifier = self._notifiers.get(dom.name())
+        if notifier is not None:
+            notifier.notify()
+
+    def _state_source(self, domain):
+        with self._lock:
+            return self._notifiers.setdefault(domain, wait.Notifier())
+
+    def _lookup(self, domain):
+        """Get a domain object by name
+
+        :param domain: the name of the domain
+        :return: the virDomain object or None if the domain does not exist
+        """
+        try:
+            return self.connection.lookupByName(domain)
+        except libvirt.libvirtError as err:
+            if err.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
+                return None
+            raise
+
+    def _get(self, domain):
+        """Get a domain object by name
+
+        :raises RuntimeError: if the domain does not exist
+        """
+        dom = self._lookup(domain)
+        if dom is None:
+            raise RuntimeError('{}: domain not found'.format(domain))
+        return dom
+
+    def state(self, domain):
+        dom = self._lookup(domain)
+        if dom is None:
+            return None
+        state, _ = dom.state()
+        return LIBVIRT_STATES[state] if state < len(LIBVIRT_STATES) else (
+            NO_STATE)
+
+    def domains(self):
+        return [dom.name() for dom in self.connection.listAllDomains()]
+
+    def destroy(self, domain):
+        self._get(domain).destroy()
+
+    def undefine(self, domain):
+        self._get(domain).undefine()
+
+    def define(self, xml):
+        return self.connection.defineXML(xml).name()
+
+    def start(self, domain):
+        self._get(domain).create()
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class VirshBackend(Backend):
+    """Backend that uses `sudo virsh` commands"""
+
+    name = 'virsh'
+
+    def __init__(self, prefix='sudo '):
+        self.prefix = prefix
+
+    def _virsh(self, arguments, raise_exception=True):
+        """Run a virsh command
+
+        :param arguments: the arguments of the virsh command
+        :param raise_exception: raise an exception if the command fails
+        :return: the tuple returned by bash_utils.run_command
+        """
+        code, output = bash.run_command(
+            '{0}virsh {1}'.format(self.prefix, arguments),
+            raise_exception=raise_exception)
+        if isinstance(output, bytes):
+            output = output.decode('utf-8')
+        return code, output
+
+    def state(self, domain):
+        code, output = self._virsh(
+            'domstate {}'.format(domain), raise_exception=False)
+        return None if code else output
+
+    def domains(self):
+        _, output = self._virsh('list --all --name')
+        return [line.strip() for line in output.splitlines() if line.strip()]
+
+    def destroy(self, domain):
+        self._virsh('destroy {}'.format(domain))
+
+    def undefine(self, domain):
+        self._virsh('undefine {}'.format(domain))
+
+    def define(self, xml):
+        xml_file = tempfile.NamedTemporaryFile(
+            mode='w', suffix='.xml', delete=False)
+        try:
+            with xml_file:
+                xml_file.write(xml)
+            self._virsh('define {}'.format(xml_file.name))
+        finally:
+            os.remove(xml_file.name)
+        return domain_name(xml)
+
+    def start(self, domain):
+        self._virsh('start {}'.format(domain))
+
+
+class FakeBackend(Backend):
+    """In memory backend
+
+    :param latency: seconds to wait in each operation in order to simulate
+        the hypervisor response time when benchmarking.
+    """
+
+    name = 'fake'
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        # domain name -> {'xml': xml, 'state': state}
+        self.defined = {}
+        # list of (operation, domain) tuples in the order they were called
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _operation(self, operation, domain):
+        """Register an operation and simulate the hypervisor latency"""
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls.append((operation, domain))
+
+    def _get(self, domain):
+        if domain not in self.defined:
+            raise RuntimeError('{}: domain not found'.format(domain))
+        return self.defined[domain]
+
+    def state(self, domain):
+        self._operation('state', domain)
+        with self._lock:
+            dom = self.defined.get(domain)
+            return dom['state'] if dom else None
+
+    def domains(self):
+        self._operation('domains', None)
+        with self._lock:
+            return sorted(self.defined)
+
+    def destroy(self, domain):
+        self._operation('destroy', domain)
+        with self._lock:
+            dom = self._get(domain)
+            if dom['state'] == SHUT_OFF:
+                raise RuntimeError('{}: domain is not running'.format(domain))
+            dom['state'] = SHUT_OFF
+
+    def undefine(self, domain):
+        self._operation('undefine', domain)
+        with self._lock:
+            self._get(domain)
+            del self.defined[domain]
+
+    def define(self, xml):
+        domain = domain_name(xml)
+        self._operation('define', domain)
+        with self._lock:
+            dom = self.defined.setdefault(domain, {'state': SHUT_OFF})
+            dom['xml'] = xml
+        return domain
+
+    def start(self, domain):
+        self._operation('start', domain)
+        with self._lock:
+            dom = self._get(domain)
+            if dom['state'] == RUNNING:
+                raise RuntimeError('{}: domain is already active'.format(
+                    domain))
+            dom['state'] = RUNNING
+
+
+def domain_name(xml):
+    """Get the name of a domain from its XML
+
+    :param xml: the domain XML as an string
+    :return: the name of the domain
+    :raises ValueError: if the XML does not have a name
+    """
+    match = re.search(r'<name>\s*(.*?)\s*</name>', xml)
+    if not match:
+        raise ValueError('the domain XML does not have a name')
+    return match.group(1)
+
+
+def get_backend(name='auto', uri=DEFAULT_URI):
+    """Get a hypervisor backend
+
+    :param name: the backend to be used, the valid options are:
+        - auto: libvirt if the bindings are installed, virsh otherwise
+        - libvirt, virsh, fake: see the module description
+    :param uri: the libvirt connection URI (only used by libvirt backend)
+    :return: the backend object
+    """
+    if name == 'auto':
+        name = 'libvirt' if libvirt is not None else 'virsh'
+
+    if name == 'libvirt':
+        return LibvirtBackend(uri=uri)
+    elif name == 'virsh':
+        return VirshBackend()
+    elif name == 'fake':
+        return FakeBackend()
+
+    raise ValueError('{}: invalid backend'.format(name))
@@ -0,0 +1,179 @@
+"""Provision the disk images of the lab nodes.
+
+The following strategies are supported for each disk (topology.Disk):
+- fresh: a new empty qcow2 image is created (the node is installed from the
+    ISO).
+- overlay: a qcow2 image backed by a shared read-only image (e.g. a golden
+    image of an already installed node) is created. Only the differences
+    with the backing image are written in the overlay, so creating it takes
+    milliseconds and the lab can be reset without reinstalling it.
+
+The preallocation mode of the image (off, metadata or falloc) is passed to
+te-img for both strategies.
+
+If the disk is marked as reusable, an existing image that matches the disk
+specification (format, size and backing image) is kept instead of being
+recreated. The images are inspected reading the qcow2 header in-process, so
+no process is spawned to check them.
+"""
+
+import errno
+import json
+import logging
+import os
+import struct
+
+from Utils import bash_utils as bash
+
+LOG = logging.getLogger(__name__)
+
+FRESH = 'fresh'
+OVERLAY = 'overlay'
+STRATEGIES = (FRESH, OVERLAY)
+
+PREALLOCATION_MODES = ('off', 'metadata', 'falloc')
+
+# qcow2 header: magic, version, backing_file_offset, backing_file_size,
+# cluster_bits, size (big endian)
+QCOW2_MAGIC = b'QFI\xfb'
+QCOW2_HEADER = struct.Struct('>4sIQIIQ')
+
+GIGABYTE = 1024 ** 3
+
+
+def _read_qcow2_header(image):
+    """Get the information of an image from its qcow2 header
+
+    :param image: an opened image file (binary mode)
+    :return: a dictionary with the format, virtual-size (bytes) and
+        backing-filename (None if the image does not have one)
+    """
+    header = image.read(QCOW2_HEADER.size)
+    if len(header) < QCOW2_HEADER.size:
+        return {'format': 'raw', 'virtual-size': None,
+                'backing-filename': None}
+
+    (magic, _, backing_offset, backing_size, _,
+     size) = QCOW2_HEADER.unpack(header)
+    if magic != QCOW2_MAGIC:
+        return {'format': 'raw', 'virtual-size': None,
+                'backing-filename': None}
+
+    backing = None
+    if backing_offset:
+        image.seek(backing_offset)
+        backing = image.read(backing_size).decode('utf-8')
+
+    return {'format': 'qcow2', 'virtual-size': size,
+            'backing-filename': backing}
+
+
+def image_info(path):
+    """Get the information of a disk image
+
+    The qcow2 header is read in-process, te-img is only used when the image
+    can not be read by the current user.
+
+    :param path: the path of the image
+    :return: a dictionary with the format, virtual-size (bytes) and
+        backing-filename of the image, None if the image does not exist
+    """
+    try:
+        with open(path, 'rb') as image:
+            return _read_qcow2_header(image)
+    except (IOError, OSError) as err:
+        if err.errno == errno.ENOENT:
+            return None
+        if err.errno != errno.EACCES:
+            raise
+
+    code, output = bash.run_command(
+        'sudo te-img info --output=json {}'.format(path))
+    if code:
+        return None
+    info = json.loads(output)
+    return {'format': info.get('format'),
+            'virtual-size': info.get('virtual-size'),
+            'backing-filename': info.get('backing-filename')}
+
+
+def is_reusable(disk):
+    """Checks if the existing image of a disk matches its specification
+
+    :param disk: the topology.Disk object
+    :return: True if the image exists and it can be kept, False otherwise
+    """
+    info = image_info(disk.path)
+    if info is None:
+        return False
+
+    return (info['format'] == 'qcow2' and
+            info['virtual-size'] == disk.size * GIGABYTE and
+            info['backing-filename'] == (disk.backing or None))
+
+
+def create_command(disk):
+    """Get the te-img command to create a disk
+
+    :param disk: the topology.Disk object
+    :return: the command as an string
+    """
+    options = []
+    if disk.preallocation != 'off':
+        options.append('-o preallocation={}'.format(disk.preallocation))
+    if disk.strategy == OVERLAY:
+        options.append('-b {} -F qcow2'.format(disk.backing))
+
+    return 'sudo te-img create -f qcow2 {0}{1} {2}G'.format(
+        ''.join('{} '.format(option) for option in options), disk.path,
+        disk.size)
+
+
+def create(disk):
+    """Create the image of a disk, deleting the previous one (if any)
+
+    :param disk: the topology.Disk object
+    """
+    if disk.strategy == OVERLAY and not os.path.isfile(disk.backing):
+        raise IOError('{}: backing image does not exists'.format(
+            disk.backing))
+
+    delete(disk.path)
+    LOG.info('creating: {0} ({1})'.format(disk.path, disk.strategy))
+    bash.run_command(create_command(disk), raise_exception=True)
+
+
+def resize(disk):
+    """Grow the image of a disk to the size of its specification
+
+    :param disk: the topology.Disk object
+    """
+    LOG.info('resizing: {0} ({1}G)'.format(disk.path, disk.size))
+    bash.run_command('sudo te-img resize {0} {1}G'.format(
+        disk.path, disk.size), raise_exception=True)
+
+
+def delete(path):
+    """Delete a disk image
+
+    :param path: the path of the image
+    """
+    LOG.info('deleting: {}'.format(path))
+    bash.run_command('sudo rm -rf {}'.format(path), raise_exception=True)
+
+
+def provision(disk):
+    """Provision a disk according to its specification
+
+    Any previous image of the disk is deleted from the system unless it is
+    reusable (see is_reusable).
+
+    :param disk: the topology.Disk object
+    :return: True if the image was created, False if it was kept
+    """
+    if disk.reuse and is_reusable(disk):
+        LOG.info('reusing: {}'.format(disk.path))
+        return False
+
+    create(disk)
+    return True
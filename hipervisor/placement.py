@@ -0,0 +1,145 @@
+"""Place the lab nodes in the NUMA nodes (cells) of the host.
+
+The nodes that request CPU pinning (cpu_pinning) or hugepages (hugepages) in
+the yaml file are placed in a single NUMA cell of the host, so their vCPUs
+and memory are local to each other:
+- cpu_pinning: every vCPU of the node is pinned to a dedicated host CPU of
+    the cell (no host CPU is shared between two pinned vCPUs), the emulator
+    threads are pinned to the reserved CPUs of the cell (the ones left for
+    the host OS, see os_system_cores) or to the vCPUs of the node if the cell
+    does not have reserved CPUs.
+- hugepages: the memory of the node is backed by hugepages of the given
+    size, allocated from the cell.
+
+The placement is a best-fit decreasing packing: the biggest nodes are placed
+first, each one in the cell that will have the fewest free CPUs left after
+placing it (so the big gaps are kept for the big nodes). A cell is only
+chosen if it has enough free CPUs, memory and hugepages for the node, so no
+cell is ever oversubscribed. A node never spans several cells.
+"""
+
+import copy
+
+
+class PlacementError(RuntimeError):
+    """The nodes do not fit in the NUMA nodes of the host"""
+
+
+class Placement(object):
+    """Where a node runs in the host
+
+    :param cell: the id of the host NUMA node
+    :param cpus: the host CPUs of each vCPU (empty if the node is not pinned)
+    :param emulator_cpus: the host CPUs of the emulator threads (empty if
+        the node is not pinned)
+    """
+
+    __slots__ = ('cell', 'cpus', 'emulator_cpus')
+
+    def __init__(self, cell, cpus=(), emulator_cpus=()):
+        self.cell = cell
+        self.cpus = list(cpus)
+        self.emulator_cpus = list(emulator_cpus)
+
+    def __repr__(self):
+        return 'Placement(cell={0}, cpus={1})'.format(self.cell, self.cpus)
+
+
+def cpu_set(cpus):
+    """Format a list of CPUs in the libvirt cpuset format (e.g. 0-3,8)
+
+    :param cpus: a list of CPU ids
+    :return: the cpuset as an string
+    """
+    ranges = []
+    for cpu in sorted(set(cpus)):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(
+        str(first) if first == last else '{0}-{1}'.format(first, last)
+        for first, last in ranges)
+
+
+def _fits(cell, node, free_cpus, use_total_memory):
+    """Checks if a node fits in a cell"""
+    if node.pinning and len(free_cpus[cell.node_id]) < node.cores:
+        return False
+
+    if node.hugepages:
+        pages = cell.hugepages.get(node.hugepages, {}).get('free', 0)
+        if use_total_memory:
+            pages = cell.hugepages.get(node.hugepages, {}).get('total', 0)
+        return pages * node.hugepages // 1024 >= node.memory
+
+    memory = cell.memory_total if use_total_memory else cell.memory_free
+    return memory >= node.memory
+
+
+def _consume(cell, node):
+    """Subtract the memory/hugepages of a node from a cell"""
+    if node.hugepages:
+        pages = cell.hugepages[node.hugepages]
+        needed = -(-node.memory * 1024 // node.hugepages)
+        pages['free'] -= needed
+        pages['total'] -= needed
+    else:
+        cell.memory_free -= node.memory
+        cell.memory_total -= node.memory
+
+
+def place(nodes, snapshot, reserved_cpus=0, use_total_memory=False):
+    """Place the nodes that need it in the NUMA nodes of the host
+
+    :param nodes: a list of topology.NodeSpec objects, only the nodes with
+        pinning or hugepages are placed
+    :param snapshot: the Utils.host.HostSnapshot of the host
+    :param reserved_cpus: the number of host CPUs reserved for the host OS,
+        the first CPUs of the host are reserved
+    :param use_total_memory: if True the total memory/hugepages of the cells
+        are used instead of the free ones (e.g. when the nodes are already
+        running and using the memory)
+    :return: a dictionary with the node names as keys and Placement objects
+        as values
+    :raises PlacementError: if a node does not fit in any cell
+    """
+    # the snapshot is not modified, the capacity is consumed from a copy
+    cells = copy.deepcopy(snapshot.numa_nodes)
+    host_cpus = sorted(cpu for cell in cells for cpu in cell.cpus)
+    reserved = set(host_cpus[:reserved_cpus])
+    free_cpus = dict(
+        (cell.node_id, [cpu for cpu in cell.cpus if cpu not in reserved])
+        for cell in cells)
+
+    placements = {}
+    pending = [node for node in nodes if node.pinning or node.hugepages]
+    # best-fit decreasing: the biggest nodes are placed first
+    pending.sort(key=lambda node: (-node.cores if node.pinning else 0,
+                                   -node.memory, node.name))
+
+    for node in pending:
+        candidates = [cell for cell in cells
+                      if _fits(cell, node, free_cpus, use_total_memory)]
+        if not candidates:
+            raise PlacementError(
+                '{0}: does not fit in any NUMA node of the host ({1} cores, '
+                '{2} MiB{3})'.format(
+                    node.name, node.cores, node.memory,
+                    ', {} KiB hugepages'.format(node.hugepages)
+                    if node.hugepages else ''))
+
+        cell = min(candidates, key=lambda cell: (
+            len(free_cpus[cell.node_id]) - (
+                node.cores if node.pinning else 0), cell.node_id))
+        _consume(cell, node)
+
+        cpus, emulator_cpus = [], []
+        if node.pinning:
+            cpus = free_cpus[cell.node_id][:node.cores]
+            free_cpus[cell.node_id] = free_cpus[cell.node_id][node.cores:]
+            emulator_cpus = [cpu for cpu in cell.cpus if cpu in reserved]
+            emulator_cpus = emulator_cpus or cpus
+        placements[node.name] = Placement(cell.node_id, cpus, emulator_cpus)
+
+    return placements
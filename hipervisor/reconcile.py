@@ -0,0 +1,359 @@
+"""Reconcile an existing lab with the topology defined in the yaml file.
+
+Instead of deleting and recreating every node, the desired state (the nodes
+from the yaml file and their rendered XML) is compared with the actual state
+of the host:
+- the domains defined in the hypervisor.
+- the format, size and backing image of each disk image.
+- the hash of the XML used to define each domain, which is recorded in a
+  state file (vms/state.json) every time a domain is defined.
+
+From the differences a plan with the minimal set of actions is built:
+- create: the domain does not exist, its disks are provisioned and it is
+    defined.
+- stop: the domain is running and some of its disks or its XML need to be
+    changed (a running domain only uses a new XML after a power cycle).
+- create-disk/recreate-disk/resize: a disk is missing, does not match its
+    specification or is smaller than its specification (shrinking a disk is
+    not possible, so it is recreated).
+- redefine: the rendered XML of the domain changed.
+- delete: the domain is not in the yaml file anymore, it is destroyed,
+    undefined and its disks are deleted.
+- start: a domain stopped by the reconciliation is started again once it
+    was changed, and controller-0 is started at the end if it is not
+    running.
+
+Running the reconciliation on a lab that is up to date does nothing.
+"""
+
+from __future__ import print_function
+
+import collections
+import functools
+import hashlib
+import itertools
+import json
+import logging
+import re
+
+from hipervisor import backends
+from hipervisor import disks
+from hipervisor import scheduler
+from hipervisor import templates
+
+LOG = logging.getLogger(__name__)
+
+STATE_FILE = 'state.json'
+
+# the domains managed by this tool
+MANAGED_DOMAIN = re.compile(r'^controller-\d+(-compute-\d+)?$')
+
+# actions
+CREATE = 'create'
+STOP = 'stop'
+CREATE_DISK = 'create-disk'
+RECREATE_DISK = 'recreate-disk'
+RESIZE = 'resize'
+REDEFINE = 'redefine'
+DELETE = 'delete'
+START = 'start'
+
+DISK_ACTIONS = (CREATE_DISK, RECREATE_DISK, RESIZE)
+
+
+class Action(object):
+    """An action of the reconciliation plan
+
+    :param node: the name of the node
+    :param kind: the kind of action (see the module description)
+    :param detail: a human readable description of the action
+    :param target: the object the action is applied to (e.g. the
+        topology.Disk for the disk actions), if any
+    """
+
+    __slots__ = ('node', 'kind', 'detail', 'target')
+
+    def __init__(self, node, kind, detail='', target=None):
+        self.node = node
+        self.kind = kind
+        self.detail = detail
+        self.target = target
+
+    def __str__(self):
+        if self.detail:
+            return '{0}: {1} ({2})'.format(self.node, self.kind, self.detail)
+        return '{0}: {1}'.format(self.node, self.kind)
+
+
+def xml_hash(xml):
+    """Get the hash of a domain XML
+
+    :param xml: the domain XML as an string
+    :return: the sha256 hash of the XML
+    """
+    return hashlib.sha256(xml.encode('utf-8')).hexdigest()
+
+
+def load_state(path):
+    """Load the state file
+
+    :param path: the path of the state file
+    :return: a dictionary with the node names as keys and a dictionary with
+        the xml hash and the disk paths of the node as values
+    """
+    try:
+        with open(path) as state_file:
+            return json.load(state_file)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def save_state(path, state):
+    """Save the state file atomically
+
+    :param path: the path of the state file
+    :param state: the state dictionary (see load_state)
+    """
+    templates.write_file(path, json.dumps(state, indent=2, sort_keys=True))
+
+
+def record(state, node, xml):
+    """Record in the state that a node was defined with an XML
+
+    :param state: the state dictionary (see load_state)
+    :param node: the topology.NodeSpec object of the node
+    :param xml: the XML used to define the node
+    """
+    state[node.name] = {'xml': xml_hash(xml),
+                        'disks': [disk.path for disk in node.disks]}
+
+
+def disk_actions(node):
+    """Get the actions needed to make the disks of a node match their specs
+
+    :param node: the topology.NodeSpec object of the node
+    :return: a list of Action objects
+    """
+    actions = []
+
+    for disk in node.disks:
+        info = disks.image_info(disk.path)
+        size = disk.size * disks.GIGABYTE
+        if info is None:
+            actions.append(Action(
+                node.name, CREATE_DISK, '{0}: {1}G'.format(
+                    disk.path, disk.size), disk))
+        elif (info['format'] != 'qcow2' or
+              info['backing-filename'] != (disk.backing or None) or
+              info['virtual-size'] > size):
+            actions.append(Action(
+                node.name, RECREATE_DISK, '{0}: does not match the '
+                'specification'.format(disk.path), disk))
+        elif info['virtual-size'] < size:
+            actions.append(Action(
+                node.name, RESIZE, '{0}: {1}G -> {2}G'.format(
+                    disk.path, info['virtual-size'] // disks.GIGABYTE,
+                    disk.size), disk))
+
+    return actions
+
+
+def plan(nodes, rendered, backend, state):
+    """Build the reconciliation plan
+
+    :param nodes: the list of topology.NodeSpec objects from the yaml file
+    :param rendered: a dictionary with the rendered XML of each node
+    :param backend: the hypervisor backend (see backends module)
+    :param state: the state dictionary (see load_state)
+    :return: a list of Action objects, the actions of each node are in the
+        order they need to be applied
+    """
+    actions = []
+    desired = set(node.name for node in nodes)
+    existing = set(backend.domains())
+
+    for node in nodes:
+        if node.name not in existing:
+            actions.append(Action(node.name, CREATE, '{0} disk(s)'.format(
+                len(node.disks))))
+            continue
+
+        node_disk_actions = disk_actions(node)
+        xml_changed = state.get(node.name, {}).get('xml') != xml_hash(
+            rendered[node.name])
+        running = backend.state(node.name) != backends.SHUT_OFF
+        stop = running and (node_disk_actions or xml_changed)
+        if stop:
+            actions.append(Action(node.name, STOP, 'its {} change'.format(
+                'disks' if node_disk_actions else 'xml')))
+        actions.extend(node_disk_actions)
+
+        if xml_changed:
+            actions.append(Action(node.name, REDEFINE, 'xml changed'))
+        # controller-0 is started at the end (after the rest of the nodes)
+        if stop and node.name != 'controller-0':
+            actions.append(Action(node.name, START, 'it was running'))
+
+    for name in sorted((existing | set(state)) - desired):
+        if not MANAGED_DOMAIN.match(name):
+            continue
+        actions.append(Action(
+            name, DELETE, 'not in the yaml file',
+            state.get(name, {}).get('disks', [])))
+
+    # controller-0 needs to be running at the end of the reconciliation
+    stopped = set(action.node for action in actions
+                  if action.kind in (CREATE, STOP))
+    if 'controller-0' in desired and (
+            'controller-0' in stopped or
+            backend.state('controller-0') != backends.RUNNING):
+        actions.append(Action('controller-0', START))
+
+    return actions
+
+
+def print_plan(actions):
+    """Print the reconciliation plan in the console and the log
+
+    :param actions: the list of Action objects (see plan)
+    """
+    if not actions:
+        message = 'the lab is up to date, nothing to do'
+        print(message)
+        LOG.info(message)
+        return
+
+    print('reconciliation plan ({} actions):'.format(len(actions)))
+    LOG.info('reconciliation plan ({} actions):'.format(len(actions)))
+    for action in actions:
+        print('  {}'.format(action))
+        LOG.info('  {}'.format(action))
+
+
+def _delete_node(backend, name, paths):
+    """Destroy and undefine a domain and delete its disks"""
+    state = backend.state(name)
+    if state not in (None, backends.SHUT_OFF):
+        # a paused or suspended domain is also active, undefining it would
+        # leave it running as a transient domain
+        _stop_node(backend, name)
+    if state is not None:
+        backend.undefine(name)
+    for path in paths:
+        disks.delete(path)
+
+
+def _stop_node(backend, name):
+    """Destroy a domain and wait until it is shut off"""
+    backend.destroy(name)
+    backend.wait_for_state(name, (backends.SHUT_OFF,))
+
+
+def _create_node(backend, node, xml):
+    """Provision the disks of a domain and define it"""
+    for disk in node.disks:
+        disks.provision(disk)
+    backend.define(xml)
+
+
+def _action_callable(action, backend, nodes, rendered):
+    """Get the callable that applies an action"""
+    node = nodes.get(action.node)
+
+    if action.kind == CREATE:
+        return functools.partial(
+            _create_node, backend, node, rendered[node.name])
+    elif action.kind == STOP:
+        return functools.partial(_stop_node, backend, action.node)
+    elif action.kind in (CREATE_DISK, RECREATE_DISK):
+        return functools.partial(disks.create, action.target)
+    elif action.kind == RESIZE:
+        return functools.partial(disks.resize, action.target)
+    elif action.kind == REDEFINE:
+        return functools.partial(backend.define, rendered[node.name])
+    elif action.kind == DELETE:
+        return functools.partial(
+            _delete_node, backend, action.node, action.target)
+    elif action.kind == START:
+        return functools.partial(backend.start, action.node)
+
+    raise ValueError('{}: invalid action'.format(action.kind))
+
+
+def apply_plan(actions, nodes, rendered, backend, state, state_path,
+               workers=scheduler.DEFAULT_WORKERS):
+    """Apply the reconciliation plan
+
+    The actions of each node are applied in order (the disk actions of a node
+    in parallel), the nodes are reconciled in parallel and controller-0 is
+    started at the end (the rest of the nodes are started again in their own
+    order of actions). The state file is updated for every node that was
+    reconciled successfully.
+
+    :param actions: the list of Action objects (see plan)
+    :param nodes: the list of topology.NodeSpec objects from the yaml file
+    :param rendered: a dictionary with the rendered XML of each node
+    :param backend: the hypervisor backend (see backends module)
+    :param state: the state dictionary (see load_state)
+    :param state_path: the path of the state file
+    :param workers: the maximum number of actions to apply at the same time
+    :return: the dictionary returned by scheduler.Scheduler.run
+    """
+    nodes = dict((node.name, node) for node in nodes)
+    provisioning = scheduler.Scheduler(workers=workers)
+
+    # group the actions by node keeping their order
+    node_actions = collections.OrderedDict()
+    start = None
+    for action in actions:
+        if action.kind == START and action.node == 'controller-0':
+            start = action
+        else:
+            node_actions.setdefault(action.node, []).append(action)
+
+    # the names of the last tasks of each node
+    last_tasks = {}
+
+    for name, node_action_list in node_actions.items():
+        previous = []
+        number = 0
+        for is_disk, group in itertools.groupby(
+                node_action_list,
+                key=lambda action: action.kind in DISK_ACTIONS):
+            group = list(group)
+            # the disks of a node are changed in parallel, the rest of the
+            # actions are applied one after another
+            batches = [group] if is_disk else [[action] for action in group]
+            for batch in batches:
+                tasks = []
+                for action in batch:
+                    task = '{0}:{1}-{2}'.format(name, action.kind, number)
+                    number += 1
+                    provisioning.add(
+                        task, name,
+                        _action_callable(action, backend, nodes, rendered),
+                        depends=previous)
+                    tasks.append(task)
+                previous = tasks
+        last_tasks[name] = previous
+
+    if start is not None:
+        provisioning.add(
+            '{}:start'.format(start.node), start.node,
+            _action_callable(start, backend, nodes, rendered),
+            depends=last_tasks.get(start.node, []),
+            after=[task for name, tasks in last_tasks.items()
+                   if name != start.node for task in tasks])
+
+    nodes_tasks = provisioning.run()
+
+    for name, tasks in nodes_tasks.items():
+        if any(task.status != scheduler.DONE for task in tasks):
+            continue
+        if name in nodes:
+            record(state, nodes[name], rendered[name])
+        else:
+            state.pop(name, None)
+    save_state(state_path, state)
+
+    return nodes_tasks
@@ -0,0 +1,248 @@
+"""Dependency-aware scheduler used to provision the lab nodes.
+
+The provisioning of a lab is described as a graph of small tasks (e.g. delete
+the old domain, create a partition, render the XML, define the domain). Every
+task belongs to a node (controller-0, controller-0-compute-1, ...) and can
+depend on other tasks. The scheduler runs every task whose dependencies are
+satisfied in a bounded pool of worker threads, so the slow and I/O bound
+operations of different nodes overlap instead of running one after another.
+
+There are two kinds of dependencies:
+- depends: hard dependencies, if any of them fails the task is skipped.
+- after: ordering dependencies, the task waits for them to finish but it is
+    executed even if they failed (e.g. controller-0 must be started after
+    every node was defined, but a broken compute must not prevent it).
+
+A failure is isolated to the node where it happened: the remaining tasks of
+that node are skipped and the rest of the nodes keep being provisioned. A task
+that raises SystemExit or KeyboardInterrupt (e.g. exit_dict_status) stops the
+scheduling instead: the tasks already running are waited for, the rest are
+skipped and the exception is raised again by run.
+
+Example:
+
+scheduler = Scheduler(workers=4)
+scheduler.add('controller-0:disk-0', 'controller-0', create_disk)
+scheduler.add('controller-0:define', 'controller-0', define,
+              depends=['controller-0:disk-0'])
+scheduler.run()
+"""
+
+import collections
+import logging
+from multiprocessing.pool import ThreadPool
+import timeit
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+LOG = logging.getLogger(__name__)
+
+# default number of tasks executed at the same time
+DEFAULT_WORKERS = 4
+
+# task status
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+class Task(object):
+    """A single unit of work of the provisioning graph"""
+
+    __slots__ = ('name', 'node', 'action', 'depends', 'after', 'status',
+                 'error', 'elapsed')
+
+    def __init__(self, name, node, action, depends=(), after=()):
+        self.name = name
+        self.node = node
+        self.action = action
+        self.depends = tuple(depends)
+        self.after = tuple(after)
+        self.status = PENDING
+        self.error = None
+        self.elapsed = 0.0
+
+
+class Scheduler(object):
+    """Runs a graph of tasks in a bounded pool of worker threads"""
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        if workers < 1:
+            raise ValueError('workers: must be at least 1')
+        self.workers = workers
+        self.tasks = collections.OrderedDict()
+
+    def add(self, name, node, action, depends=(), after=()):
+        """Adds a task to the graph.
+
+        :param name: the unique name of the task
+        :param node: the name of the node the task belongs to
+        :param action: a callable without arguments that performs the work,
+            any exception raised by it marks the task as failed (SystemExit
+            and KeyboardInterrupt also stop the scheduling, see run)
+        :param depends: names of the tasks that must finish successfully
+            before this one
+        :param after: names of the tasks that must finish (successfully or
+            not) before this one
+        :return: the task added
+        """
+        if name in self.tasks:
+            raise ValueError('{}: task already defined'.format(name))
+        task = Task(name, node, action, depends, after)
+        self.tasks[name] = task
+        return task
+
+    def _check_graph(self):
+        """Validates that every dependency exists and that there are no cycles
+
+        :raises ValueError: if the graph is not valid
+        """
+        for task in self.tasks.values():
+            for dependency in task.depends + task.after:
+                if dependency not in self.tasks:
+                    raise ValueError('{0}: unknown dependency {1}'.format(
+                        task.name, dependency))
+
+        # depth first search keeping the tasks in the current path
+        visited, path = set(), set()
+
+        def visit(name):
+            if name in path:
+                raise ValueError('{}: dependency cycle detected'.format(name))
+            if name in visited:
+                return
+            path.add(name)
+            task = self.tasks[name]
+            for dependency in task.depends + task.after:
+                visit(dependency)
+            path.remove(name)
+            visited.add(name)
+
+        for name in self.tasks:
+            visit(name)
+
+    @staticmethod
+    def _execute(task):
+        """Executes a task in a worker thread catching any error
+
+        :param task: the task to be executed
+        :return: a tuple with the task, the error raised (if any) and the
+            elapsed time in seconds
+        """
+        start = timeit.default_timer()
+        error = None
+        try:
+            task.action()
+        except BaseException as err:  # pylint: disable=broad-except
+            # also SystemExit, the dispatcher waits for every task it started
+            error = err
+        return task, error, timeit.default_timer() - start
+
+    @staticmethod
+    def _ready(task, finished):
+        """Checks if all the dependencies of a task have finished"""
+        return all(dependency in finished
+                   for dependency in task.depends + task.after)
+
+    def run(self):
+        """Runs all the tasks of the graph.
+
+        :return: a dictionary with the node names as keys and the list of
+            its tasks as values
+        :raises SystemExit, KeyboardInterrupt: if a task raised it, once the
+            running tasks finished (the pending ones are skipped)
+        """
+        self._check_graph()
+        pending = list(self.tasks.values())
+        finished = set()
+        running = 0
+        completed = queue.Queue()
+        pool = ThreadPool(processes=self.workers)
+        # the task that raised SystemExit or KeyboardInterrupt
+        aborted = None
+
+        try:
+            while pending or running:
+                progressed = False
+                for task in list(pending) if aborted is None else []:
+                    if not self._ready(task, finished):
+                        continue
+                    pending.remove(task)
+                    progressed = True
+                    failed = [dependency for dependency in task.depends
+                              if self.tasks[dependency].status != DONE]
+                    if failed:
+                        task.status = SKIPPED
+                        task.error = 'dependency not satisfied: {}'.format(
+                            ', '.join(failed))
+                        finished.add(task.name)
+                        LOG.warning('{0}: skipped ({1})'.format(
+                            task.name, task.error))
+                        continue
+                    LOG.info('{}: started'.format(task.name))
+                    pool.apply_async(
+                        self._execute, (task,), callback=completed.put)
+                    running += 1
+
+                if not running:
+                    if aborted is not None:
+                        break
+                    if not progressed:
+                        raise RuntimeError('tasks can not be scheduled: {}'
+                                           .format(', '.join(
+                                               task.name for task in pending)))
+                    # skipped tasks can make new tasks ready
+                    continue
+
+                task, error, elapsed = completed.get()
+                running -= 1
+                task.elapsed = elapsed
+                finished.add(task.name)
+                # the fields of the structured logs (see Utils/logger.py)
+                fields = {'node': task.node, 'duration': round(elapsed, 3),
+                          'phase': task.name.split(':', 1)[-1]}
+                if error is None:
+                    task.status = DONE
+                    LOG.info('{0}: done ({1:.2f}s)'.format(task.name, elapsed),
+                             extra=fields)
+                else:
+                    task.status = FAILED
+                    task.error = error
+                    LOG.error('{0}: failed ({1})'.format(task.name, error),
+                              extra=fields)
+                    if aborted is None and not isinstance(error, Exception):
+                        aborted = task
+
+            if aborted is not None:
+                for task in pending:
+                    task.status = SKIPPED
+                    task.error = 'aborted by {0} ({1})'.format(
+                        aborted.name, type(aborted.error).__name__)
+                    LOG.warning('{0}: skipped ({1})'.format(
+                        task.name, task.error))
+                raise aborted.error
+        finally:
+            pool.close()
+            pool.join()
+
+        return self.report()
+
+    def report(self):
+        """Groups the tasks by node
+
+        :return: a dictionary with the node names as keys and the list of
+            its tasks as values
+        """
+        nodes = collections.OrderedDict()
+        for task in self.tasks.values():
+            nodes.setdefault(task.node, []).append(task)
+        return nodes
+
+    def failed_nodes(self):
+        """Returns the names of the nodes with failed or skipped tasks"""
+        return [node for node, tasks in self.report().items()
+                if any(task.status in (FAILED, SKIPPED) for task in tasks)]
@@ -2,10 +2,8 @@ from __future__ import print_function
 
 import argparse
 from argparse import RawDescriptionHelpFormatter
-from imp import reload
-import multiprocessing
+import functools
 import os
-import re
 from shutil import rmtree
 import sys
 
@@ -16,13 +14,21 @@ sys.path.append(SUITE_DIR)
 
 from Config import config
 from Utils import bash_utils as bash
+from Utils import host
 from Utils import logger
 from Utils import network
+from Utils import tracing
+from hipervisor import backends
+from hipervisor import disks
+from hipervisor import placement
+from hipervisor import reconcile
+from hipervisor import scheduler
+from hipervisor import templates
+from hipervisor import topology
 import kmodpy
-import yaml
 
-# reloading config.ini
-reload(config)
+# reading config.ini again only if it changed since it was loaded
+config.reload_if_changed()
 
 # Global variables
 THIS_PATH = os.path.dirname(os.path.abspath(__file__))
@@ -83,13 +89,15 @@ def check_preconditions():
         os.environ['DISPLAY'] = ':0'
 
 
-def get_system_memory(configurations):
+def get_system_memory(general, snapshot):
     """Get the system memory
 
     The aim of this function is to get the system memory to be setup with QEMU.
 
-    :param: configurations
-        - which is an object with the values loaded from the yml.
+    :param: general
+        - which is the general_system_configurations loaded from the yml.
+    :param: snapshot
+        - which is the Utils.host.HostSnapshot of the host.
     :return:
         - system_free_memory: which is the total system free memory.
         - recommended_system_free_memory: which is the recommended system free
@@ -97,30 +105,24 @@ def get_system_memory(configurations):
     """
 
     # calculating the system memory to be assigned (value in megabytes)
-    # os_system_memory will return 0 if either key1 or key2 does not exists
-    os_system_memory = configurations.get(
-        'general_system_configurations', 0).get("os_system_memory", 0)
-    system_free_memory = map(
-        int, os.popen('free -m | grep Mem').readlines()[-1][4:].split())[-1]
+    # os_system_memory will return 0 if the key does not exists
+    os_system_memory = general.get("os_system_memory", 0)
+    # the available memory is limited by the cgroup of this process (if any)
+    system_free_memory = snapshot.usable_memory
     # subtracting OS system memory
     recommended_system_free_memory = system_free_memory - os_system_memory
 
     return system_free_memory, recommended_system_free_memory
 
 
-def get_free_disk_space(configurations):
-    # disk_space_allocated_to_os will return 0 if either key1 or key2 does
-    # not exists
-    disk_space_allocated_to_os = configurations.get(
-        'general_system_configurations', 0).get(
-            "disk_space_allocated_to_os", 0)
+def get_free_disk_space(general, snapshot):
+    # disk_space_allocated_to_os will return 0 if the key does not exists
+    disk_space_allocated_to_os = general.get("disk_space_allocated_to_os", 0)
     # the mount point in which will be calculated the free space in disk
-    default_mount_point = configurations.get(
-        'general_system_configurations', 0).get(
-            "default_mount_point", '/')
-    statvfs = os.statvfs(default_mount_point)
-    # the following value will be get in megabytes
-    system_free_disk_size = statvfs.f_frsize * statvfs.f_bavail / 1000000000
+    default_mount_point = general.get("default_mount_point", '/')
+    # the following value will be get in gigabytes (the same unit used for
+    # the partitions in the yaml)
+    system_free_disk_size = snapshot.free_disk(default_mount_point)
     # subtracting the 20% of the total disk free
     recommended_system_free_disk_size = (
         (100 - disk_space_allocated_to_os) * system_free_disk_size / 100)
@@ -128,21 +130,33 @@ def get_free_disk_space(configurations):
     return system_free_disk_size, recommended_system_free_disk_size
 
 
-def get_system_resources(configurations):
-    # os_system_cores will return 0 if either key1 or key2 does not exists
-    os_system_cores = configurations.get(
-        'general_system_configurations', 0).get("os_system_cores", 0)
+def get_system_resources(general, snapshot=None):
+    """Get the system resources
+
+    :param general: which is the general_system_configurations loaded from
+        the yml.
+    :param snapshot: the Utils.host.HostSnapshot of the host, if not set a new
+        snapshot is taken.
+    """
+    if snapshot is None:
+        snapshot = host.snapshot(
+            paths=[general.get("default_mount_point", '/')])
+
+    # os_system_cores will return 0 if the key does not exists
+    os_system_cores = general.get("os_system_cores", 0)
 
     # Getting the system free memory and the recommended system memory
     system_free_memory, recommended_system_free_memory = get_system_memory(
-        configurations)
+        general, snapshot)
 
     # Getting the system free disk size and the recommended system free (GB)
     system_free_disk_size, recommended_system_free_disk_size = (
-        get_free_disk_space(configurations))
+        get_free_disk_space(general, snapshot))
 
-    # Calculating the system cores to be assigned to the controller/computes
-    recommended_system_cores = multiprocessing.cpu_count() - os_system_cores
+    # Calculating the system cores to be assigned to the controller/computes,
+    # only the cores this process is allowed to use are taken into account
+    # (affinity and cgroup limits)
+    recommended_system_cores = snapshot.usable_cpus - os_system_cores
 
     return (
         system_free_memory, recommended_system_free_memory,
@@ -150,7 +164,7 @@ def get_system_resources(configurations):
         recommended_system_cores)
 
 
-def check_disk_memory_size_system_cores(configurations):
+def check_disk_memory_size_system_cores(lab, snapshot=None):
     """Check basic configurations.
 
     The aim of this function is to check the following aspects before to
@@ -162,101 +176,20 @@ def check_disk_memory_size_system_cores(configurations):
     - checks if the system cores setup by the user in the yaml is less than the
         recommended system cores.
 
-    :param configurations: which is the object that contains all the
-        configurations from the yaml file.
+    :param lab: which is the topology.Topology object loaded from the yaml
+        file.
+    :param snapshot: the Utils.host.HostSnapshot of the host, if not set a new
+        snapshot is taken.
     """
-    # checking how many configurations the yaml file has
-    configurations_keys = configurations.keys()
-    regex = re.compile('configuration_.')
-    total_configurations = list(filter(regex.match, configurations_keys))
-
     # getting the system recommendations
     (system_free_memory, recommended_system_free_memory, system_free_disk_size,
      recommended_system_free_disk_size,
-     recommended_system_cores) = get_system_resources(configurations)
-
-    # iterating over the total configurations setup in yaml file in order to
-    # get the disk/memory space assigned by the user
-    user_memory_defined, user_disk_space_defined, user_system_cores_defined = (
-        0, 0, 0)
-
-    for configuration in range(0, len(total_configurations)):
-        # iterating over the configurations
-
-        current_controller = 'controller-{}'.format(configuration)
-        # controller will return NoneType if either key1 or key2 does
-        # not exists
-        controller = configurations.get(
-            'configuration_{}'.format(configuration), {}).get(
-                'controller-{}'.format(configuration), {})
-        controller_partition_a = int(controller.get(
-            'controller_{}_partition_a'.format(configuration)))
-        controller_partition_b = int(controller.get(
-            'controller_{}_partition_b'.format(configuration)))
-        controller_memory = int(controller.get(
-            'controller_{}_memory_size'.format(configuration)))
-        controller_system_cores = int(controller.get(
-            'controller_{}_system_cores'.format(configuration)))
-
-        # checking if the current controller at least has 1 cpu assigned in
-        # order to avoid the following error:
-        # error: XML error: Invalid CPU topology
-        if controller_system_cores < 1:
-            LOG.error('{}: must have assigned at least 1 core'.format(
-                current_controller))
-            exit_dict_status(1)
-
-        # checking how many computes the current controller has
-        compute_keys = configurations.get('configuration_{}'.format(
-            configuration), {}).keys()
-        regex = re.compile('controller-{0}-compute-.'.format(configuration))
-        total_computes = list(filter(regex.match, compute_keys))
-
-        for compute_number in range(0, len(total_computes)):
-            current_compute = '{0}-compute-{1}'.format(
-                current_controller, compute_number)
-            # compute will return NoneType if either key1 or key2 does
-            # not exists  controller_1_compute_2:
-            compute = configurations.get('configuration_{}'.format(
-                configuration), {}).get(
-                    'controller-{0}-compute-{1}'.format(
-                        configuration, compute_number), {})
-            compute_partition_a = int(compute.get(
-                'controller_{0}_compute_{1}_partition_a'.format(
-                    configuration, compute_number)))
-            compute_partition_b = int(compute.get(
-                'controller_{0}_compute_{1}_partition_b'.format(
-                    configuration, compute_number)))
-            compute_memory = int(compute.get(
-                'controller_{0}_compute_{1}_memory_size'.format(
-                    configuration, compute_number)))
-            compute_system_cores = int(compute.get(
-                'controller_{0}_compute_{1}_system_cores'.format(
-                    configuration, compute_number)))
-
-            # checking if the current compute at least has 1 cpu assigned in
-            # order to avoid the following error:
-            # error: XML error: Invalid CPU topology
-            if compute_system_cores < 1:
-                LOG.error('{}: must have assigned at least 1 core'.format(
-                    current_compute))
-                exit_dict_status(1)
-
-            # increasing the variables (computes loop)
-            user_disk_space_defined = (
-                user_disk_space_defined + compute_partition_a +
-                compute_partition_b)
-            user_memory_defined = user_memory_defined + compute_memory
-            user_system_cores_defined = (
-                user_system_cores_defined + compute_system_cores)
-
-        # increasing the variables (controller loop)
-        user_disk_space_defined = (
-            user_disk_space_defined + controller_partition_a +
-            controller_partition_b)
-        user_memory_defined = user_memory_defined + controller_memory
-        user_system_cores_defined = (
-            user_system_cores_defined + controller_system_cores)
+     recommended_system_cores) = get_system_resources(lab.general, snapshot)
+
+    # the totals assigned by the user are computed when the yaml is loaded
+    user_memory_defined = lab.memory
+    user_disk_space_defined = lab.disk
+    user_system_cores_defined = lab.cores
 
     # checking the conditions defined in the yaml
     if user_memory_defined > recommended_system_free_memory:
@@ -288,9 +221,100 @@ def check_disk_memory_size_system_cores(configurations):
         exit_dict_status(1)
 
 
-def setup_controller_computes(iso_file, configurations):
+def delete_domain(backend, name):
+    """Delete a domain (if any)
+
+    :param backend: the hypervisor backend (see backends module)
+    :param name: the name of the domain to be deleted
+    """
+    # checking if the domain exists in order to delete it
+    state = backend.state(name)
+
+    if state is not None:
+        if state != backends.SHUT_OFF:
+            LOG.info('{}: is running, shutting down and destroy it'.format(
+                name))
+            try:
+                backend.destroy(name)
+                backend.wait_for_state(name, (backends.SHUT_OFF, None))
+            except Exception as err:  # pylint: disable=broad-except
+                LOG.warning('{0}: could not be destroyed ({1})'.format(
+                    name, err))
+        backend.undefine(name)
+
+
+def render_xml(node, rendered):
+    """Render the xml of a domain from its template
+
+    The xml is kept in memory to be defined and it is also written in the vms
+    folder for reference.
+
+    :param node: the topology.NodeSpec object of the node
+    :param rendered: a dictionary where the xml is stored (node name as key)
+    """
+    xml = templates.render(os.path.join(THIS_PATH, node.template), node)
+    templates.write_file(
+        os.path.join(THIS_PATH, 'vms', '{}.xml'.format(node.name)), xml)
+    rendered[node.name] = xml
+
+
+def add_node_tasks(scheduler, backend, node, rendered):
+    """Add the tasks to provision a node to the scheduler
+
+    The graph for each node is the following:
+    cleanup -> disk-0, disk-1 -> define <- xml
+
+    :param scheduler: the scheduler.Scheduler object
+    :param backend: the hypervisor backend (see backends module)
+    :param node: the topology.NodeSpec object of the node
+    :param rendered: a dictionary shared by the tasks to pass the rendered
+        xml of each node to the define task
+    """
+    name = node.name
+    task = '{0}:{1}'.format
+    disk_tasks = [task(name, 'disk-{}'.format(number))
+                  for number in range(len(node.disks))]
+
+    scheduler.add(task(name, 'cleanup'), name,
+                  functools.partial(delete_domain, backend, name))
+    for disk_task, disk in zip(disk_tasks, node.disks):
+        scheduler.add(disk_task, name,
+                      functools.partial(disks.provision, disk),
+                      depends=[task(name, 'cleanup')])
+    scheduler.add(task(name, 'xml'), name,
+                  functools.partial(render_xml, node, rendered))
+    scheduler.add(task(name, 'define'), name,
+                  lambda: backend.define(rendered[name]),
+                  depends=disk_tasks + [task(name, 'xml')])
+
+
+def report_provisioning(nodes_tasks):
+    """Log the result of the provisioning of each node
+
+    :param nodes_tasks: the dictionary returned by scheduler.Scheduler.run
+    :return: the list of nodes that could not be provisioned
+    """
+    failed_nodes = []
+
+    for node, tasks in nodes_tasks.items():
+        errors = [task for task in tasks if task.status != scheduler.DONE]
+        elapsed = sum(task.elapsed for task in tasks)
+        if not errors:
+            LOG.info('{0}: provisioned ({1:.2f}s)'.format(node, elapsed),
+                     extra={'node': node, 'phase': 'provision',
+                            'duration': round(elapsed, 3)})
+            continue
+        failed_nodes.append(node)
+        for task in errors:
+            LOG.error('{0}: {1} ({2})'.format(
+                task.name, task.status, task.error))
+
+    return failed_nodes
+
+
+def configure_libvirt():
+    """Configure libvirt in the host"""
     # define the module's variables
-    libvirt_images_path = '/var/lib/libvirt/images'
     default_xml = '/etc/libvirt/some_foldernetworks/autostart/default.xml'
     conf_file = '/etc/libvirt/configuration_file.conf'
 
@@ -301,228 +325,119 @@ def setup_controller_computes(iso_file, configurations):
 
     parameters = ['user = "root"', 'group = "root"']
 
-    for param in parameters:
-        status, output = bash.run_command(
-            "sudo cat {0} | grep -w '^{1}'".format(conf_file, param))
-        if status:
+    # the parameters are checked in the same shell session
+    checks = bash.run_batch([
+        "sudo cat {0} | grep -w '^{1}'".format(conf_file, param)
+        for param in parameters])
+    for param, check in zip(parameters, checks):
+        if check.returncode:
             # this mean that the param is not in conf_file
             bash.run_command(
                 "echo '{0}' | sudo tee -a {1}".format(param, conf_file),
                 raise_exception=True)
 
-    # ===================================
-    # configuring the network interfaces
-    # ===================================
-    network.delete_network_interfaces()
-    network.configure_network_interfaces()
-
-    if os.path.exists(os.path.join(THIS_PATH, 'vms')):
-        rmtree(os.path.join(THIS_PATH, 'vms'))
-
-    os.mkdir(os.path.join(THIS_PATH, 'vms'))
-
-    # checking how many configurations the yaml file has
-    configurations_keys = configurations.keys()
-    regex = re.compile('configuration_.')
-    total_configurations = list(filter(regex.match, configurations_keys))
-
-    # ----------------------------------------------------------
-    # iterating over the total configurations setup in yaml file
-    # ----------------------------------------------------------
-
-    for configuration in range(0, len(total_configurations)):
-        # iterating over the configurations
-        current_controller_name = 'controller-{}'.format(configuration)
-        # controller will return NoneType if either key1 or key2 does
-        # not exists
-        controller = configurations.get(
-            'configuration_{}'.format(configuration), {}).get(
-                'controller-{}'.format(configuration), {})
-        controller_partition_a = int(controller.get(
-            'controller_{}_partition_a'.format(configuration)))
-        controller_partition_b = int(controller.get(
-            'controller_{}_partition_b'.format(configuration)))
-        controller_memory = int(controller.get(
-            'controller_{}_memory_size'.format(configuration)))
-        controller_system_cores = int(controller.get(
-            'controller_{}_system_cores'.format(configuration)))
-
-        # checking if the current controller exists in order to delete it
-        output, command = bash.run_command('sudo virsh domstate {}'.format(
-            current_controller_name))
-
-        if not output:
-            LOG.info('{}: is running, shutting down and destroy it...'.format(
-                current_controller_name))
-            bash.run_command('sudo virsh destroy {} > /dev/null 2>&1'.format(
-                current_controller_name))
-            bash.run_command('sudo virsh undefine {} > /dev/null 2>&1'.format(
-                current_controller_name), raise_exception=True)
-
-        # deleting both controller's partitions from the system (if any)
-        LOG.info('deleting: {0}/{1}-0.img'.format(
-            libvirt_images_path, current_controller_name))
-        bash.run_command('sudo rm -rf {0}/{1}-0.img'.format(
-            libvirt_images_path, current_controller_name),
-                         raise_exception=True)
-        LOG.info('deleting: {0}/{1}-1.img'.format(
-            libvirt_images_path, current_controller_name))
-        bash.run_command('sudo rm -rf {0}/{1}-1.img'.format(
-            libvirt_images_path, current_controller_name),
-                         raise_exception=True)
-
-        # creating both controller's partitions in the system
-        bash.run_command(
-            'sudo te-img create -f qcow2 {0}/{1}-0.img {2}G'.format(
-                libvirt_images_path, current_controller_name,
-                controller_partition_a), raise_exception=True)
-        bash.run_command(
-            'sudo te-img create -f qcow2 {0}/{1}-1.img {2}G'.format(
-                libvirt_images_path, current_controller_name,
-                controller_partition_b), raise_exception=True)
-
-        # Only controller-0 needs to have the ISO file in order to boot the
-        # subsequent controllers
-        check_controller = False if configuration else True
-
-        if check_controller:
-            # this mean that is the controller-0
-            bash.run_command(
-                'sed -e "s,NAME,{0}," '
-                '-e "s,ISO,{1}," '
-                '-e "s,UNIT,MiB," '
-                '-e "s,MEMORY,{2}," '
-                '-e "s,CORES,{3}," '
-                '-e "s,DISK0,{4}/{0}-0.img," '
-                '-e "s,DISK1,{4}/{0}-1.img," '
-                '-e "s,destroy,restart," {5}/master_controller.xml > '
-                '{5}/vms/{0}.xml'.format(
-                    current_controller_name, iso_file, controller_memory,
-                    controller_system_cores, libvirt_images_path, THIS_PATH),
-                raise_exception=True)
-        else:
-            # this mean that is the controller-N
-            # modifying xml parameters for the current controller
-            bash.run_command(
-                'sed -e "s,NAME,{0}," '
-                '-e "s,UNIT,MiB," '
-                '-e "s,MEMORY,{1}," '
-                '-e "s,CORES,{2}," '
-                '-e "s,DISK0,{3}/{0}-0.img," '
-                '-e "s,DISK1,{3}/{0}-1.img," '
-                '-e "s,destroy,restart," {4}/slave_controller.xml > '
-                '{4}/vms/{0}.xml'.format(
-                    current_controller_name, controller_memory,
-                    controller_system_cores, libvirt_images_path, THIS_PATH),
-                raise_exception=True)
-
-        # checking how many computes the current controller has
-        compute_keys = configurations.get('configuration_{}'.format(
-            configuration), {}).keys()
-        regex = re.compile('controller-{0}-compute-.'.format(configuration))
-        total_computes = list(filter(regex.match, compute_keys))
-
-        for compute_number in range(0, len(total_computes)):
-            current_compute_number = 'controller-{0}-compute-{1}'.format(
-                configuration, compute_number)
-            # compute will return NoneType if either key1 or key2 does
-            # not exists
-            compute = configurations.get('configuration_{}'.format(
-                configuration), {}).get(
-                    'controller-{0}-compute-{1}'.format(
-                        configuration, compute_number), {})
-            compute_partition_a = int(compute.get(
-                'controller_{0}_compute_{1}_partition_a'.format(
-                    configuration, compute_number)))
-            compute_partition_b = int(compute.get(
-                'controller_{0}_compute_{1}_partition_b'.format(
-                    configuration, compute_number)))
-            compute_memory = int(compute.get(
-                'controller_{0}_compute_{1}_memory_size'.format(
-                    configuration, compute_number)))
-            compute_system_cores = int(compute.get(
-                'controller_{0}_compute_{1}_system_cores'.format(
-                    configuration, compute_number)))
-
-            # checking if the compute exists
-            code, output = bash.run_command('sudo virsh domstate {}'.format(
-                current_compute_number))
-
-            if not code and output != 'shut off':
-                LOG.info('{}: is running, shutting down and destroy it'.format(
-                    current_compute_number))
-                bash.run_command('sudo virsh destroy {}'.format(
-                    current_compute_number))
-                bash.run_command('sudo virsh undefine {}'.format(
-                    current_compute_number), raise_exception=True)
-
-            # removing the compute's partitions (if any)
-            bash.run_command('sudo rm -rf {0}/{1}.img'.format(
-                libvirt_images_path, current_compute_number),
-                             raise_exception=True)
-            bash.run_command(
-                'cp {0}/compute.xml {0}/vms/{1}.xml'.format(
-                    THIS_PATH, current_compute_number),
-                raise_exception=True)
 
-            # creating both compute's partitions in the system
-            # Notes:
-            # 1. The partitions to be create are hardcoded in the following
-            #    lines
-            bash.run_command(
-                'sudo te-img create -f qcow2 {0}/{1}-0.img {2}G'.format(
-                    libvirt_images_path, current_compute_number,
-                    compute_partition_a), raise_exception=True)
-            bash.run_command(
-                'sudo te-img create -f qcow2 {0}/{1}-1.img {2}G'.format(
-                    libvirt_images_path, current_compute_number,
-                    compute_partition_b), raise_exception=True)
+def provision_lab(nodes, backend, workers):
+    """Provision all the nodes from scratch
 
-            # modifying xml compute parameters
-            bash.run_command(
-                'sed -i -e "s,NAME,{0}," '
-                '-e "s,UNIT,MiB," '
-                '-e "s,MEMORY,{1}," '
-                '-e "s,CORES,{2}," '
-                '-e "s,destroy,restart," '
-                '-e "s,DISK0,{3}/{0}-0.img," '
-                '-e "s,DISK1,{3}/{0}-1.img," '
-                '{4}/vms/{0}.xml'.format(
-                    current_compute_number, compute_memory,
-                    compute_system_cores, libvirt_images_path, THIS_PATH),
-                raise_exception=True)
+    The previous domains and disks of the nodes are deleted and the nodes are
+    provisioned in parallel (see the scheduler module), the controller-0 is
+    started once every node was defined.
 
-            # creating the computes according to the XML
-            # the following command create a domain but it does not start it
-            # and makes it non-persistent
-            # bash.run_command('sudo virsh create vms/{}.xml'.format(
-            #     current_compute_number))
-
-            # creating the computes according to the XML
-            # the following command create a domain but it does not start it
-            # and makes it persistent even after shutdown
-            bash.run_command('sudo virsh define {0}/vms/{1}.xml'.format(
-                THIS_PATH, current_compute_number))
-
-        # creating the controller according the XML
-        # the following command create a domain but it does not start it and
-        # and makes it non-persistent
-        # bash.run_command('sudo virsh create vms/{}.xml'.format(
-        #   current_controller_name))
-
-        # the following command define a domain and it does not start it
-        # and makes it persistent even after shutdown
-        bash.run_command('sudo virsh define {0}/vms/{1}.xml'.format(
-            THIS_PATH, current_controller_name))
-
-        # starting only the controller-0 which is the one with ISO in the xml
-        start_controller = False if configuration else True
-        if start_controller:
-            # the following command start a domain
-            bash.run_command('sudo virsh start {}'.format(
-                current_controller_name), raise_exception=True)
-
-    # opening the graphical interface
+    :param nodes: the list of topology.NodeSpec objects
+    :param backend: the hypervisor backend (see backends module)
+    :param workers: the maximum number of provisioning tasks to run at the
+        same time.
+    :return: the dictionary returned by scheduler.Scheduler.run
+    """
+    vms_path = os.path.join(THIS_PATH, 'vms')
+    if os.path.exists(vms_path):
+        rmtree(vms_path)
+
+    os.mkdir(vms_path)
+
+    # ------------------------------------------------------
+    # building the provisioning graph from the yaml file
+    # ------------------------------------------------------
+    provisioning = scheduler.Scheduler(workers=workers)
+    rendered = {}
+
+    for node in nodes:
+        add_node_tasks(provisioning, backend, node, rendered)
+
+    # starting only the controller-0 which is the one with ISO in the xml,
+    # it is started when all the nodes were defined (successfully or not)
+    provisioning.add(
+        'controller-0:start', 'controller-0',
+        functools.partial(backend.start, 'controller-0'),
+        depends=['controller-0:define'],
+        after=['{}:define'.format(node.name) for node in nodes
+               if node.name != 'controller-0'])
+
+    LOG.info('provisioning {0} nodes ({1} workers, {2} backend)'.format(
+        len(nodes), workers, backend.name))
+    nodes_tasks = provisioning.run()
+
+    # recording the xml of the nodes defined for the reconcile mode
+    state = {}
+    for node in nodes:
+        if provisioning.tasks['{}:define'.format(node.name)].status == (
+                scheduler.DONE):
+            reconcile.record(state, node, rendered[node.name])
+    reconcile.save_state(os.path.join(vms_path, reconcile.STATE_FILE), state)
+
+    return nodes_tasks
+
+
+def reconcile_lab(nodes, backend, workers, general=None, snapshot=None):
+    """Reconcile the existing nodes with the yaml file
+
+    Only the actions needed to make the lab match the yaml file are applied
+    (see the reconcile module), the plan is printed before applying it. The
+    nodes the plan creates are checked against the free resources of the
+    host (see check_disk_memory_size_system_cores) before applying it.
+
+    :param nodes: the list of topology.NodeSpec objects
+    :param backend: the hypervisor backend (see backends module)
+    :param workers: the maximum number of actions to apply at the same time
+    :param general: the general_system_configurations of the yaml file
+    :param snapshot: the Utils.host.HostSnapshot of the host, if not set a new
+        snapshot is taken.
+    :return: the dictionary returned by scheduler.Scheduler.run, it is empty
+        if the lab was up to date
+    """
+    vms_path = os.path.join(THIS_PATH, 'vms')
+    if not os.path.exists(vms_path):
+        os.mkdir(vms_path)
+
+    state_path = os.path.join(vms_path, reconcile.STATE_FILE)
+    state = reconcile.load_state(state_path)
+    rendered = {}
+    for node in nodes:
+        render_xml(node, rendered)
+
+    actions = reconcile.plan(nodes, rendered, backend, state)
+    reconcile.print_plan(actions)
+    if not actions:
+        return {}
+
+    # the existing nodes already use their resources (they are not free in
+    # the host), only the new ones need to fit in what is left
+    created = set(action.node for action in actions
+                  if action.kind == reconcile.CREATE)
+    if created:
+        check_disk_memory_size_system_cores(topology.Topology(
+            [node for node in nodes if node.name in created], general),
+            snapshot)
+
+    LOG.info('reconciling {0} nodes ({1} workers, {2} backend)'.format(
+        len(nodes), workers, backend.name))
+    return reconcile.apply_plan(actions, nodes, rendered, backend, state,
+                                state_path, workers=workers)
+
+
+def open_virt_manager():
+    """Open the Virtual Machine Manager in the controller-0 console"""
     if bash.is_process_running('virt-manager'):
         # in order that virt-manager takes the new configurations from the
         # yaml file, is needed to kill it and start again.
@@ -535,10 +450,70 @@ def setup_controller_computes(iso_file, configurations):
     # opening the controller console
     bash.run_command('virt-manager -c te:///system --show-domain-console '
                      'controller-0', raise_exception=True)
+
+
+@tracing.traced()
+def setup_controller_computes(lab, workers=scheduler.DEFAULT_WORKERS,
+                              backend=None, reconcile_mode=False,
+                              snapshot=None):
+    """Setup the controller/computes nodes
+
+    :param lab: which is the topology.Topology object loaded from the yaml
+        file.
+    :param workers: the maximum number of provisioning tasks to run at the
+        same time.
+    :param backend: the hypervisor backend (see backends module), if not set
+        the libvirt backend is used when available (virsh otherwise).
+    :param reconcile_mode: if True only the changes between the existing lab
+        and the yaml file are applied (see reconcile_lab), otherwise the
+        whole lab is provisioned from scratch (see provision_lab).
+    :param snapshot: the Utils.host.HostSnapshot of the host, if not set a new
+        snapshot is taken when the resources of the new nodes are checked.
+    """
+    if backend is None:
+        backend = backends.get_backend('auto')
+
+    with tracing.span('configure_libvirt'):
+        configure_libvirt()
+
+    # ===================================
+    # configuring the network interfaces
+    # ===================================
+    if not reconcile_mode or not network.network_interfaces_exist():
+        with tracing.span('configure_network_interfaces'):
+            network.delete_network_interfaces()
+            network.configure_network_interfaces()
+
+    nodes = list(lab)
+
+    try:
+        if reconcile_mode:
+            with tracing.span('reconcile_lab', nodes=len(nodes),
+                              backend=backend.name):
+                nodes_tasks = reconcile_lab(nodes, backend, workers,
+                                            lab.general, snapshot)
+        else:
+            with tracing.span('provision_lab', nodes=len(nodes),
+                              backend=backend.name):
+                nodes_tasks = provision_lab(nodes, backend, workers)
+    finally:
+        backend.close()
+
+    failed_nodes = report_provisioning(nodes_tasks)
+
+    if failed_nodes:
+        LOG.error('the following nodes could not be provisioned: {}'.format(
+            ', '.join(failed_nodes)))
+        exit_dict_status(1)
+
+    # opening the graphical interface (if something changed)
+    if nodes_tasks:
+        open_virt_manager()
     exit_dict_status(0)
 
 
-def setup(iso_file, configuration_file):
+def setup(iso_file, configuration_file, workers=None, backend='auto',
+          reconcile_mode=False):
     """Setup StarlingX
 
     The aim of this function is to setup StarlingX in a smart way in order
@@ -546,6 +521,13 @@ def setup(iso_file, configuration_file):
 
     :param iso_file: the iso file to be configured in the controller(s).
     :param configuration_file: the yaml configuration file.
+    :param workers: the maximum number of provisioning tasks to run at the
+        same time, if not set the value of provisioning_workers from the
+        yaml file (or scheduler.DEFAULT_WORKERS) is used.
+    :param backend: the name of the hypervisor backend to be used (see
+        backends.get_backend).
+    :param reconcile_mode: if True only the differences between the existing
+        lab and the yaml file are applied.
     """
     # before to run anything, KVM needs to be checked it this is present in the
     # current host
@@ -554,11 +536,50 @@ def setup(iso_file, configuration_file):
     # check the host requirements
     check_preconditions()
 
-    # loading all the configurations from yaml file
-    configurations = yaml.load(open(configuration_file))
+    # loading the lab topology from yaml file
+    try:
+        lab = topology.load(configuration_file, iso_file=iso_file)
+    except topology.TopologyError as err:
+        LOG.error('{0}: {1}'.format(configuration_file, err))
+        exit_dict_status(1)
+
+    # the host is probed once for the resources check and the placement
+    snapshot = host.snapshot(
+        paths=[lab.general.get('default_mount_point', '/')])
+
+    # the resources of the existing lab are still in use when reconciling,
+    # only the nodes the plan creates are checked then (see reconcile_lab)
+    if not reconcile_mode:
+        check_disk_memory_size_system_cores(lab, snapshot)
+
+    # placing the nodes with cpu_pinning/hugepages in the host NUMA nodes,
+    # against the total capacity of the cells: the domains of the previous
+    # lab are still running (they are deleted or kept later) and their
+    # memory and hugepages would count as used otherwise
+    try:
+        placements = placement.place(
+            lab.nodes, snapshot,
+            reserved_cpus=int(lab.general.get('os_system_cores', 0)),
+            use_total_memory=True)
+    except placement.PlacementError as err:
+        LOG.error(err)
+        exit_dict_status(1)
+    for node in lab:
+        node.placement = placements.get(node.name)
+        if node.placement is not None:
+            LOG.info('{0}: placed in {1}'.format(node.name, node.placement))
+
+    # provisioning_workers will return the default value if the key does
+    # not exists
+    if not workers:
+        workers = int(lab.general.get(
+            'provisioning_workers', scheduler.DEFAULT_WORKERS))
 
     # setting the controller/computes nodes
-    setup_controller_computes(iso_file, configurations)
+    setup_controller_computes(lab, workers=workers,
+                              backend=backends.get_backend(backend),
+                              reconcile_mode=reconcile_mode,
+                              snapshot=snapshot)
 
 
 def arguments():
@@ -571,7 +592,7 @@ def arguments():
     parser = argparse.ArgumentParser(
         formatter_class=RawDescriptionHelpFormatter, description='''
 Program description:
-some description'',
+some description''',
         epilog='some epilog',
         usage='%(prog)s [options]')
     group_mandatory = parser.add_argument_group('mandatory arguments')
@@ -582,6 +603,20 @@ some description'',
         '-c', '--configuration', dest='configuration',
         help='the configuration file in yaml format. The default '
              'configuration file is setup.yml in this folder')
+    parser.add_argument(
+        '-j', '--jobs', dest='jobs', type=int,
+        help='the maximum number of provisioning tasks to run at the same '
+             'time (e.g. creating the partitions of several nodes)')
+    parser.add_argument(
+        '-b', '--backend', dest='backend', choices=backends.BACKENDS,
+        default='auto',
+        help='the hypervisor backend, auto uses the libvirt python bindings '
+             'if they are installed and falls back to virsh otherwise')
+    parser.add_argument(
+        '-r', '--reconcile', dest='reconcile', action='store_true',
+        help='instead of recreating the whole lab, print a plan with the '
+             'differences between the existing lab and the configuration '
+             'file and apply only those changes')
     args = parser.parse_args()
 
     # checks if the iso file given exists
@@ -599,7 +634,8 @@ some description'',
             configuration_file))
         exit_dict_status(1)
 
-    setup(args.iso, configuration_file)
+    setup(args.iso, configuration_file, workers=args.jobs,
+          backend=args.backend, reconcile_mode=args.reconcile)
 
 
 if __name__ == '__main__':
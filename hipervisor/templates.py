@@ -0,0 +1,185 @@
+"""Render the domain XML of the lab nodes from the XML templates.
+
+Each template (master_controller.xml, slave_controller.xml, compute.xml) is
+parsed only once and cached in memory (the cache is invalidated if the
+template is modified). The XML of each node is rendered in memory from its
+topology.NodeSpec by setting the values in the corresponding elements of the
+domain, so no textual substitution is done over the template and no process
+is spawned per node.
+
+The following elements of the template are set:
+- name: the name of the node.
+- memory/currentMemory: the memory of the node (in MiB).
+- vcpu: the number of cores of the node.
+- on_crash: the crash policy of the node.
+- devices/disk[@device='disk']/source: the disks of the node (in order).
+- devices/disk[@device='cdrom']/source: the ISO (if the node has one).
+- memoryBacking/hugepages: the hugepages size (if the node uses them).
+- numatune/cputune: the NUMA node and the pinned CPUs of the node (if it was
+    placed, see placement module).
+
+Example:
+
+xml = templates.render('/path/to/compute.xml', node)
+templates.write_file('/path/to/vms/{}.xml'.format(node.name), xml)
+"""
+
+import copy
+import os
+import tempfile
+import threading
+import xml.etree.ElementTree as ElementTree
+
+from hipervisor import placement
+
+# parsed templates: path -> (mtime, root element)
+_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
+MEMORY_UNIT = 'MiB'
+
+
+def load_template(path):
+    """Get the parsed template from the cache (parsing it if needed)
+
+    :param path: the path of the XML template
+    :return: the root element of the template, it must not be modified
+    """
+    mtime = os.path.getmtime(path)
+    with _CACHE_LOCK:
+        cached = _CACHE.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+    root = ElementTree.parse(path).getroot()
+    with _CACHE_LOCK:
+        _CACHE[path] = (mtime, root)
+    return root
+
+
+def clear_cache():
+    """Remove all the parsed templates from the cache"""
+    with _CACHE_LOCK:
+        _CACHE.clear()
+
+
+def _child(parent, tag):
+    """Get a child element creating it if it does not exist"""
+    element = parent.find(tag)
+    if element is None:
+        element = ElementTree.SubElement(parent, tag)
+    return element
+
+
+def _set_source(disk, path):
+    """Set the file of the source element of a disk"""
+    _child(disk, 'source').set('file', path)
+
+
+def render_element(template, node):
+    """Render the domain of a node as an element
+
+    :param template: the root element of the template (see load_template)
+    :param node: the topology.NodeSpec object of the node
+    :return: the root element of the domain XML
+    :raises ValueError: if the template does not fit the node
+    """
+    domain = copy.deepcopy(template)
+
+    _child(domain, 'name').text = node.name
+    for element in (_child(domain, 'memory'), domain.find('currentMemory')):
+        if element is not None:
+            element.text = str(node.memory)
+            element.set('unit', MEMORY_UNIT)
+    _child(domain, 'vcpu').text = str(node.cores)
+    _child(domain, 'on_crash').text = node.on_crash
+
+    devices = _child(domain, 'devices')
+    disks = devices.findall("disk[@device='disk']")
+    if len(disks) < len(node.disks):
+        raise ValueError(
+            '{0}: the template has {1} disk(s) but the node needs {2}'.format(
+                node.name, len(disks), len(node.disks)))
+    for element, disk in zip(disks, node.disks):
+        _set_source(element, disk.path)
+
+    cdrom = devices.find("disk[@device='cdrom']")
+    if node.iso:
+        if cdrom is None:
+            raise ValueError('{}: the template does not have a cdrom'.format(
+                node.name))
+        _set_source(cdrom, node.iso)
+
+    _render_placement(domain, node)
+
+    return domain
+
+
+def _replace(domain, tag):
+    """Replace an element of the domain with an empty one"""
+    element = domain.find(tag)
+    if element is not None:
+        domain.remove(element)
+    return ElementTree.SubElement(domain, tag)
+
+
+def _render_placement(domain, node):
+    """Render the hugepages, NUMA and CPU pinning elements of a node"""
+    if node.hugepages:
+        hugepages = ElementTree.SubElement(
+            _replace(domain, 'memoryBacking'), 'hugepages')
+        ElementTree.SubElement(hugepages, 'page', {
+            'size': str(node.hugepages), 'unit': 'KiB'})
+
+    if node.placement is None:
+        return
+
+    numatune = _replace(domain, 'numatune')
+    ElementTree.SubElement(numatune, 'memory', {
+        'mode': 'strict', 'nodeset': str(node.placement.cell)})
+
+    if not node.placement.cpus:
+        return
+
+    vcpu = domain.find('vcpu')
+    vcpu.set('placement', 'static')
+    vcpu.set('cpuset', placement.cpu_set(node.placement.cpus))
+    cputune = _replace(domain, 'cputune')
+    for number, cpu in enumerate(node.placement.cpus):
+        ElementTree.SubElement(cputune, 'vcpupin', {
+            'vcpu': str(number), 'cpuset': str(cpu)})
+    ElementTree.SubElement(cputune, 'emulatorpin', {
+        'cpuset': placement.cpu_set(node.placement.emulator_cpus)})
+
+
+def render(template_path, node):
+    """Render the domain XML of a node
+
+    :param template_path: the path of the XML template
+    :param node: the topology.NodeSpec object of the node
+    :return: the domain XML as an string
+    """
+    domain = render_element(load_template(template_path), node)
+    xml = ElementTree.tostring(domain)
+    return xml.decode('utf-8') if isinstance(xml, bytes) else xml
+
+
+def write_file(path, content):
+    """Write a file (e.g. a rendered XML) atomically
+
+    The content is written to a temporary file in the same directory which is
+    renamed to its final name, so a partially written file is never seen.
+
+    :param path: the path of the file
+    :param content: the content of the file as an string
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    file_descriptor, temporary = tempfile.mkstemp(
+        dir=directory, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'w') as output_file:
+            output_file.write(content)
+        os.rename(temporary, path)
+    except Exception:
+        os.remove(temporary)
+        raise
@@ -0,0 +1,324 @@
+"""Model of the lab topology (controllers/computes) to be provisioned.
+
+The yaml file is parsed once into a Topology object, which contains one
+NodeSpec object per node of the lab (the typed specification consumed by the
+resource checks and the provisioning steps) and the totals of the resources
+needed by the lab. The yaml file is validated while it is loaded, so the
+rest of the code does not need to check the values again.
+
+Example:
+
+from hipervisor import topology
+lab = topology.load('setup.yml', iso_file='/path/to/file.iso')
+print(lab.memory, lab.cores)
+for node in lab:
+    print(node.name)
+"""
+
+import os
+import re
+
+from Utils import yaml_loader
+
+# the folder where the disk images of the nodes are stored
+LIBVIRT_IMAGES_PATH = '/var/lib/libvirt/images'
+
+# the default hugepage size in KiB (used when hugepages is set to true)
+DEFAULT_HUGEPAGE_SIZE = 2048
+
+CONFIGURATION = re.compile(r'^configuration_(\d+)$')
+
+# loaded topologies: path -> (key, Topology)
+_CACHE = {}
+
+
+class Disk(object):
+    """A disk (partition) of a node
+
+    :param path: the path of the disk image in the host
+    :param size: the size of the disk in gigabytes
+    :param strategy: how the disk is created, fresh or overlay (see disks
+        module)
+    :param backing: the backing image of the disk (only for overlay)
+    :param preallocation: the preallocation mode of the image, the valid
+        options are: off, metadata and falloc
+    :param reuse: if True an existing image that matches the specification
+        of the disk is kept instead of being recreated
+    """
+
+    __slots__ = ('path', 'size', 'strategy', 'backing', 'preallocation',
+                 'reuse')
+
+    def __init__(self, path, size, strategy='fresh', backing=None,
+                 preallocation='off', reuse=False):
+        # yaml loads an unquoted off as False
+        if preallocation is None or preallocation is False:
+            preallocation = 'off'
+        preallocation = str(preallocation)
+        if strategy not in ('fresh', 'overlay'):
+            raise ValueError('{0}: invalid disk strategy: {1}'.format(
+                path, strategy))
+        if strategy == 'overlay' and not backing:
+            raise ValueError('{}: overlay disks need a backing image'.format(
+                path))
+        if preallocation not in ('off', 'metadata', 'falloc'):
+            raise ValueError('{0}: invalid preallocation mode: {1}'.format(
+                path, preallocation))
+        self.path = path
+        self.size = int(size)
+        self.strategy = strategy
+        self.backing = backing if strategy == 'overlay' else None
+        self.preallocation = preallocation
+        self.reuse = bool(reuse)
+
+    def __repr__(self):
+        return 'Disk({0!r}, {1}, {2!r})'.format(
+            self.path, self.size, self.strategy)
+
+
+class NodeSpec(object):
+    """The specification of a node (domain) of the lab
+
+    :param name: the name of the domain (e.g. controller-0)
+    :param memory: the memory of the domain in MiB
+    :param cores: the number of virtual CPUs of the domain
+    :param disks: a list of Disk objects, in the order they are attached
+    :param template: the name of the XML template of the domain
+    :param iso: the ISO file to boot from (only for the nodes that boot from
+        it, e.g. controller-0)
+    :param on_crash: the action libvirt performs when the domain crashes
+    :param pinning: if True the vCPUs of the domain are pinned to dedicated
+        host CPUs (see placement module)
+    :param hugepages: the size in KiB of the hugepages that back the memory
+        of the domain, None to not use hugepages
+    """
+
+    __slots__ = ('name', 'memory', 'cores', 'disks', 'template', 'iso',
+                 'on_crash', 'pinning', 'hugepages', 'placement')
+
+    def __init__(self, name, memory, cores, disks, template, iso=None,
+                 on_crash='restart', pinning=False, hugepages=None):
+        self.name = name
+        self.memory = int(memory)
+        self.cores = int(cores)
+        self.disks = list(disks)
+        self.template = template
+        self.iso = iso
+        self.on_crash = on_crash
+        self.pinning = bool(pinning)
+        self.hugepages = int(hugepages) if hugepages else None
+        # the placement.Placement in the host NUMA nodes (if any)
+        self.placement = None
+
+    def __repr__(self):
+        return 'NodeSpec({!r})'.format(self.name)
+
+
+class TopologyError(ValueError):
+    """The topology defined in the yaml file is not valid"""
+
+
+class Topology(object):
+    """The nodes of a lab and the totals of the resources they need
+
+    :param nodes: the list of NodeSpec objects, the controllers are listed
+        before their computes
+    :param general: the general_system_configurations of the yaml file
+    """
+
+    __slots__ = ('nodes', 'general', 'memory', 'disk', 'cores', '_by_name')
+
+    def __init__(self, nodes, general=None):
+        self.nodes = tuple(nodes)
+        self.general = general or {}
+        self._by_name = dict((node.name, node) for node in self.nodes)
+        # totals of the resources needed by the lab (MiB, GB and cores)
+        self.memory = sum(node.memory for node in self.nodes)
+        self.disk = sum(
+            disk.size for node in self.nodes for disk in node.disks)
+        self.cores = sum(node.cores for node in self.nodes)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def node(self, name):
+        """Get a node by name
+
+        :param name: the name of the node
+        :return: the NodeSpec object or None if the node does not exist
+        """
+        return self._by_name.get(name)
+
+
+def _numbered_keys(mapping, regex):
+    """Get the keys of a mapping that match a regex sorted by their number
+
+    :param mapping: the dictionary to be filtered
+    :param regex: a compiled regex with one group that matches the number
+    :return: a list of (number, key) tuples
+    """
+    keys = []
+    for key in mapping:
+        match = regex.match(str(key))
+        if match:
+            keys.append((int(match.group(1)), key))
+    return sorted(keys)
+
+
+def _integer(values, key, node):
+    """Get a required integer value of a node
+
+    :raises TopologyError: if the value does not exist or is not an integer
+    """
+    value = values.get(key)
+    if value is None:
+        raise TopologyError('{0}: {1} is required'.format(node, key))
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise TopologyError('{0}: {1} must be an integer (got {2!r})'.format(
+            node, key, value))
+
+
+def _node(name, prefix, values, general, template, images_path, iso=None):
+    """Build the NodeSpec of a node from its yaml values
+
+    :param name: the name of the node (e.g. controller-0-compute-1)
+    :param prefix: the prefix of the node keys (e.g. controller_0_compute_1)
+    :param values: the dictionary of the node from the yaml file
+    :param general: the general_system_configurations of the yaml file, the
+        default values of the optional keys are taken from it
+    :param template: the name of the XML template of the node
+    :param images_path: the folder where the disk images are stored
+    :param iso: the ISO file to boot from (if any)
+    :return: the NodeSpec object
+    :raises TopologyError: if the values of the node are not valid
+    """
+    if not isinstance(values, dict):
+        raise TopologyError('{}: must be a dictionary'.format(name))
+
+    def option(key, default=None):
+        return values.get('{0}_{1}'.format(prefix, key),
+                          general.get(key, default))
+
+    memory = _integer(values, '{}_memory_size'.format(prefix), name)
+    cores = _integer(values, '{}_system_cores'.format(prefix), name)
+    # checking if the node at least has 1 cpu assigned in order to avoid the
+    # following error:
+    # error: XML error: Invalid CPU topology
+    if cores < 1:
+        raise TopologyError('{}: must have assigned at least 1 core'.format(
+            name))
+    if memory < 1:
+        raise TopologyError('{}: must have assigned some memory'.format(name))
+
+    try:
+        disks = [
+            Disk('{0}/{1}-{2}.img'.format(images_path, name, number),
+                 _integer(values, '{0}_partition_{1}'.format(
+                     prefix, partition), name),
+                 strategy=option('disk_strategy', 'fresh'),
+                 backing=option('backing_image_{}'.format(partition)),
+                 preallocation=option('preallocation', 'off'),
+                 reuse=option('reuse_disks', False))
+            for number, partition in enumerate('ab')]
+    except TopologyError:
+        raise
+    except ValueError as err:
+        raise TopologyError('{0}: {1}'.format(name, err))
+
+    # hugepages can be set to true to use the default page size
+    hugepages = option('hugepages')
+    if hugepages is True:
+        hugepages = DEFAULT_HUGEPAGE_SIZE
+    try:
+        hugepages = int(hugepages) if hugepages else None
+    except (TypeError, ValueError):
+        raise TopologyError('{0}: invalid hugepages size: {1!r}'.format(
+            name, hugepages))
+
+    return NodeSpec(name, memory=memory, cores=cores, disks=disks,
+                    template=template, iso=iso,
+                    pinning=option('cpu_pinning', False),
+                    hugepages=hugepages)
+
+
+def from_configurations(configurations, iso_file=None,
+                        images_path=LIBVIRT_IMAGES_PATH):
+    """Build the topology of a lab from the yaml configurations
+
+    The yaml file has one configuration_N key per controller, every
+    configuration has the controller-N key for the controller and one
+    controller-N-compute-M key per compute of the controller.
+
+    :param configurations: the dictionary loaded from the yaml file
+    :param iso_file: the ISO file to boot the controller-0 from
+    :param images_path: the folder where the disk images are stored
+    :return: the Topology object
+    :raises TopologyError: if the configurations are not valid
+    """
+    if not isinstance(configurations, dict):
+        raise TopologyError('the configuration file must be a dictionary')
+
+    general = configurations.get('general_system_configurations') or {}
+    nodes = []
+
+    for controller, key in _numbered_keys(configurations, CONFIGURATION):
+        configuration = configurations[key]
+        if not isinstance(configuration, dict):
+            raise TopologyError('{}: must be a dictionary'.format(key))
+        name = 'controller-{}'.format(controller)
+        if name not in configuration:
+            raise TopologyError('{0}: {1} is required'.format(key, name))
+
+        # Only controller-0 needs to have the ISO file in order to boot the
+        # subsequent controllers
+        nodes.append(_node(
+            name, 'controller_{}'.format(controller), configuration[name],
+            general,
+            'slave_controller.xml' if controller else 'master_controller.xml',
+            images_path, iso=None if controller else iso_file))
+
+        computes = re.compile(r'^controller-{}-compute-(\d+)$'.format(
+            controller))
+        for compute, compute_key in _numbered_keys(configuration, computes):
+            nodes.append(_node(
+                compute_key, 'controller_{0}_compute_{1}'.format(
+                    controller, compute),
+                configuration[compute_key], general, 'compute.xml',
+                images_path))
+
+    if not nodes:
+        raise TopologyError('the configuration file does not define nodes')
+    if nodes[0].name != 'controller-0':
+        raise TopologyError('controller-0 is required')
+
+    return Topology(nodes, general)
+
+
+def load(path, iso_file=None, images_path=LIBVIRT_IMAGES_PATH):
+    """Load the topology of a lab from a yaml file
+
+    The topology is cached, the yaml file is only parsed again if it was
+    modified (its mtime or size changed). The parsed yaml is also cached on
+    disk (see Utils/yaml_loader) to be reused by the next runs.
+
+    :param path: the path of the yaml file
+    :param iso_file: the ISO file to boot the controller-0 from
+    :param images_path: the folder where the disk images are stored
+    :return: the Topology object
+    :raises TopologyError: if the yaml file is not valid
+    """
+    status = os.stat(path)
+    key = (status.st_mtime, status.st_size, iso_file, images_path)
+    cached = _CACHE.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    configurations = yaml_loader.load(path, disk_cache=True)
+    lab = from_configurations(configurations, iso_file, images_path)
+    _CACHE[path] = (key, lab)
+    return lab
@@ -1,6 +1,12 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-"""Runner for StarlingX test suite"""
+"""Runner for StarlingX test suite
+
+Every option of the runner only imports the modules it needs (e.g. robot is
+only imported to run a suite), so --help and --list-suites start fast; the
+suites are listed from the suite index (see Utils/suite_index.py) without
+parsing the suite tree.
+"""
 
 from __future__ import print_function
 
@@ -8,9 +14,8 @@ import argparse
 import getpass
 import os
 
-import robot
 import Utils.common as common
-from Libraries.common import update_config_ini
+import Utils.sharding as sharding
 
 # Global variables
 CURRENT_USER = getpass.getuser()
@@ -44,27 +49,94 @@ def get_args():
                        action='store_true', help='Run all available suites')
     group.add_argument('--run-suite', dest='run_suite_name',
                        help='Run the specified suite')
+    group.add_argument(
+        '--list-runs', dest='list_runs_suite', nargs='?', const='',
+        help=(
+            'List the past runs stored in the results directory (of the '
+            'specified suite, or all of them if no value is given).'))
     group_extras = parser.add_argument_group(
         'Execution Extras', 'Extra options to be used on the suite execution.')
     group_extras.add_argument(
-        '--include', dest='tags',
+        '--include', dest='tags', action='append',
         help=(
             'Executes only the test cases with specified tags.'
             'Tags and patterns can also be combined together with `AND`, `OR`,'
             'and `NOT` operators.'
             'Examples: --include foo --include bar* --include fooANDbar*'))
+    group_extras.add_argument(
+        '--config', dest='overrides', action='append', default=[],
+        metavar='SECTION:OPTION=VALUE',
+        help=(
+            'Override an option of Config/config.ini for this run (it can be '
+            'repeated), the STX_<SECTION>__<OPTION> environment variables '
+            'also override the options.'))
+    group_extras.add_argument(
+        '--processes', dest='processes', type=int, default=1,
+        help=(
+            'Run the suite in N parallel processes, the suite is split in '
+            'shards (see --shard-by) and their results are merged.'))
+    group_extras.add_argument(
+        '--shard-by', dest='shard_by', choices=sharding.SHARD_MODES,
+        default=sharding.SUITE,
+        help='Split the suite by sub-suite (default) or by test case.')
+    group_extras.add_argument(
+        '--print-schedule', dest='print_schedule', action='store_true',
+        help=(
+            'Show how the shards would be assigned to the processes and the '
+            'predicted wall time (from the durations of the past runs) '
+            'without running the suite.'))
+    group_results = parser.add_argument_group(
+        'Results Extras',
+        'Retention of the past runs, applied after each execution.')
+    group_results.add_argument(
+        '--keep-runs', dest='keep_runs', type=int,
+        help='Delete the oldest runs when there are more than N.')
+    group_results.add_argument(
+        '--keep-days', dest='keep_days', type=float,
+        help='Delete the runs older than N days.')
+    group_results.add_argument(
+        '--max-results-size', dest='max_results_size', type=float,
+        help='Delete the oldest runs when all the runs take more than N MB.')
+    group_results.add_argument(
+        '--uncompressed-runs', dest='uncompressed_runs', type=int,
+        help='Compress the runs older than the newest N runs (default: 5).')
+    group_list = parser.add_argument_group(
+        'Listing Extras', 'Extra options to be used with --list-suites.')
+    group_list.add_argument(
+        '--format', dest='output_format', choices=common.OUTPUT_FORMATS,
+        default=common.TEXT_FORMAT,
+        help='Output format of the list (json is one object per line).')
+    group_list.add_argument(
+        '--depth', dest='max_depth', type=int,
+        help='Deepest level of the tree to list (0 is the suite itself).')
+    group_list.add_argument(
+        '--name', dest='name',
+        help='List only the test cases whose name matches this glob.')
     return parser.parse_args()
 
 
-def list_suites_option(suite_to_list):
+def list_suites_option(suite_to_list, args=None):
     """Display the suite tree including test cases
 
         Args:
             suite_to_list: name of the suite to display on stdout
+            args: the parsed arguments with the listing filters (see
+                get_args)
     """
 
     # Get suite details
     suite = common.Suite(suite_to_list, MAIN_SUITE)
+    output_format = getattr(args, 'output_format', common.TEXT_FORMAT)
+    tags = getattr(args, 'tags', None)
+    options = dict(
+        output_format=output_format, tags=tags,
+        name=getattr(args, 'name', None),
+        max_depth=getattr(args, 'max_depth', None))
+
+    if output_format != common.TEXT_FORMAT:
+        common.list_suites(suite.node, **options)
+        return
+
     print(
         '''
 Suite is located at: {}
@@ -76,47 +148,168 @@ Suite is located at: {}
 === SUITE TREE ====
     '''.format(suite.path))
 
-    common.list_suites(suite.data, '')
+    common.list_suites(suite.node, '', **options)
+
+
+def list_runs_option(suite_name):
+    """Display the past runs from the index of the results directory
 
+    Args:
+        suite_name: name of the suite whose runs are listed, all the runs
+            are listed if it is empty
+    """
+    import Utils.results as results
+
+    results_dir = common.check_results_dir(SUITE_DIR)
+    results.update_index(results_dir)
+    results.print_runs(results.list_runs(results_dir, suite=suite_name))
 
-def run_suite_option(suite_name):
+
+def run_suite_option(suite_name, args):
     """Run Specified Test Suite and creates the results structure
 
+    The phases of the run (also the ones of the libraries and of the other
+    processes of the run) are traced, the trace is written to trace.json in
+    the output directory and summarized at the end (see Utils/tracing.py).
+
+    Args:
+        suite_name: name of the suite that will be executed
+        args: the parsed arguments (see get_args)
+    """
+    import Utils.tracing as tracing
+
+    with tracing.span('run_suite', suite=suite_name):
+        output_dir = _run_suite(suite_name, args, tracing)
+    if not output_dir:
+        return
+    # Merge the spans of this process with the ones of the other processes
+    events = tracing.collect(output_dir)
+    os.environ.pop(tracing.TRACE_DIR_VARIABLE, None)
+    tracing.export_chrome(os.path.join(output_dir, 'trace.json'), events)
+    tracing.print_summary(events)
+
+
+def _run_suite(suite_name, args, tracing):
+    """Run a test suite (see run_suite_option)
+
     Args:
         suite_name: name of the suite that will be executed
+        args: the parsed arguments (see get_args)
+        tracing: the Utils.tracing module
+    Returns:
+        output_dir: the directory of the results of the run, None if the
+                    suite did not run
     """
+    import robot
+    import Utils.durations as durations
+    import Utils.logger as logger
+    import Utils.results as results
+    from Config import config
 
+    # Parse the overrides of the configuration
+    try:
+        overrides = [config.parse_override(override)
+                     for override in args.overrides]
+    except ValueError as error:
+        print('ERROR: {}'.format(error))
+        return None
     # Get suite details
     suite = common.Suite(suite_name, MAIN_SUITE)
     # Create results directory if does not exist
     results_dir = common.check_results_dir(SUITE_DIR)
+    # Select the sub-suites with test cases that match the tags, using the
+    # tags of the suite index instead of parsing the whole suite
+    with tracing.span('select_suites') as current:
+        suites, selected = common.select_suites(suite.node, args.tags)
+        current.set('selected', selected)
+    if args.tags:
+        print('{0} test cases selected with tags: {1}'.format(
+            selected, ' | '.join(args.tags)))
+    else:
+        print('{} test cases selected'.format(selected))
+    if not selected:
+        return None
+    # Schedule the shards with the durations of the past runs
+    if args.processes > 1 or args.print_schedule:
+        with tracing.span('schedule', processes=args.processes):
+            plan = durations.schedule(
+                sharding.make_shards(suite.node, mode=args.shard_by,
+                                     tags=args.tags),
+                durations.update_from_results(results_dir), args.processes)
+        if args.print_schedule:
+            durations.print_schedule(plan)
+            return None
     # Create output directory to store execution results
     output_dir = common.create_output_dir(results_dir, suite.name)
+    # The retention of the other runs keeps this run until it finishes
+    run_lock = results.lock_run(output_dir)
     # Create a link pointing to the latest run
     common.link_latest_run(SUITE_DIR, output_dir)
-    # Updating config.ini LOG_PATH variable with output_dir
-    config_path = os.path.join(SUITE_DIR, 'Config', 'config.ini')
-    update_config_ini(config_ini=config_path, LOG_PATH=output_dir)
+    # All the logs of the run (also of the shards) have the same run id
+    os.environ[logger.RUN_ID_VARIABLE] = os.path.basename(output_dir)
+    # The other processes of the run write their spans in output_dir
+    os.environ[tracing.TRACE_DIR_VARIABLE] = output_dir
+    # Use a configuration snapshot for this run (LOG_PATH is output_dir),
+    # the libraries and the shards load it instead of config.ini
+    config.activate(config.build(
+        overrides=overrides + [('general', 'LOG_PATH', output_dir)]))
     # Select tags to be used, empty if not set to execute all
-    if ARGS.tags:
-        include_tags = ARGS.tags
-    else:
-        include_tags = ''
+    include_tags = args.tags or ''
     # Run sxt-test-suite using robot framework
-    robot.run(suite.path, outputdir=output_dir, debugfile=LOG_NAME,
-              variable='LOGS_DIR:{}'.format(output_dir), include=include_tags)
+    if args.processes > 1:
+        print('Running {0} shards in {1} processes (predicted time: {2}s)'
+              .format(len(plan.order), args.processes, int(plan.makespan)))
+        with tracing.span('run_shards', shards=len(plan.order)):
+            sharding.run_shards(suite.path, plan.order, output_dir,
+                                args.processes, debugfile=LOG_NAME,
+                                include=include_tags)
+    else:
+        # Only the selected sub-suites run, the suite keeps its hierarchy so
+        # the long names are the same ones of the durations history
+        options = {'suite': suites} if suites != [suite.name] else {}
+        with tracing.span('robot', suites=len(suites)):
+            robot.run(suite.path, outputdir=output_dir, debugfile=LOG_NAME,
+                      variable='LOGS_DIR:{}'.format(output_dir),
+                      include=include_tags, **options)
+    # Record the durations of this run for the next schedules
+    with tracing.span('update_durations'):
+        durations.update_from_results(results_dir)
+    results.unlock_run(run_lock)
+    # Index the run and compress/delete the old runs
+    with tracing.span('retention'):
+        deleted, compressed = results.apply_retention(
+            results_dir, results.Retention(
+                max_runs=args.keep_runs, max_age_days=args.keep_days,
+                max_size_mb=args.max_results_size,
+                uncompressed_runs=(results.DEFAULT_UNCOMPRESSED_RUNS
+                                   if args.uncompressed_runs is None
+                                   else args.uncompressed_runs)),
+            exclude=output_dir)
+    if deleted or compressed:
+        print('Results: {0} old runs compressed, {1} deleted'.format(
+            len(compressed), len(deleted)))
+    return output_dir
+
+
+def main(args):
+    """Dispatch the selected option to its command
+
+    Args:
+        args: the parsed arguments (see get_args)
+    """
+    if args.list_suite_name:
+        list_suites_option(args.list_suite_name, args)
+    elif args.list_runs_suite is not None:
+        list_runs_option(args.list_runs_suite)
+    elif args.run_all:
+        run_suite_option(os.path.basename(MAIN_SUITE), args)
+    elif args.run_suite_name:
+        run_suite_option(args.run_suite_name, args)
 
 
 if __name__ == '__main__':
     if CURRENT_USER == 'root':
         raise RuntimeError('DO NOT RUN AS ROOT')
     # Validate if script is called with at least one argument
-    # Get args variables
-    ARGS = get_args()
-    # Check options selected
-    if ARGS.list_suite_name:
-        list_suites_option(ARGS.list_suite_name)
-    elif ARGS.run_all:
-        run_suite_option(os.path.basename(MAIN_SUITE))
-    elif ARGS.run_suite_name:
-        run_suite_option(ARGS.run_suite_name)
+    # Get args variables and run the selected option
+    main(get_args())
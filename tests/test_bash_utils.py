@@ -0,0 +1,136 @@
+"""Tests of the command execution of Utils/bash_utils.py"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    # python 2
+    import mock
+
+from Utils import bash_utils as bash
+
+
+def process_exists(pid):
+    """Check if a process exists and it is not a zombie"""
+    try:
+        with open('/proc/{}/stat'.format(pid)) as stat:
+            return stat.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except (IOError, OSError):
+        return False
+
+
+class ShellSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(bash, 'PERSISTENT_SHELL', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(bash.close_sessions)
+        bash.close_sessions()
+
+    def test_exit_code_and_error(self):
+        result = bash.execute('echo out; echo err >&2; exit 3')
+        self.assertEqual(3, result.returncode)
+        self.assertEqual(b'out', result.output)
+        self.assertEqual(b'err', result.error)
+        self.assertEqual((0, b''), bash.run_command('true'))
+        self.assertEqual((1, b'missing'),
+                         bash.run_command('echo missing >&2; false'))
+
+    def test_syntax_error_does_not_break_the_session(self):
+        self.assertNotEqual(0, bash.execute('echo "unterminated').returncode)
+        self.assertEqual((0, b'ok'), bash.run_command('echo ok'))
+
+    def test_output_without_trailing_newline(self):
+        result = bash.execute('printf abc; printf def >&2')
+        self.assertEqual((0, b'abc', b'def'),
+                         (result.returncode, result.output, result.error))
+
+    def test_output_with_marker_text(self):
+        text = '__stx_shell_{}__0'.format('0' * 32)
+        result = bash.execute('echo {0}; echo {0} >&2; exit 2'.format(text))
+        self.assertEqual((2, text.encode('utf-8'), text.encode('utf-8')),
+                         (result.returncode, result.output, result.error))
+
+    def test_stdin_is_not_the_session(self):
+        # cat would read the next commands sent to the shell otherwise
+        self.assertEqual((0, b''), bash.run_command('cat'))
+        self.assertEqual((0, b'ok'), bash.run_command('echo ok'))
+
+    def test_stream(self):
+        lines = []
+        result = bash.execute('echo a; echo b', stream=lines.append)
+        self.assertEqual(['a', 'b'], lines)
+        self.assertEqual(b'a\nb', result.output)
+
+    def test_commands_do_not_leak_state(self):
+        results = bash.run_batch(['cd /; export STX_TEST_VARIABLE=1',
+                                  'pwd', 'echo "$STX_TEST_VARIABLE"'])
+        self.assertEqual([0, 0, 0], [result.returncode for result in results])
+        self.assertEqual(os.getcwd().encode('utf-8'), results[1].output)
+        self.assertEqual(b'', results[2].output)
+
+    def test_sessions_follow_the_process_context(self):
+        bash.execute('true')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory)
+        self.assertEqual(os.path.realpath(directory).encode('utf-8'),
+                         bash.execute('pwd -P').output)
+
+        with mock.patch.dict(os.environ, {'STX_TEST_VARIABLE': 'new'}):
+            self.assertEqual(b'new', bash.execute(
+                'echo "$STX_TEST_VARIABLE"').output)
+        self.assertEqual(b'', bash.execute(
+            'echo "$STX_TEST_VARIABLE"').output)
+
+    def test_shell_killed_between_commands(self):
+        bash.execute('true')
+        self.assertEqual(1, len(bash._SESSIONS))
+        session = bash._SESSIONS[0]
+        session.process.kill()
+        session.process.wait()
+        self.assertEqual((0, b'ok'), bash.run_command('echo ok'))
+        self.assertNotIn(session, bash._SESSIONS)
+
+    def test_shell_killed_by_the_command(self):
+        # $$ is the pid of the session shell, not of the subshell
+        results = bash.run_batch(['kill -9 $$', 'echo ok'])
+        self.assertNotEqual(0, results[0].returncode)
+        self.assertEqual((0, b'ok'),
+                         (results[1].returncode, results[1].output))
+
+    def test_stop_on_error(self):
+        results = bash.run_batch(['false', 'echo ok'], stop_on_error=True)
+        self.assertEqual(['false'], [result.command for result in results])
+
+
+class TimeoutTest(unittest.TestCase):
+
+    def test_finished_in_time(self):
+        self.assertEqual((0, b'ok'), bash.run_command('echo ok', timeout=10))
+        self.assertEqual((4, b''), bash.run_command('exit 4', timeout=10))
+
+    @unittest.skipIf(not bash.NEW_GROUP, 'python 2 only kills the shell')
+    def test_timeout_kills_the_process_group(self):
+        start = time.time()
+        result = bash.execute('sleep 30 & echo $!; sleep 30', timeout=0.5)
+        self.assertLess(time.time() - start, 10)
+        self.assertEqual(bash.TIMEOUT_CODE, result.returncode)
+        self.assertIn(b'timed out', result.error)
+
+        child = int(result.output)
+        deadline = time.time() + 5
+        while process_exists(child) and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(process_exists(child))
+
+
+if __name__ == '__main__':
+    unittest.main()
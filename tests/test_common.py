@@ -0,0 +1,67 @@
+"""Tests of Utils/common.py"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from Utils import common
+from Utils import suite_index
+
+
+class SelectSuitesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.suite = self.folder('Tests', [
+            self.folder('Setup', [
+                self.file('Boot', [('boot', ['sanity']),
+                                   ('reboot', ['slow'])]),
+                self.file('Login', [('login', ['sanity'])])]),
+            self.folder('Network', [
+                self.file('Ping', [('ping', ['slow'])]),
+                self.file('Dns', [('dns', ['sanity'])])], init=True),
+            self.file('Other', [('other', ['slow'])])])
+
+    def file(self, name, tests):
+        return suite_index.SuiteNode(
+            name, '{}.robot'.format(name),
+            [suite_index.TestEntry(test, tags) for test, tags in tests])
+
+    def folder(self, name, children, init=False):
+        path = os.path.join(self.directory, name)
+        os.mkdir(path)
+        if init:
+            open(os.path.join(path, '__init__.robot'), 'w').close()
+        return suite_index.SuiteNode(name, path, children=children)
+
+    def test_all_tests(self):
+        self.assertEqual((['Tests'], 6),
+                         common.select_suites(self.suite, []))
+
+    def test_long_names_keep_the_hierarchy(self):
+        suites, selected = common.select_suites(self.suite, ['sanity'])
+        self.assertEqual(3, selected)
+        # Network has an __init__ file, so it is selected as a whole
+        self.assertEqual(['Tests.Setup.Boot', 'Tests.Setup.Login',
+                          'Tests.Network'], suites)
+
+    def test_folder_where_all_the_tests_match(self):
+        suites, selected = common.select_suites(self.suite, ['slow'])
+        self.assertEqual(3, selected)
+        self.assertEqual(['Tests.Setup.Boot', 'Tests.Network',
+                          'Tests.Other'], suites)
+
+    def test_names_are_relative_to_the_suite(self):
+        setup = self.suite.children[0]
+        self.assertEqual((['Setup.Boot', 'Setup.Login'], 2),
+                         common.select_suites(setup, ['sanity']))
+
+    def test_nothing_selected(self):
+        self.assertEqual(([], 0), common.select_suites(self.suite,
+                                                       ['missing']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+"""Tests of Config/config.py"""
+
+import configparser
+import os
+import shutil
+import tempfile
+import unittest
+
+from Config import config
+
+
+class InterpolationTest(unittest.TestCase):
+
+    def snapshot(self, raw):
+        return config.Snapshot(raw)
+
+    def test_local_and_foreign_references(self):
+        snapshot = self.snapshot({
+            'Section1': {'country': 'mexico'},
+            'section2': {'name': 'John', 'lastname': 'Doe',
+                         'fullname': '%(name)s %(lastname)s',
+                         'country': '${Section1:country}',
+                         'percent': '100%%'}})
+        self.assertEqual('John Doe', snapshot.get('section2', 'fullname'))
+        self.assertEqual('mexico', snapshot.get('section2', 'country'))
+        self.assertEqual('100%', snapshot.get('section2', 'percent'))
+        self.assertEqual('%(name)s %(lastname)s',
+                         snapshot.get('section2', 'fullname', raw=True))
+
+    def test_transitive_references(self):
+        snapshot = self.snapshot({
+            'general': {'root': '/opt/stx', 'logs': '${root}/logs',
+                        'setup': '%(logs)s/setup'},
+            'installer': {'log': '${general:setup}/installer.log'}})
+        self.assertEqual('/opt/stx/logs/setup/installer.log',
+                         snapshot.get('installer', 'log'))
+
+    def test_variables(self):
+        snapshot = self.snapshot({'general': {'path': '%(root)s/x',
+                                              'root': '/a'}})
+        self.assertEqual('/b/x', snapshot.get('general', 'path',
+                                              variables={'root': '/b'}))
+        self.assertEqual('/a/x', snapshot.get('general', 'path'))
+
+    def test_cycle(self):
+        snapshot = self.snapshot({
+            'a': {'x': '${b:y}', 'ok': 'fine'},
+            'b': {'y': '${a:x}'}})
+        with self.assertRaises(config.InterpolationCycleError) as context:
+            snapshot.get('a', 'x')
+        self.assertIn('a:x -> b:y -> a:x', str(context.exception))
+        # the rest of the options can still be gotten
+        self.assertEqual('fine', snapshot.get('a', 'ok'))
+
+    def test_self_reference(self):
+        snapshot = self.snapshot({'a': {'x': '%(x)s'}})
+        self.assertRaises(config.InterpolationCycleError, snapshot.get,
+                          'a', 'x')
+
+    def test_missing_reference(self):
+        snapshot = self.snapshot({'a': {'x': '${b:missing}'}})
+        self.assertRaises(configparser.InterpolationMissingOptionError,
+                          snapshot.get, 'a', 'x')
+
+    def test_missing_option(self):
+        snapshot = self.snapshot({'a': {'x': '1'}})
+        self.assertRaises(configparser.NoOptionError, snapshot.get, 'a', 'y')
+        self.assertRaises(configparser.NoSectionError, snapshot.get, 'b', 'x')
+
+    def test_immutable(self):
+        snapshot = self.snapshot({'a': {'x': '1'}})
+        self.assertRaises(AttributeError, setattr, snapshot, '_raw', {})
+        copy = config.Snapshot.from_json(snapshot.to_json())
+        self.assertEqual(1, copy.getint('a', 'x'))
+
+
+class BuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'config.ini')
+        with open(self.path, 'w') as config_file:
+            config_file.write('[general]\nLOG_PATH = /var/log/stx\n'
+                              'SETUP_LOG = ${LOG_PATH}/setup.log\n')
+
+    def test_layers(self):
+        snapshot = config.build(self.path, environ={})
+        self.assertEqual('/var/log/stx/setup.log',
+                         snapshot.get('general', 'SETUP_LOG'))
+
+        snapshot = config.build(
+            self.path, environ={'STX_GENERAL__LOG_PATH': '/tmp/env'})
+        self.assertEqual('/tmp/env/setup.log',
+                         snapshot.get('general', 'SETUP_LOG'))
+
+        snapshot = config.build(
+            self.path, environ={'STX_GENERAL__LOG_PATH': '/tmp/env'},
+            overrides=[config.parse_override('general:LOG_PATH=/tmp/run')])
+        self.assertEqual('/tmp/run/setup.log',
+                         snapshot.get('general', 'SETUP_LOG'))
+
+    def test_invalid_override(self):
+        self.assertRaises(ValueError, config.parse_override, 'general=x')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+"""Tests of Utils/durations.py"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from Utils import durations
+from Utils import sharding
+
+OUTPUT = """<?xml version="1.0" encoding="UTF-8"?>
+<robot>
+<suite name="Tests">
+<suite name="Setup">
+<test name="Boot">
+<status status="PASS" starttime="20260101 10:00:00.000"
+ endtime="20260101 10:00:30.000"/>
+</test>
+<test name="Check v1.2 API">
+<status status="PASS" starttime="20260101 10:00:30.000"
+ endtime="20260101 10:00:35.000"/>
+</test>
+<status status="PASS" starttime="20260101 10:00:00.000"
+ endtime="20260101 10:00:40.000"/>
+</suite>
+<status status="PASS" starttime="20260101 10:00:00.000"
+ endtime="20260101 10:00:50.000"/>
+</suite>
+</robot>
+"""
+
+
+def history(known, parents=None):
+    if parents is None:
+        parents = dict((key, key.rpartition('.')[0] or None)
+                       for key in known)
+    return {'version': durations.HISTORY_VERSION, 'durations': dict(known),
+            'parents': parents, 'runs': []}
+
+
+class EstimateTest(unittest.TestCase):
+
+    def test_known(self):
+        self.assertEqual(30.0, durations.estimate(
+            'Tests.Setup', history({'Tests.Setup': 30.0})))
+
+    def test_sum_of_the_children(self):
+        known = history({'Tests.Setup.Boot': 10.0,
+                         'Tests.Setup.Login': 5.0,
+                         'Tests.Setup.Network.Ping': 100.0,
+                         'Tests.Other.Boot': 7.0})
+        self.assertEqual(15.0, durations.estimate('Tests.Setup', known))
+
+    def test_names_with_dots(self):
+        known = history({'Tests.Setup.Boot': 10.0,
+                         'Tests.Setup.Check v1.2 API': 5.0},
+                        {'Tests.Setup.Boot': 'Tests.Setup',
+                         'Tests.Setup.Check v1.2 API': 'Tests.Setup'})
+        self.assertEqual(15.0, durations.estimate('Tests.Setup', known))
+        self.assertEqual(durations.DEFAULT_DURATION,
+                         durations.estimate('Tests.Setup.Check v1', known))
+
+    def test_unknown(self):
+        self.assertEqual(durations.DEFAULT_DURATION,
+                         durations.estimate('Tests.Setup', history({})))
+
+
+class ScheduleTest(unittest.TestCase):
+
+    def test_longest_processing_time_first(self):
+        shards = [sharding.Shard(index, name, sharding.SUITE)
+                  for index, name in enumerate('ABCDE', 1)]
+        known = history({'A': 10.0, 'B': 40.0, 'C': 30.0, 'D': 20.0,
+                         'E': 20.0})
+        plan = durations.schedule(shards, known, workers=2)
+
+        self.assertEqual(['B', 'C', 'D', 'E', 'A'],
+                         [shard.name for shard in plan.order])
+        self.assertEqual([['B', 'E'], ['C', 'D', 'A']],
+                         [[shard.name for shard in worker]
+                          for worker in plan.workers])
+        self.assertEqual(60.0, plan.makespan)
+
+    def test_more_workers_than_shards(self):
+        shards = [sharding.Shard(1, 'A', sharding.SUITE)]
+        plan = durations.schedule(shards, history({}), workers=4)
+        self.assertEqual(1, len(plan.workers))
+        self.assertEqual(durations.DEFAULT_DURATION, plan.makespan)
+
+
+class HistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.results = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.results)
+
+    def add_run(self, name):
+        os.mkdir(os.path.join(self.results, name))
+        with open(os.path.join(self.results, name, 'output.xml'),
+                  'w') as output:
+            output.write(OUTPUT)
+
+    def test_update_from_results(self):
+        self.add_run('20260101100000_Tests')
+        known = durations.update_from_results(self.results)
+        self.assertEqual({'Tests': 50.0, 'Tests.Setup': 40.0,
+                          'Tests.Setup.Boot': 30.0,
+                          'Tests.Setup.Check v1.2 API': 5.0},
+                         known['durations'])
+        self.assertEqual('Tests.Setup',
+                         known['parents']['Tests.Setup.Check v1.2 API'])
+        self.assertIsNone(known['parents']['Tests'])
+        self.assertEqual(['20260101100000_Tests'], known['runs'])
+
+    def test_old_history_is_rebuilt(self):
+        self.add_run('20260101100000_Tests')
+        durations.save_history(
+            os.path.join(self.results, durations.HISTORY_FILE),
+            {'durations': {'Tests': 10.0},
+             'runs': ['20260101100000_Tests']})
+        known = durations.update_from_results(self.results)
+        self.assertEqual(50.0, known['durations']['Tests'])
+        self.assertEqual(35.0, durations.estimate('Tests.Setup', history(
+            {'Tests.Setup.Boot': 30.0, 'Tests.Setup.Check v1.2 API': 5.0},
+            known['parents'])))
+
+    def test_moving_average(self):
+        known = history({'Tests.Setup': 40.0})
+        durations.record(known, {'Tests.Setup': 20.0},
+                         {'Tests.Setup': 'Tests'})
+        self.assertEqual(30.0, known['durations']['Tests.Setup'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""Tests of hipervisor/placement.py"""
+
+import unittest
+
+from Utils import host
+from hipervisor import placement
+from hipervisor import topology
+
+
+class Snapshot(object):
+    """The NUMA nodes of a host (the part of host.HostSnapshot used)"""
+
+    def __init__(self, numa_nodes):
+        self.numa_nodes = numa_nodes
+
+
+def node(name, cores, memory, pinning=False, hugepages=None):
+    return topology.NodeSpec(name, memory=memory, cores=cores, disks=[],
+                             template='compute.xml', pinning=pinning,
+                             hugepages=hugepages)
+
+
+class PlaceTest(unittest.TestCase):
+
+    def setUp(self):
+        # the hugepages of the previous lab are still in use
+        self.snapshot = Snapshot([
+            host.NumaNode(cell, list(range(cell * 8, cell * 8 + 8)), 16384,
+                          2048, {2048: {'total': 4096, 'free': 0}})
+            for cell in range(2)])
+
+    def test_pinned_nodes_do_not_share_cpus(self):
+        placements = placement.place(
+            [node('controller-0', 4, 1024, pinning=True),
+             node('controller-0-compute-0', 6, 1024, pinning=True),
+             node('controller-0-compute-1', 2, 1024)],
+            self.snapshot, reserved_cpus=2, use_total_memory=True)
+
+        self.assertNotIn('controller-0-compute-1', placements)
+        cpus = [cpu for item in placements.values() for cpu in item.cpus]
+        self.assertEqual(len(cpus), len(set(cpus)))
+        self.assertFalse(set([0, 1]) & set(cpus))
+        # best fit: the biggest node fills the cell with reserved CPUs
+        compute = placements['controller-0-compute-0']
+        self.assertEqual(0, compute.cell)
+        self.assertEqual(list(range(2, 8)), compute.cpus)
+        self.assertEqual([0, 1], compute.emulator_cpus)
+        self.assertEqual(1, placements['controller-0'].cell)
+
+    def test_total_capacity(self):
+        nodes = [node('controller-0', 2, 8192, hugepages=2048)]
+        self.assertRaises(placement.PlacementError, placement.place, nodes,
+                          self.snapshot)
+        placements = placement.place(nodes, self.snapshot,
+                                     use_total_memory=True)
+        self.assertEqual(0, placements['controller-0'].cell)
+
+    def test_does_not_fit(self):
+        self.assertRaises(
+            placement.PlacementError, placement.place,
+            [node('controller-0', 12, 1024, pinning=True)], self.snapshot,
+            use_total_memory=True)
+
+    def test_cpu_set(self):
+        self.assertEqual('0-3,8,10-11', placement.cpu_set(
+            [3, 2, 1, 0, 8, 10, 11]))
+
+
+if __name__ == '__main__':
+    unittest.main()
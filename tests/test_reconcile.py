@@ -0,0 +1,207 @@
+"""Tests of hipervisor/reconcile.py with the fake backend"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    # python 2
+    import mock
+
+from hipervisor import backends
+from hipervisor import disks
+from hipervisor import reconcile
+from hipervisor import topology
+
+
+def domain_xml(name, memory=1024):
+    return '<domain><name>{0}</name><memory>{1}</memory></domain>'.format(
+        name, memory)
+
+
+def make_node(name, directory, size=10):
+    disk_list = [topology.Disk(os.path.join(directory, '{0}-{1}.img'.format(
+        name, number)), size) for number in range(2)]
+    return topology.NodeSpec(name, memory=1024, cores=1, disks=disk_list,
+                             template='compute.xml')
+
+
+class ReconcileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.state_path = os.path.join(self.directory, reconcile.STATE_FILE)
+        self.backend = backends.FakeBackend()
+        self.nodes = [make_node(name, self.directory) for name in (
+            'controller-0', 'controller-0-compute-0')]
+        self.rendered = dict((node.name, domain_xml(node.name))
+                             for node in self.nodes)
+
+        # the disk images exist and match their specification
+        self.images = {}
+        for name, function in (('image_info', self.image_info),
+                               ('create', self.create_image),
+                               ('resize', self.create_image),
+                               ('provision', self.create_image),
+                               ('delete', self.delete_image)):
+            patcher = mock.patch.object(disks, name, side_effect=function)
+            self.addCleanup(patcher.stop)
+            setattr(self, name, patcher.start())
+
+    def image_info(self, path):
+        size = self.images.get(path)
+        if size is None:
+            return None
+        return {'format': 'qcow2', 'virtual-size': size * disks.GIGABYTE,
+                'backing-filename': None}
+
+    def create_image(self, disk):
+        self.images[disk.path] = disk.size
+
+    def delete_image(self, path):
+        self.images.pop(path, None)
+
+    def reconcile(self):
+        state = reconcile.load_state(self.state_path)
+        actions = reconcile.plan(self.nodes, self.rendered, self.backend,
+                                 state)
+        nodes_tasks = reconcile.apply_plan(
+            actions, self.nodes, self.rendered, self.backend, state,
+            self.state_path, workers=2)
+        return actions, nodes_tasks
+
+    def kinds(self, actions):
+        return [(action.node, action.kind) for action in actions]
+
+    def test_create(self):
+        actions, nodes_tasks = self.reconcile()
+
+        self.assertEqual([('controller-0', reconcile.CREATE),
+                          ('controller-0-compute-0', reconcile.CREATE),
+                          ('controller-0', reconcile.START)],
+                         self.kinds(actions))
+        self.assertEqual(['controller-0', 'controller-0-compute-0'],
+                         self.backend.domains())
+        self.assertEqual(backends.RUNNING,
+                         self.backend.state('controller-0'))
+        self.assertEqual(backends.SHUT_OFF,
+                         self.backend.state('controller-0-compute-0'))
+        self.assertEqual(4, len(self.images))
+        state = reconcile.load_state(self.state_path)
+        self.assertEqual(reconcile.xml_hash(self.rendered['controller-0']),
+                         state['controller-0']['xml'])
+
+    def test_up_to_date(self):
+        self.reconcile()
+        calls = len(self.backend.calls)
+        actions, nodes_tasks = self.reconcile()
+
+        self.assertEqual([], actions)
+        self.assertEqual({}, nodes_tasks)
+        # only the state of the domains was queried
+        self.assertEqual(set(['domains', 'state']), set(
+            call[0] for call in self.backend.calls[calls:]))
+
+    def test_resize_stops_the_running_domain(self):
+        self.reconcile()
+        node = self.nodes[0]
+        node.disks[0].size = 20
+        actions, nodes_tasks = self.reconcile()
+
+        self.assertEqual([('controller-0', reconcile.STOP),
+                          ('controller-0', reconcile.RESIZE),
+                          ('controller-0', reconcile.START)],
+                         self.kinds(actions))
+        self.resize.assert_called_once_with(node.disks[0])
+        self.assertEqual(backends.RUNNING,
+                         self.backend.state('controller-0'))
+
+    def test_redefine_power_cycles_the_running_domain(self):
+        self.reconcile()
+        compute = 'controller-0-compute-0'
+        self.backend.start(compute)
+        self.rendered[compute] = domain_xml(compute, memory=2048)
+        calls = len(self.backend.calls)
+        actions, nodes_tasks = self.reconcile()
+
+        self.assertEqual([(compute, reconcile.STOP),
+                          (compute, reconcile.REDEFINE),
+                          (compute, reconcile.START)], self.kinds(actions))
+        self.assertEqual(['destroy', 'define', 'start'], [
+            operation for operation, domain in self.backend.calls[calls:]
+            if domain == compute and operation != 'state'])
+        self.assertEqual(backends.RUNNING, self.backend.state(compute))
+        self.assertEqual(self.rendered[compute],
+                         self.backend.defined[compute]['xml'])
+
+    def test_redefine_shut_off_domain(self):
+        self.reconcile()
+        compute = 'controller-0-compute-0'
+        self.rendered[compute] = domain_xml(compute, memory=2048)
+        actions, _ = self.reconcile()
+
+        self.assertEqual([(compute, reconcile.REDEFINE)], self.kinds(actions))
+        self.assertEqual(backends.SHUT_OFF, self.backend.state(compute))
+
+    def test_redefine_controller(self):
+        self.reconcile()
+        self.rendered['controller-0'] = domain_xml('controller-0', 2048)
+        actions, _ = self.reconcile()
+
+        self.assertEqual([('controller-0', reconcile.STOP),
+                          ('controller-0', reconcile.REDEFINE),
+                          ('controller-0', reconcile.START)],
+                         self.kinds(actions))
+        self.assertEqual(backends.RUNNING,
+                         self.backend.state('controller-0'))
+
+    def test_stopped_compute_is_started_again(self):
+        self.reconcile()
+        compute = self.nodes[1]
+        self.backend.start(compute.name)
+        compute.disks[1].size = 20
+        actions, _ = self.reconcile()
+
+        self.assertEqual([(compute.name, reconcile.STOP),
+                          (compute.name, reconcile.RESIZE),
+                          (compute.name, reconcile.START)],
+                         self.kinds(actions))
+        self.assertEqual(backends.RUNNING, self.backend.state(compute.name))
+
+    def test_delete(self):
+        self.reconcile()
+        compute = self.nodes.pop()
+        actions, nodes_tasks = self.reconcile()
+
+        self.assertEqual([(compute.name, reconcile.DELETE)],
+                         self.kinds(actions))
+        self.assertEqual(['controller-0'], self.backend.domains())
+        self.assertFalse(any(disk.path in self.images
+                             for disk in compute.disks))
+        self.assertNotIn(compute.name, reconcile.load_state(self.state_path))
+
+    def test_delete_paused_domain(self):
+        self.reconcile()
+        compute = self.nodes.pop()
+        self.backend.defined[compute.name]['state'] = backends.PAUSED
+        calls = len(self.backend.calls)
+        self.reconcile()
+
+        self.assertEqual(['destroy', 'undefine'], [
+            operation for operation, domain in self.backend.calls[calls:]
+            if domain == compute.name and operation != 'state'])
+        self.assertEqual(['controller-0'], self.backend.domains())
+
+    def test_unmanaged_domains_are_kept(self):
+        self.backend.define(domain_xml('other-vm'))
+        actions, _ = self.reconcile()
+        self.assertNotIn('other-vm', [action.node for action in actions])
+        self.assertIn('other-vm', self.backend.domains())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+"""Tests of Utils/results.py"""
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from Utils import results
+
+OUTPUT = """<?xml version="1.0" encoding="UTF-8"?>
+<robot>
+<suite name="Tests">
+<status status="FAIL" starttime="20260101 10:00:00.000"
+ endtime="20260101 10:01:00.000"/>
+</suite>
+<statistics>
+<total>
+<stat pass="3" fail="1" skip="0">All Tests</stat>
+</total>
+</statistics>
+</robot>
+"""
+
+
+class RetentionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.results = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.results)
+        self.now = datetime.datetime.now()
+
+    def add_run(self, days_ago, size=1024, suite='Tests'):
+        """Create a run directory started some days ago"""
+        name = '{0:%Y%m%d%H%M%S}_{1}'.format(
+            self.now - datetime.timedelta(days=days_ago), suite)
+        os.mkdir(os.path.join(self.results, name))
+        with open(os.path.join(self.results, name, 'output.xml'),
+                  'w') as output:
+            output.write(OUTPUT)
+        with open(os.path.join(self.results, name, 'log.html'), 'wb') as log:
+            log.write(os.urandom(size))
+        return name
+
+    def stored(self):
+        return sorted(os.listdir(self.results))
+
+    def test_index(self):
+        name = self.add_run(1)
+        entries = results.update_index(self.results)
+        self.assertEqual(3, entries[name]['passed'])
+        self.assertEqual(1, entries[name]['failed'])
+        self.assertEqual(60.0, entries[name]['elapsed'])
+        self.assertEqual(results.DIRECTORY, entries[name]['location'])
+
+    def test_max_runs(self):
+        runs = [self.add_run(days) for days in (3, 2, 1)]
+        deleted, compressed = results.apply_retention(
+            self.results, results.Retention(max_runs=2))
+
+        self.assertEqual([runs[0]], deleted)
+        self.assertEqual([], compressed)
+        self.assertEqual(sorted(runs[1:] + [results.INDEX_FILE]),
+                         self.stored())
+        entries, _ = results.load_index(self.results)
+        self.assertIsNone(entries[runs[0]]['location'])
+
+    def test_max_age(self):
+        old, new = self.add_run(40), self.add_run(1)
+        deleted, _ = results.apply_retention(
+            self.results, results.Retention(max_age_days=30))
+        self.assertEqual([old], deleted)
+        self.assertIn(new, self.stored())
+
+    def test_current_run_is_kept(self):
+        old, new = self.add_run(40), self.add_run(1)
+        deleted, _ = results.apply_retention(
+            self.results, results.Retention(max_runs=0),
+            exclude=os.path.join(self.results, old))
+        self.assertEqual([new], deleted)
+        self.assertIn(old, self.stored())
+
+    def test_compression(self):
+        runs = [self.add_run(days) for days in (3, 2, 1)]
+        deleted, compressed = results.apply_retention(
+            self.results, results.Retention(uncompressed_runs=1))
+
+        self.assertEqual([], deleted)
+        self.assertEqual(runs[:2][::-1], compressed)
+        entries, _ = results.load_index(self.results)
+        for name in runs[:2]:
+            location = entries[name]['location']
+            self.assertTrue(location.startswith(name + '.tar'))
+            self.assertIn(location, self.stored())
+            self.assertNotIn(name, self.stored())
+        self.assertIn(runs[2], self.stored())
+
+    def test_max_size_deletes_the_older_runs(self):
+        # the newest run fits, the middle one does not (so the oldest one is
+        # also deleted even if it is small)
+        oldest = self.add_run(3, size=1024)
+        middle = self.add_run(2, size=2 ** 20)
+        newest = self.add_run(1, size=1024)
+        deleted, _ = results.apply_retention(
+            self.results, results.Retention(max_size_mb=0.5,
+                                            uncompressed_runs=None))
+        self.assertEqual([middle, oldest], deleted)
+        self.assertIn(newest, self.stored())
+
+    def test_runs_being_executed_are_kept(self):
+        old = self.add_run(3)
+        running = self.add_run(2)
+        lock = results.lock_run(os.path.join(self.results, running))
+        self.addCleanup(lock.close)
+        os.remove(os.path.join(self.results, running, 'output.xml'))
+        new = self.add_run(1)
+        deleted, compressed = results.apply_retention(
+            self.results, results.Retention(max_runs=1, uncompressed_runs=0),
+            exclude=os.path.join(self.results, new))
+
+        self.assertEqual([old], deleted)
+        self.assertEqual([], compressed)
+        self.assertIn(running, self.stored())
+        entries, _ = results.load_index(self.results)
+        self.assertTrue(entries[running]['running'])
+        self.assertIsNone(entries[running]['passed'])
+
+        # the run finished, its entry is indexed again
+        with open(os.path.join(self.results, running, 'output.xml'),
+                  'w') as output:
+            output.write(OUTPUT)
+        results.unlock_run(lock)
+        entries = results.update_index(self.results)
+        self.assertFalse(entries[running]['running'])
+        self.assertEqual(3, entries[running]['passed'])
+        self.assertNotIn(results.LOCK_FILE, os.listdir(
+            os.path.join(self.results, running)))
+
+    def test_lock_released_when_the_process_dies(self):
+        name = self.add_run(1)
+        run_dir = os.path.join(self.results, name)
+        results.lock_run(run_dir).close()
+        self.assertTrue(os.path.exists(os.path.join(run_dir,
+                                                    results.LOCK_FILE)))
+        self.assertFalse(results.is_running(run_dir))
+
+    def test_complete_entries_are_not_indexed_again(self):
+        self.add_run(1)
+        results.update_index(self.results)
+        _, lines = results.load_index(self.results)
+        results.update_index(self.results)
+        self.assertEqual((1, 1), (lines, results.load_index(
+            self.results)[1]))
+
+    def test_list_runs(self):
+        self.add_run(2, suite='Setup')
+        name = self.add_run(1)
+        results.update_index(self.results)
+        self.assertEqual([name], [entry['run'] for entry in results.list_runs(
+            self.results, suite='tests')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""Tests of hipervisor/scheduler.py"""
+
+import threading
+import time
+import unittest
+
+from hipervisor import scheduler
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = scheduler.Scheduler(workers=4)
+        self.executed = []
+        self.lock = threading.Lock()
+
+    def action(self, name, error=None):
+        def run():
+            with self.lock:
+                self.executed.append(name)
+            if error is not None:
+                raise error
+        return run
+
+    def test_dependencies_run_first(self):
+        self.scheduler.add('a:disk', 'a', self.action('a:disk'))
+        self.scheduler.add('a:xml', 'a', self.action('a:xml'))
+        self.scheduler.add('a:define', 'a', self.action('a:define'),
+                           depends=['a:disk', 'a:xml'])
+        nodes = self.scheduler.run()
+
+        self.assertEqual('a:define', self.executed[-1])
+        self.assertEqual([scheduler.DONE] * 3,
+                         [task.status for task in nodes['a']])
+        self.assertEqual([], self.scheduler.failed_nodes())
+
+    def test_failure_skips_the_dependent_tasks(self):
+        self.scheduler.add('a:disk', 'a',
+                           self.action('a:disk', RuntimeError('no space')))
+        self.scheduler.add('a:define', 'a', self.action('a:define'),
+                           depends=['a:disk'])
+        self.scheduler.add('a:start', 'a', self.action('a:start'),
+                           depends=['a:define'])
+        self.scheduler.add('b:define', 'b', self.action('b:define'))
+        self.scheduler.run()
+
+        tasks = self.scheduler.tasks
+        self.assertEqual(scheduler.FAILED, tasks['a:disk'].status)
+        self.assertEqual('no space', str(tasks['a:disk'].error))
+        self.assertEqual(scheduler.SKIPPED, tasks['a:define'].status)
+        self.assertEqual(scheduler.SKIPPED, tasks['a:start'].status)
+        self.assertEqual(scheduler.DONE, tasks['b:define'].status)
+        self.assertEqual(['a:disk', 'b:define'], sorted(self.executed))
+        self.assertEqual(['a'], self.scheduler.failed_nodes())
+
+    def test_after_runs_even_if_the_task_failed(self):
+        self.scheduler.add('b:define', 'b',
+                           self.action('b:define', RuntimeError('broken')))
+        self.scheduler.add('a:define', 'a', self.action('a:define'))
+        self.scheduler.add('a:start', 'a', self.action('a:start'),
+                           depends=['a:define'], after=['b:define'])
+        self.scheduler.run()
+
+        self.assertEqual(scheduler.DONE,
+                         self.scheduler.tasks['a:start'].status)
+        self.assertEqual('a:start', self.executed[-1])
+
+    def test_depends_skips_if_the_task_failed(self):
+        self.scheduler.add('b:define', 'b',
+                           self.action('b:define', RuntimeError('broken')))
+        self.scheduler.add('a:start', 'a', self.action('a:start'),
+                           depends=['b:define'])
+        self.scheduler.run()
+
+        self.assertEqual(scheduler.SKIPPED,
+                         self.scheduler.tasks['a:start'].status)
+        self.assertNotIn('a:start', self.executed)
+
+    def test_system_exit_stops_the_scheduling(self):
+        self.scheduler.add('a:disk', 'a',
+                           self.action('a:disk', SystemExit(1)))
+        self.scheduler.add('a:define', 'a', self.action('a:define'),
+                           depends=['a:disk'])
+        self.scheduler.add('b:define', 'b', self.action('b:define'),
+                           after=['a:disk'])
+        with self.assertRaises(SystemExit) as context:
+            self.scheduler.run()
+
+        self.assertEqual(1, context.exception.code)
+        tasks = self.scheduler.tasks
+        self.assertEqual(scheduler.FAILED, tasks['a:disk'].status)
+        self.assertEqual(scheduler.SKIPPED, tasks['a:define'].status)
+        self.assertEqual(scheduler.SKIPPED, tasks['b:define'].status)
+        self.assertEqual(['a:disk'], self.executed)
+
+    def test_running_tasks_finish_before_the_exit(self):
+        def slow():
+            time.sleep(0.2)
+            self.action('a:disk')()
+
+        self.scheduler.add('a:disk', 'a', slow)
+        self.scheduler.add('b:disk', 'b', self.action('b:disk',
+                                                      KeyboardInterrupt()))
+        self.scheduler.add('a:define', 'a', self.action('a:define'),
+                           depends=['a:disk'])
+        self.assertRaises(KeyboardInterrupt, self.scheduler.run)
+
+        tasks = self.scheduler.tasks
+        self.assertEqual(scheduler.DONE, tasks['a:disk'].status)
+        self.assertEqual(scheduler.SKIPPED, tasks['a:define'].status)
+        self.assertEqual(['a:disk', 'b:disk'], sorted(self.executed))
+
+    def test_cycle(self):
+        self.scheduler.add('a', 'a', self.action('a'), depends=['c'])
+        self.scheduler.add('b', 'a', self.action('b'), depends=['a'])
+        self.scheduler.add('c', 'a', self.action('c'), after=['b'])
+        self.assertRaises(ValueError, self.scheduler.run)
+        self.assertEqual([], self.executed)
+
+    def test_unknown_dependency(self):
+        self.scheduler.add('a', 'a', self.action('a'), depends=['missing'])
+        self.assertRaises(ValueError, self.scheduler.run)
+
+    def test_duplicated_task(self):
+        self.scheduler.add('a', 'a', self.action('a'))
+        self.assertRaises(ValueError, self.scheduler.add, 'a', 'a',
+                          self.action('a'))
+
+    def test_workers(self):
+        self.assertRaises(ValueError, scheduler.Scheduler, workers=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+"""Tests of the provisioning flow of hipervisor/setup.py with the fake backend
+
+hipervisor/setup.py needs the host dependencies (kmodpy and the network
+modules), the tests are skipped when they are not installed.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    # python 2
+    import mock
+
+from hipervisor import backends
+from hipervisor import disks
+from hipervisor import reconcile
+from hipervisor import templates
+from hipervisor import topology
+
+try:
+    from hipervisor import setup
+except ImportError:
+    setup = None
+
+
+def render(template_path, node):
+    return '<domain><name>{0}</name><memory>{1}</memory></domain>'.format(
+        node.name, node.memory)
+
+
+@unittest.skipIf(setup is None, 'the dependencies of hipervisor/setup.py '
+                                'are not installed')
+class SetupControllerComputesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.backend = backends.FakeBackend()
+        self.lab = topology.Topology([
+            topology.NodeSpec(name, memory=1024, cores=1, disks=[
+                topology.Disk(os.path.join(self.directory, '{0}-{1}.img'
+                                           .format(name, number)), 10)
+                for number in range(2)], template='compute.xml')
+            for name in ('controller-0', 'controller-0-compute-0',
+                         'controller-0-compute-1')], {})
+
+        self.images = {}
+        self.failing = set()
+        for target, name, replacement in (
+                (setup, 'THIS_PATH', self.directory),
+                (setup, 'configure_libvirt', mock.DEFAULT),
+                (setup, 'network', mock.DEFAULT),
+                (setup, 'open_virt_manager', mock.DEFAULT),
+                (setup, 'check_disk_memory_size_system_cores',
+                 mock.DEFAULT),
+                (templates, 'render', mock.Mock(side_effect=render)),
+                (disks, 'provision',
+                 mock.Mock(side_effect=self.provision)),
+                (disks, 'image_info',
+                 mock.Mock(side_effect=self.image_info))):
+            patcher = mock.patch.object(target, name, replacement)
+            self.addCleanup(patcher.stop)
+            setattr(self, name, patcher.start())
+
+    def provision(self, disk):
+        if disk.path in self.failing:
+            raise RuntimeError('{}: no space left'.format(disk.path))
+        self.images[disk.path] = disk.size
+        return True
+
+    def image_info(self, path):
+        size = self.images.get(path)
+        if size is None:
+            return None
+        return {'format': 'qcow2', 'virtual-size': size * disks.GIGABYTE,
+                'backing-filename': None}
+
+    def run_setup(self, reconcile_mode=False):
+        with self.assertRaises(SystemExit) as context:
+            setup.setup_controller_computes(
+                self.lab, workers=2, backend=self.backend,
+                reconcile_mode=reconcile_mode)
+        return context.exception.code
+
+    def test_provision(self):
+        self.assertEqual(0, self.run_setup())
+
+        self.assertEqual([node.name for node in self.lab],
+                         self.backend.domains())
+        self.assertEqual(backends.RUNNING,
+                         self.backend.state('controller-0'))
+        self.assertEqual(backends.SHUT_OFF,
+                         self.backend.state('controller-0-compute-0'))
+        self.assertEqual(6, len(self.images))
+        self.network.configure_network_interfaces.assert_called_once_with()
+        self.open_virt_manager.assert_called_once_with()
+        state = reconcile.load_state(os.path.join(
+            self.directory, 'vms', reconcile.STATE_FILE))
+        self.assertEqual(sorted(node.name for node in self.lab),
+                         sorted(state))
+
+    def test_previous_domains_are_deleted(self):
+        self.backend.define(render(None, self.lab.nodes[0]))
+        self.backend.start('controller-0')
+        calls = len(self.backend.calls)
+        self.assertEqual(0, self.run_setup())
+
+        operations = [operation for operation, domain
+                      in self.backend.calls[calls:]
+                      if domain == 'controller-0']
+        self.assertLess(operations.index('destroy'),
+                        operations.index('undefine'))
+        self.assertLess(operations.index('undefine'),
+                        operations.index('define'))
+        self.assertEqual(backends.RUNNING,
+                         self.backend.state('controller-0'))
+
+    def test_failed_node(self):
+        broken = self.lab.nodes[1]
+        self.failing.add(broken.disks[0].path)
+        self.assertEqual(1, self.run_setup())
+
+        # the failure is isolated to its node, controller-0 is started
+        self.assertNotIn(broken.name, self.backend.domains())
+        self.assertIn('controller-0-compute-1', self.backend.domains())
+        self.assertEqual(backends.RUNNING,
+                         self.backend.state('controller-0'))
+
+    def test_reconcile_up_to_date(self):
+        self.assertEqual(0, self.run_setup())
+        self.open_virt_manager.reset_mock()
+        self.network.reset_mock()
+        self.network.network_interfaces_exist.return_value = True
+        calls = len(self.backend.calls)
+
+        self.assertEqual(0, self.run_setup(reconcile_mode=True))
+        self.assertEqual(set(['domains', 'state']), set(
+            operation for operation, _ in self.backend.calls[calls:]))
+        self.assertFalse(self.network.delete_network_interfaces.called)
+        self.assertFalse(self.open_virt_manager.called)
+        self.assertFalse(self.check_disk_memory_size_system_cores.called)
+
+    def test_reconcile_new_compute(self):
+        self.assertEqual(0, self.run_setup())
+        self.lab = topology.Topology(list(self.lab) + [topology.NodeSpec(
+            'controller-0-compute-2', memory=1024, cores=1, disks=[],
+            template='compute.xml')])
+
+        self.assertEqual(0, self.run_setup(reconcile_mode=True))
+        self.assertIn('controller-0-compute-2', self.backend.domains())
+        # only the new node is checked against the free resources
+        checked = self.check_disk_memory_size_system_cores.call_args[0][0]
+        self.assertEqual(['controller-0-compute-2'],
+                         [node.name for node in checked])
+        self.assertEqual(1, len([
+            operation for operation, domain in self.backend.calls
+            if operation == 'start' and domain == 'controller-0']))
+
+    def test_reconcile_new_compute_does_not_fit(self):
+        self.assertEqual(0, self.run_setup())
+        self.lab = topology.Topology(list(self.lab) + [topology.NodeSpec(
+            'controller-0-compute-2', memory=1024, cores=1, disks=[],
+            template='compute.xml')])
+        self.check_disk_memory_size_system_cores.side_effect = SystemExit(1)
+
+        self.assertEqual(1, self.run_setup(reconcile_mode=True))
+        self.assertNotIn('controller-0-compute-2', self.backend.domains())
+
+
+if __name__ == '__main__':
+    unittest.main()
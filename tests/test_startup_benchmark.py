@@ -0,0 +1,32 @@
+"""Tests of Utils/startup_benchmark.py"""
+
+import subprocess
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    # python 2
+    import mock
+
+from Utils import startup_benchmark
+
+
+class MeasureTest(unittest.TestCase):
+
+    @mock.patch.object(subprocess, 'call', return_value=0)
+    def test_measure(self, call):
+        result = startup_benchmark.measure(['--help'], runs=3)
+        self.assertEqual(3, call.call_count)
+        self.assertLessEqual(result['best'], result['median'])
+
+    @mock.patch.object(subprocess, 'call', return_value=1)
+    def test_failed_command(self, call):
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            startup_benchmark.measure(['--help'], runs=3)
+        self.assertEqual(1, context.exception.returncode)
+        self.assertEqual(1, call.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
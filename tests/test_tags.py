@@ -0,0 +1,65 @@
+"""Tests of Utils/tags.py"""
+
+import unittest
+
+from Utils import tags
+
+
+class TagPatternTest(unittest.TestCase):
+
+    def match(self, pattern, test_tags):
+        return tags.TagPattern(pattern).match(test_tags)
+
+    def test_ignores_case_spaces_and_underscores(self):
+        self.assertTrue(self.match('Smoke Test', ['smoke_test']))
+        self.assertTrue(self.match('smoke_test', ['SmokeTest']))
+        self.assertFalse(self.match('smoke', ['sanity']))
+
+    def test_wildcards(self):
+        self.assertTrue(self.match('controller*', ['controller-0']))
+        self.assertTrue(self.match('controller-?', ['controller-1']))
+        self.assertFalse(self.match('controller-?', ['controller-10']))
+
+    def test_and(self):
+        self.assertTrue(self.match('sanityANDcontroller*',
+                                   ['sanity', 'controller-0']))
+        self.assertTrue(self.match('sanity&controller*',
+                                   ['sanity', 'controller-0']))
+        self.assertFalse(self.match('sanityANDcontroller*', ['sanity']))
+
+    def test_or(self):
+        self.assertTrue(self.match('sanityORsmoke', ['smoke']))
+        self.assertFalse(self.match('sanityORsmoke', ['regression']))
+
+    def test_not(self):
+        self.assertTrue(self.match('sanityNOTslow', ['sanity']))
+        self.assertFalse(self.match('sanityNOTslow', ['sanity', 'slow']))
+        self.assertTrue(self.match('NOTslow', ['sanity']))
+        self.assertFalse(self.match('NOTslow', ['slow']))
+
+    def test_precedence(self):
+        # NOT is the lowest precedence, then OR, then AND
+        pattern = 'aANDbORcNOTd'
+        self.assertTrue(self.match(pattern, ['a', 'b']))
+        self.assertTrue(self.match(pattern, ['c']))
+        self.assertFalse(self.match(pattern, ['a']))
+        self.assertFalse(self.match(pattern, ['c', 'd']))
+
+
+class TagFilterTest(unittest.TestCase):
+
+    def test_empty_matches_everything(self):
+        tag_filter = tags.TagFilter([])
+        self.assertFalse(tag_filter)
+        self.assertTrue(tag_filter.match([]))
+
+    def test_any_pattern(self):
+        tag_filter = tags.TagFilter(['sanity', 'smokeNOTslow'])
+        self.assertTrue(tag_filter)
+        self.assertTrue(tag_filter.match(['sanity', 'slow']))
+        self.assertTrue(tag_filter.match(['smoke']))
+        self.assertFalse(tag_filter.match(['smoke', 'slow']))
+
+
+if __name__ == '__main__':
+    unittest.main()
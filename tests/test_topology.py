@@ -0,0 +1,69 @@
+"""Tests of hipervisor/topology.py"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from Utils import yaml_loader
+from hipervisor import topology
+
+LAB = """
+general_system_configurations:
+  preallocation: {preallocation}
+configuration_0:
+  controller-0:
+    controller_0_memory_size: 8192
+    controller_0_system_cores: 2
+    controller_0_partition_a: 200
+    controller_0_partition_b: 200
+  controller-0-compute-0:
+    controller_0_compute_0_memory_size: 4096
+    controller_0_compute_0_system_cores: 1
+    controller_0_compute_0_partition_a: 100
+    controller_0_compute_0_partition_b: 100
+"""
+
+
+class TopologyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        cache_dir = yaml_loader.CACHE_DIR
+        yaml_loader.CACHE_DIR = os.path.join(self.directory, 'cache')
+        self.addCleanup(setattr, yaml_loader, 'CACHE_DIR', cache_dir)
+
+    def load(self, preallocation):
+        path = os.path.join(self.directory, 'setup.yml')
+        with open(path, 'w') as yaml_file:
+            yaml_file.write(LAB.format(preallocation=preallocation))
+        return topology.load(path, images_path='/images')
+
+    def test_nodes(self):
+        lab = self.load('metadata')
+        self.assertEqual(['controller-0', 'controller-0-compute-0'],
+                         [node.name for node in lab])
+        controller = lab.nodes[0]
+        self.assertEqual(8192, controller.memory)
+        self.assertEqual(['/images/controller-0-0.img',
+                          '/images/controller-0-1.img'],
+                         [disk.path for disk in controller.disks])
+        self.assertEqual('metadata', controller.disks[0].preallocation)
+
+    def test_preallocation_off(self):
+        # yaml loads the unquoted off as False
+        lab = self.load('off')
+        self.assertEqual(set(['off']), set(
+            disk.preallocation for node in lab for disk in node.disks))
+
+    def test_invalid_preallocation(self):
+        self.assertRaises(topology.TopologyError, self.load, 'full')
+
+    def test_overlay_needs_backing_image(self):
+        self.assertRaises(ValueError, topology.Disk, '/images/a.img', 10,
+                          strategy='overlay')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""Tests of Utils/yaml_loader.py"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from Utils import yaml_loader
+
+
+class DiskCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        cache_dir = yaml_loader.CACHE_DIR
+        yaml_loader.CACHE_DIR = os.path.join(self.directory, 'cache')
+        self.addCleanup(setattr, yaml_loader, 'CACHE_DIR', cache_dir)
+        self.addCleanup(yaml_loader.clear_cache)
+        self.path = os.path.join(self.directory, 'setup.yml')
+
+    def write(self, content):
+        with open(self.path, 'w') as yaml_file:
+            yaml_file.write(content)
+
+    def cache_file(self):
+        return yaml_loader._cache_file(os.path.abspath(self.path))
+
+    def test_cached_as_json(self):
+        self.write('lab:\n  memory: 1024\n')
+        self.assertEqual({'lab': {'memory': 1024}},
+                         yaml_loader.load(self.path, disk_cache=True))
+        with open(self.cache_file()) as cache_file:
+            self.assertEqual({'lab': {'memory': 1024}},
+                             json.load(cache_file)['document'])
+
+        # another process reads the document from the disk cache
+        yaml_loader.clear_cache()
+        with open(self.cache_file()) as cache_file:
+            cached = json.load(cache_file)
+        cached['document'] = {'lab': {'memory': 2048}}
+        with open(self.cache_file(), 'w') as cache_file:
+            json.dump(cached, cache_file)
+        self.assertEqual({'lab': {'memory': 2048}},
+                         yaml_loader.load(self.path, disk_cache=True))
+
+    def test_outdated_cache(self):
+        self.write('memory: 1024\n')
+        yaml_loader.load(self.path, disk_cache=True)
+        yaml_loader.clear_cache()
+        self.write('memory: 40960\n')
+        self.assertEqual({'memory': 40960},
+                         yaml_loader.load(self.path, disk_cache=True))
+
+    def test_invalid_cache(self):
+        self.write('memory: 1024\n')
+        os.makedirs(yaml_loader.CACHE_DIR)
+        with open(self.cache_file(), 'w') as cache_file:
+            cache_file.write('not json')
+        self.assertEqual({'memory': 1024},
+                         yaml_loader.load(self.path, disk_cache=True))
+
+    def test_documents_changed_by_json_are_not_cached(self):
+        self.write('1: one\n')
+        self.assertEqual({1: 'one'},
+                         yaml_loader.load(self.path, disk_cache=True))
+        self.assertFalse(os.path.exists(self.cache_file()))
+
+
+if __name__ == '__main__':
+    unittest.main()